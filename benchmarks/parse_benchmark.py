@@ -0,0 +1,69 @@
+# Parses a large generated program, the way machine-generated models look:
+# a long chain of `let`s, with the occasional `discrete` over 4096 weights.
+# Reports the time and peak memory taken to go from text to IR, and fails if
+# either is over budget.
+#
+#   python benchmarks/parse_benchmark.py [num_lines]
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from main import make_parser  # noqa: E402
+
+
+NUM_LINES = 100_000
+# Every this many lines is a `discrete` with this many weights
+DISCRETE_EVERY = 1000
+NUM_WEIGHTS = 4096
+
+# For 100k lines (about 2.2M tokens). A single core of a cloud VM takes
+# about 31s and 154 MiB.
+TIME_BUDGET = 45.0  # seconds
+MEMORY_BUDGET = 300  # MiB
+
+
+def generate(num_lines: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    lines = ["let x0 = flip 0.5 in"]
+    for i in range(1, num_lines - 1):
+        if i % DISCRETE_EVERY == 0:
+            weights = ", ".join(f"{rng.random():.4f}" for _ in range(NUM_WEIGHTS))
+            lines.append(f"let d{i} = discrete({weights}) in")
+        elif i % 3 == 0:
+            lines.append(f"let x{i} = if x{i - 1} then flip {rng.random():.3f} else x{i - 2} in")
+        else:
+            lines.append(f"let x{i} = x{i - 1} && flip {rng.random():.3f} || x{i // 2} in")
+    lines.append(f"x{num_lines - 2}")
+    return "\n".join(lines)
+
+
+def main():
+    num_lines = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_LINES
+    text = generate(num_lines)
+    parser = make_parser()
+
+    start = time.perf_counter()
+    parser.parse(text)
+    elapsed = time.perf_counter() - start
+
+    # Again for the memory, since tracing slows parsing down
+    tracemalloc.start()
+    parser.parse(text)
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+
+    # The budgets are for 100k lines, and parsing is linear
+    scale = num_lines / NUM_LINES
+    print(f"{num_lines} lines ({len(text) / 2**20:.1f} MiB): {elapsed:.2f}s"
+          f" (budget {TIME_BUDGET * scale:.2f}s), peak {peak:.0f} MiB"
+          f" (budget {MEMORY_BUDGET * scale:.0f} MiB)")
+    if elapsed > TIME_BUDGET * scale or peak > MEMORY_BUDGET * scale:
+        sys.exit("Over budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,148 @@
+# Only what every run needs is imported up front. The other engines, lark and
+# the parser are imported when they are used, since with a cached program
+# none of them are needed.
+from __future__ import annotations
+
 import argparse
 import sys
-import lark
+from typing import TYPE_CHECKING
 
-from main import grammar, TreeTransformer
 from inference import Inferencer
-from compiler import PyEdaCompiler
+from ordering import ORDERINGS
+from cache import ProgramCache
+
+if TYPE_CHECKING:
+    import lark
+
+
+# The optimized IR of `text`. `parser` can also be a ProgramCache, which
+# only parses the program if it hasn't seen it before.
+def build_ir(text: str, parser: lark.Lark | ProgramCache):
+    if isinstance(parser, ProgramCache):
+        return parser.load(text)
+    from main import parse_ir
+    from optimizer import Optimizer
 
+    return Optimizer(parse_ir(text, parser)).optimize()
 
-def parse_string(text: str, parser: lark.Lark, num_its: int=10000) -> dict:
-    ast = parser.parse(text)
-    ir = TreeTransformer().transform(ast)
-    inferencer = Inferencer(ir, num_iterations=num_its, seed=0)
+
+def parse_string(text: str, parser: lark.Lark | ProgramCache, num_its: int=10000, workers: int=1,
+                 likelihood_weighting: bool=False) -> dict:
+    ir = build_ir(text, parser)
+    inferencer = Inferencer(ir, num_iterations=num_its, seed=0, workers=workers,
+                            likelihood_weighting=likelihood_weighting)
     return inferencer.infer()
 
 
-def parse_string_compile(text: str, parser: lark.Lark) -> dict:
-    ast = parser.parse(text)
-    ir = TreeTransformer().transform(ast)
-    compiled_tree = PyEdaCompiler(ir)
+def parse_string_adaptive(text: str, parser: lark.Lark | ProgramCache, tolerance: float,
+                          time_budget: float | None=None, max_its: int | None=None,
+                          likelihood_weighting: bool=False):
+    ir = build_ir(text, parser)
+    inferencer = Inferencer(ir, seed=0, likelihood_weighting=likelihood_weighting)
+    return inferencer.inferAdaptive(tolerance, time_budget=time_budget, max_iterations=max_its)
+
+
+def parse_string_vectorized(text: str, parser: lark.Lark | ProgramCache, num_its: int=10000) -> dict:
+    from vectorized import VectorizedInferencer
+
+    ir = build_ir(text, parser)
+    inferencer = VectorizedInferencer(ir, num_iterations=num_its, seed=0)
+    return inferencer.infer()
+
+
+def parse_string_smc(text: str, parser: lark.Lark | ProgramCache, num_particles: int=10000) -> dict:
+    from smc import SMCInferencer
+
+    ir = build_ir(text, parser)
+    inferencer = SMCInferencer(ir, num_particles=num_particles, seed=0)
+    return inferencer.infer()
+
+
+def parse_string_hybrid(text: str, parser: lark.Lark | ProgramCache, num_its: int=10000) -> dict:
+    from hybrid import HybridInferencer
+
+    ir = build_ir(text, parser)
+    inferencer = HybridInferencer(ir, num_iterations=num_its, seed=0)
+    return inferencer.infer()
+
+
+def parse_string_compile(text: str, parser: lark.Lark | ProgramCache, ordering: str="ast", sift: bool=False) -> dict:
+    from compiler import PyEdaCompiler
+
+    ir = build_ir(text, parser)
+    compiled_tree = PyEdaCompiler(ir, ordering=ordering, sift=sift)
     return compiled_tree.infer()
 
 
+# Compiles the program with every variable ordering, with and without
+# sifting, and prints the BDD size and time for each
+def print_ordering_stats(text: str, parser: lark.Lark | ProgramCache):
+    from compiler import PyEdaCompiler
+
+    ir = build_ir(text, parser)
+    print(f"{'ordering':<16}{'vars':>8}{'bdd size':>12}{'compile (s)':>14}{'sift (s)':>12}")
+    for ordering in ORDERINGS:
+        for sift in (False, True):
+            compiled_tree = PyEdaCompiler(ir, ordering=ordering, sift=sift)
+            compiled_tree.infer()
+            stats = compiled_tree.stats
+            name = ordering + ("+sift" if sift else "")
+            sift_time = f"{stats['sift_time']:.4f}" if sift else "-"
+            print(f"{name:<16}{stats['num_vars']:>8}{stats['bdd_size']:>12}"
+                  f"{stats['compile_time']:>14.4f}{sift_time:>12}")
+
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--bdd", action="store_true", help="enable bdd computation")
-    ap.add_argument("-n", "--num-its", type=int, default=10000, help="number of sampling iterations (default 10000)")
+    ap.add_argument("--vectorized", action="store_true", help="sample in batches with numpy")
+    ap.add_argument("--smc", action="store_true", help="sequential monte carlo with -n particles")
+    ap.add_argument("--hybrid", action="store_true", help="compile what the bdd compiler supports and sample the rest")
+    ap.add_argument("--order", choices=list(ORDERINGS), default="ast", help="bdd variable ordering (default ast)")
+    ap.add_argument("--sift", action="store_true", help="reorder bdd variables by sifting as the bdds grow")
+    ap.add_argument("--order-stats", action="store_true", help="print bdd size and time for every ordering")
+    ap.add_argument("-n", "--num-its", type=int, default=None, help="number of sampling iterations (default 10000, or no limit with --tolerance)")
+    ap.add_argument("--tolerance", type=float, default=None, help="sample until every 95%% confidence interval is narrower than this")
+    ap.add_argument("--time-budget", type=float, default=None, help="with --tolerance, stop sampling after this many seconds")
+    ap.add_argument("--likelihood-weighting", action="store_true", help="weight samples by observed flips instead of rejecting them")
+    ap.add_argument("-j", "--workers", type=int, default=1, help="number of sampling processes for the default sampler (default 1)")
+    ap.add_argument("--no-cache", action="store_true", help="don't read or write the parsed program cache (~/.cache/pydice)")
     ap.add_argument("input_file", nargs='?', type=argparse.FileType('r'), default=sys.stdin, help="input file")
 
     args = ap.parse_args()
+    num_its = 10000 if args.num_its is None else args.num_its
+    if args.workers > 1 and (args.order_stats or args.bdd or args.tolerance is not None
+                             or args.hybrid or args.smc or args.vectorized):
+        ap.error("-j/--workers only works with the default sampler")
 
     # print(args.bdd)
     # print(args.num_its)
     # print(args.input_file)
 
     prog = args.input_file.read()
-    parser = lark.Lark(grammar, parser="lalr")
+    if args.no_cache:
+        from main import make_parser
+
+        parser = make_parser()
+    else:
+        parser = ProgramCache()
 
-    if args.bdd:
-        print(parse_string_compile(prog, parser))
+    if args.order_stats:
+        print_ordering_stats(prog, parser)
+    elif args.bdd:
+        print(parse_string_compile(prog, parser, args.order, args.sift))
+    elif args.tolerance is not None:
+        print(parse_string_adaptive(prog, parser, args.tolerance, args.time_budget, args.num_its,
+                                    args.likelihood_weighting))
+    elif args.hybrid:
+        print(parse_string_hybrid(prog, parser, num_its))
+    elif args.smc:
+        print(parse_string_smc(prog, parser, num_its))
+    elif args.vectorized:
+        print(parse_string_vectorized(prog, parser, num_its))
     else:
-        print(parse_string(prog, parser, args.num_its))
+        print(parse_string(prog, parser, num_its, args.workers,
+                           args.likelihood_weighting))
 
     args.input_file.close()
 
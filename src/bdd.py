@@ -0,0 +1,366 @@
+# A small reduced ordered binary decision diagram (ROBDD) package.
+#
+# Every BDD node is hash-consed through the manager's unique table, so two
+# nodes are equal if and only if they are the same object. All Boolean
+# operations go through `ite` (if-then-else), whose results are memoized in a
+# bounded least-recently-used computed table.
+#
+# The unique table only holds weak references, so nodes are reference counted
+# by Python itself: once no BDD (or cache entry) uses a node, it is freed and
+# drops out of the table.
+#
+# Each variable sits at a level, and nodes are ordered by level. A variable's
+# level starts out as its index, and only changes when the variables are
+# reordered, which swaps adjacent levels in place: every node keeps standing
+# for the same function, so BDDs held by callers stay valid.
+import time
+import weakref
+from collections import OrderedDict
+
+
+class BDDNode:
+    __slots__ = ("var", "level", "low", "high", "__weakref__")
+
+    def __init__(self, var: int, level, low, high):
+        self.var = var
+        self.level = level
+        self.low = low
+        self.high = high
+
+    def __repr__(self):
+        if self.low is None:
+            return "BDDNode(terminal)"
+        return f"BDDNode(x{self.var})"
+
+
+class BDDManager:
+    # Terminals sort after every variable
+    TERMINAL_VAR = float("inf")
+
+    def __init__(self, cache_size: int = 1 << 16):
+        self.zero = BDDNode(self.TERMINAL_VAR, self.TERMINAL_VAR, None, None)
+        self.one = BDDNode(self.TERMINAL_VAR, self.TERMINAL_VAR, None, None)
+        # The nodes of each variable, by their children
+        self.unique = {}
+        self.levels = {}
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.var_names = {}
+        self._vars = {}
+        self.next_index = 0
+        # Automatic reordering: once this many nodes have been made since the
+        # last reordering, the live nodes are counted, and sifted if there
+        # are more than `reorder_threshold` of them
+        self.reorder_threshold = None
+        self.min_reorder_threshold = None
+        self.num_created = 0
+        self.num_reorders = 0
+        self.sift_time = 0.0
+
+    ### Construction ##########################################################
+
+    # Creates a new variable and returns its index. Variables are ordered by
+    # index, which defaults to coming after every existing variable. Indices
+    # don't need to be consecutive, so a caller can leave gaps to place later
+    # variables in between.
+    def new_var(self, name: str | None = None, index: int | None = None) -> int:
+        if index is None:
+            index = self.next_index
+        if index in self._vars:
+            raise ValueError(f"Variable {index} already exists")
+        self.next_index = max(self.next_index, index + 1)
+        self.var_names[index] = name if name is not None else f"x{index}"
+        self.unique[index] = weakref.WeakValueDictionary()
+        # Levels are a permutation of the indices, so a new index is a free
+        # level
+        self.levels[index] = index
+        self._vars[index] = self.mk(index, self.zero, self.one)
+        return index
+
+    # The BDD that is true exactly when variable `index` is true
+    def var(self, index: int) -> BDDNode:
+        return self._vars[index]
+
+    def constant(self, val: bool) -> BDDNode:
+        return self.one if val else self.zero
+
+    def mk(self, var: int, low: BDDNode, high: BDDNode) -> BDDNode:
+        if low is high:
+            return low
+        table = self.unique[var]
+        key = (low, high)
+        node = table.get(key)
+        if node is None:
+            node = BDDNode(var, self.levels[var], low, high)
+            table[key] = node
+            self.num_created += 1
+        return node
+
+    ### Operations ############################################################
+
+    # Operations all go through here, and the variables are only ever
+    # reordered between them, never partway through one
+    def ite(self, f: BDDNode, g: BDDNode, h: BDDNode) -> BDDNode:
+        res = self._ite(f, g, h)
+        if self.reorder_threshold is not None and self.num_created > self.reorder_threshold:
+            self.num_created = 0
+            if self.live_size() > self.reorder_threshold:
+                self.sift()
+                self.num_reorders += 1
+                self.reorder_threshold = max(self.min_reorder_threshold, 2 * self.live_size())
+        return res
+
+    def _ite(self, f: BDDNode, g: BDDNode, h: BDDNode) -> BDDNode:
+        one, zero = self.one, self.zero
+        if f is one:
+            return g
+        if f is zero:
+            return h
+        if g is h:
+            return g
+        if g is one and h is zero:
+            return f
+
+        key = (f, g, h)
+        cache = self.cache
+        res = cache.get(key)
+        if res is not None:
+            cache.move_to_end(key)
+            return res
+
+        top = f
+        if g.level < top.level:
+            top = g
+        if h.level < top.level:
+            top = h
+        var = top.var
+        f0, f1 = (f.low, f.high) if f.var == var else (f, f)
+        g0, g1 = (g.low, g.high) if g.var == var else (g, g)
+        h0, h1 = (h.low, h.high) if h.var == var else (h, h)
+        res = self.mk(var, self._ite(f0, g0, h0), self._ite(f1, g1, h1))
+
+        cache[key] = res
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return res
+
+    def not_(self, f: BDDNode) -> BDDNode:
+        return self.ite(f, self.zero, self.one)
+
+    def and_(self, f: BDDNode, g: BDDNode) -> BDDNode:
+        return self.ite(f, g, self.zero)
+
+    def or_(self, f: BDDNode, g: BDDNode) -> BDDNode:
+        return self.ite(f, self.one, g)
+
+    def xor(self, f: BDDNode, g: BDDNode) -> BDDNode:
+        return self.ite(f, self.not_(g), g)
+
+    def iff(self, f: BDDNode, g: BDDNode) -> BDDNode:
+        return self.ite(f, g, self.not_(g))
+
+    # Replaces every variable `v` in `substitution` with the BDD
+    # `substitution[v]`. Relabeling is the special case where each BDD is just
+    # another variable. Pass the same `memo` to compose several BDDs under one
+    # substitution, so nodes they share are only rebuilt once.
+    def compose(self, f: BDDNode, substitution: dict[int, BDDNode],
+                memo: dict | None = None) -> BDDNode:
+        memo = memo if memo is not None else {}
+
+        def rebuild(f):
+            if f.low is None:
+                return f
+            res = memo.get(f)
+            if res is None:
+                # Read together, since reordering during `rebuild` can
+                # rewrite `f` in place
+                var, low, high = f.var, f.low, f.high
+                g = substitution.get(var)
+                if g is None:
+                    g = self._vars[var]
+                res = self.ite(g, rebuild(high), rebuild(low))
+                memo[f] = res
+            return res
+
+        return rebuild(f)
+
+    ### Queries ###############################################################
+
+    # Weighted model count: the probability that `f` is true when each
+    # variable is independently true with probability `weights[var]`. Each
+    # node is computed once from its children. A variable skipped along an
+    # edge would contribute p + (1 - p) = 1, so skipped variables need no
+    # correction.
+    def wmc(self, f: BDDNode, weights, cache: dict | None = None) -> float:
+        probs = cache if cache is not None else {}
+        probs[self.zero] = 0.0
+        probs[self.one] = 1.0
+        stack = [f]
+        while stack:
+            bdd_node = stack[-1]
+            if bdd_node in probs:
+                stack.pop()
+                continue
+            low, high = bdd_node.low, bdd_node.high
+            if low in probs and high in probs:
+                stack.pop()
+                p = weights[bdd_node.var]
+                probs[bdd_node] = (1.0 - p) * probs[low] + p * probs[high]
+            else:
+                stack.append(low)
+                stack.append(high)
+        return probs[f]
+
+    # Returns (P(query and evidence), P(evidence)) without building the BDD
+    # for `query and evidence`. Both counts come out of one memoized walk over
+    # pairs of nodes, and the evidence-only count is the (one, evidence) pair,
+    # so subgraphs shared between the query and the evidence are only
+    # counted once.
+    def wmc_with_evidence(self, query: BDDNode, evidence: BDDNode,
+                          weights) -> tuple[float, float]:
+        one, zero = self.one, self.zero
+        memo = {}
+
+        def wmc_and(f, g):
+            if f is zero or g is zero:
+                return 0.0
+            if f is one and g is one:
+                return 1.0
+            if g is one:
+                f, g = g, f  # the conjunction is symmetric
+            key = (f, g)
+            res = memo.get(key)
+            if res is not None:
+                return res
+            var = f.var if f.level < g.level else g.var
+            f0, f1 = (f.low, f.high) if f.var == var else (f, f)
+            g0, g1 = (g.low, g.high) if g.var == var else (g, g)
+            p = weights[var]
+            res = (1.0 - p) * wmc_and(f0, g0) + p * wmc_and(f1, g1)
+            memo[key] = res
+            return res
+
+        return wmc_and(query, evidence), wmc_and(one, evidence)
+
+    # Yields every path to the one terminal as a {var: value} dict
+    def satisfy_all(self, f: BDDNode):
+        if f is self.zero:
+            return
+        if f is self.one:
+            yield {}
+            return
+        for val, child in ((False, f.low), (True, f.high)):
+            for path in self.satisfy_all(child):
+                path[f.var] = val
+                yield path
+
+    # The distinct non-terminal nodes reachable from any of `roots`
+    def nodes(self, *roots: BDDNode) -> set[BDDNode]:
+        seen = set()
+        stack = list(roots)
+        while stack:
+            bdd_node = stack.pop()
+            if bdd_node.low is None or bdd_node in seen:
+                continue
+            seen.add(bdd_node)
+            stack.append(bdd_node.low)
+            stack.append(bdd_node.high)
+        return seen
+
+    def size(self, *roots: BDDNode) -> int:
+        return len(self.nodes(*roots))
+
+    # The variables that any of `roots` depend on
+    def support(self, *roots: BDDNode) -> set[int]:
+        return {bdd_node.var for bdd_node in self.nodes(*roots)}
+
+    ### Reordering ############################################################
+
+    # Sifts the variables whenever the number of live nodes has grown past
+    # `threshold` since the last time, and at least `threshold`
+    def enable_reordering(self, threshold: int = 4096):
+        self.reorder_threshold = self.min_reorder_threshold = threshold
+        self.num_created = 0
+
+    # The number of nodes still in use
+    def live_size(self) -> int:
+        return sum(len(table) for table in self.unique.values())
+
+    # The variables, from the top level down
+    def order(self) -> list[int]:
+        return sorted(self.levels, key=self.levels.get)
+
+    # Swaps variable `x` with `y`, the variable on the level just below it.
+    # Nodes of `x` that have a child on `y` are rewritten in place into nodes
+    # of `y` whose children are new nodes of `x`; every other node keeps its
+    # variable and just changes level. Only the two levels are touched.
+    def swap(self, x: int, y: int):
+        levels = self.levels
+        x_table, y_table = self.unique[x], self.unique[y]
+        x_level, y_level = levels[x], levels[y]
+        levels[x], levels[y] = y_level, x_level
+
+        moved = []
+        for bdd_node in list(x_table.values()):
+            if bdd_node.low.var == y or bdd_node.high.var == y:
+                moved.append(bdd_node)
+                del x_table[(bdd_node.low, bdd_node.high)]
+            else:
+                bdd_node.level = y_level
+        for bdd_node in list(y_table.values()):
+            bdd_node.level = x_level
+
+        for bdd_node in moved:
+            f0, f1 = bdd_node.low, bdd_node.high
+            f00, f01 = (f0.low, f0.high) if f0.var == y else (f0, f0)
+            f10, f11 = (f1.low, f1.high) if f1.var == y else (f1, f1)
+            low, high = self.mk(x, f00, f10), self.mk(x, f01, f11)
+            bdd_node.var, bdd_node.level = y, x_level
+            bdd_node.low, bdd_node.high = low, high
+            y_table[(low, high)] = bdd_node
+
+    # Rudell's sifting: each variable in turn (busiest first) is moved
+    # through every level by adjacent swaps, and left wherever the fewest
+    # nodes are live. A variable stops moving in one direction once that has
+    # grown the BDDs past `max_growth` times the best size so far. The
+    # memoized results are dropped first, since they keep nodes alive.
+    def sift(self, max_growth: float = 1.2):
+        start = time.perf_counter()
+        self.clear_cache()
+        order = self.order()
+        size = self.live_size()
+        # A variable with only its own node can't make anything smaller
+        candidates = sorted((var for var in order if len(self.unique[var]) > 1),
+                            key=lambda var: -len(self.unique[var]))
+
+        for var in candidates:
+            pos = order.index(var)
+            best_size, best_pos = size, pos
+
+            def move(to: int):
+                nonlocal pos, size
+                step = 1 if to > pos else -1
+                while pos != to:
+                    upper, lower = (pos, pos + 1) if step == 1 else (pos - 1, pos)
+                    x, y = order[upper], order[lower]
+                    before = len(self.unique[x]) + len(self.unique[y])
+                    self.swap(x, y)
+                    size += len(self.unique[x]) + len(self.unique[y]) - before
+                    order[upper], order[lower] = y, x
+                    pos += step
+                    yield
+
+            for end in (len(order) - 1, 0):
+                for _ in move(end):
+                    if size < best_size:
+                        best_size, best_pos = size, pos
+                    elif size > best_size * max_growth:
+                        break
+            for _ in move(best_pos):
+                pass
+        self.sift_time += time.perf_counter() - start
+
+    # Drops all memoized results, which also lets the nodes only they were
+    # keeping alive be freed
+    def clear_cache(self):
+        self.cache.clear()
@@ -0,0 +1,97 @@
+import pytest
+
+from bdd import BDDManager
+
+
+def test_canonical() -> None:
+    mgr = BDDManager()
+    x, y = mgr.var(mgr.new_var()), mgr.var(mgr.new_var())
+    # De Morgan: both sides must be the exact same node
+    assert mgr.not_(mgr.and_(x, y)) is mgr.or_(mgr.not_(x), mgr.not_(y))
+    assert mgr.xor(x, x) is mgr.zero
+    assert mgr.or_(x, mgr.not_(x)) is mgr.one
+    assert mgr.size(mgr.and_(x, y)) == 2
+
+
+def test_wmc() -> None:
+    mgr = BDDManager()
+    x, y, z = (mgr.var(mgr.new_var()) for _ in range(3))
+    weights = {0: 0.3, 1: 0.6, 2: 0.9}
+    f = mgr.or_(mgr.and_(x, y), z)
+    assert mgr.wmc(f, weights) == pytest.approx(1 - (1 - 0.18) * 0.1)
+    # y is a don't-care on the path where x is false
+    assert mgr.wmc(mgr.ite(x, y, z), weights) == pytest.approx(0.3 * 0.6 + 0.7 * 0.9)
+
+
+def test_satisfy_all() -> None:
+    mgr = BDDManager()
+    x, y = mgr.var(mgr.new_var()), mgr.var(mgr.new_var())
+    paths = list(mgr.satisfy_all(mgr.or_(x, y)))
+    assert paths == [{0: False, 1: True}, {0: True}]
+
+
+def test_bounded_cache() -> None:
+    mgr = BDDManager(cache_size=8)
+    xs = [mgr.var(mgr.new_var()) for _ in range(20)]
+    f = mgr.zero
+    for x in xs:
+        f = mgr.xor(f, x)
+    assert len(mgr.cache) <= 8
+    assert mgr.wmc(f, {i: 0.5 for i in range(20)}) == pytest.approx(0.5)
+
+
+def test_wmc_with_evidence() -> None:
+    mgr = BDDManager()
+    x, y, z = (mgr.var(mgr.new_var()) for _ in range(3))
+    weights = {0: 0.3, 1: 0.6, 2: 0.9}
+    query = mgr.or_(mgr.and_(x, y), z)
+    evidence = mgr.or_(x, mgr.not_(z))
+    prob, evidence_prob = mgr.wmc_with_evidence(query, evidence, weights)
+    assert prob == pytest.approx(mgr.wmc(mgr.and_(query, evidence), weights))
+    assert evidence_prob == pytest.approx(mgr.wmc(evidence, weights))
+
+
+def test_compose() -> None:
+    mgr = BDDManager()
+    x, y, z = (mgr.var(mgr.new_var()) for _ in range(3))
+    f = mgr.and_(x, y)
+    # Substituting a formula, and relabeling y to z
+    assert mgr.compose(f, {0: mgr.or_(y, z)}) is y
+    assert mgr.compose(f, {1: z}) is mgr.and_(x, z)
+    assert mgr.support(mgr.compose(f, {1: z})) == {0, 2}
+
+
+def test_swap_keeps_functions() -> None:
+    mgr = BDDManager()
+    x, y, z = (mgr.var(mgr.new_var()) for _ in range(3))
+    weights = {0: 0.3, 1: 0.6, 2: 0.9}
+    f = mgr.or_(mgr.and_(x, y), mgr.and_(mgr.not_(x), z))
+    expected = mgr.wmc(f, weights)
+    mgr.swap(0, 1)
+    assert mgr.order() == [1, 0, 2]
+    assert f.var == 1
+    assert mgr.wmc(f, weights) == pytest.approx(expected)
+    # Still canonical under the new order
+    assert mgr.or_(mgr.and_(x, y), mgr.and_(mgr.not_(x), z)) is f
+
+
+def pairs(mgr: BDDManager, n: int):
+    a = [mgr.var(mgr.new_var()) for _ in range(n)]
+    b = [mgr.var(mgr.new_var()) for _ in range(n)]
+    f = mgr.zero
+    for ai, bi in zip(a, b):
+        f = mgr.or_(f, mgr.and_(ai, bi))
+    return f
+
+
+def test_reorders_while_building() -> None:
+    # (a0 && b0) || (a1 && b1) || ... is exponential with every a before
+    # every b
+    plain = BDDManager()
+    plain_size = plain.size(pairs(plain, 8))
+    mgr = BDDManager()
+    mgr.enable_reordering(threshold=32)
+    f = pairs(mgr, 8)
+    assert mgr.num_reorders > 0
+    assert mgr.size(f) * 4 < plain_size
+    assert mgr.wmc(f, {i: 0.5 for i in range(16)}) == pytest.approx(1 - 0.75 ** 8)
@@ -0,0 +1,156 @@
+# An on-disk cache of parsed programs, so that running the same program
+# again skips straight to inference.
+#
+# Two things are kept: lark's LALR parser tables, and the optimized IR of
+# each program (pickled). A program's entry is keyed by a hash of its text
+# together with everything that decides what IR it turns into: the grammar,
+# the distribution plugins, lark's version, and the modules that build and
+# optimize the IR.
+# Changing any of those just means old entries are never looked up again.
+#
+# The cache is only ever a shortcut: if it can't be read or written, the
+# program is parsed as usual.
+#
+# A hit only needs this module and the IR's own classes: lark, the grammar
+# and the optimizer are imported once a program has to be parsed.
+import hashlib
+import importlib.util
+import os
+import pathlib
+import pickle
+import sys
+import tempfile
+
+
+# Bump this when the format of the cache changes
+CACHE_VERSION = 1
+
+_SRC_DIR = pathlib.Path(__file__).parent.resolve()
+
+# The modules that decide what IR a program text turns into
+_IR_MODULES = ("main.py", "node.py", "dicetypes.py", "checker.py", "optimizer.py",
+               "custom_distribution.py")
+
+
+def defaultCacheDir() -> pathlib.Path:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(pathlib.Path.home(), ".cache")
+    return pathlib.Path(base) / "pydice"
+
+
+# The installed version of lark, which decides how a program text parses.
+# The package metadata has it without importing lark, but importing
+# importlib.metadata takes about as long as importing lark. So the version is
+# kept in the cache directory, under a stamp of lark's files that changes
+# whenever lark is reinstalled.
+def _larkVersion(directory: pathlib.Path) -> str | None:
+    spec = importlib.util.find_spec("lark")
+    if spec is None or spec.origin is None:
+        return None
+    stat = os.stat(spec.origin)
+    stamp = hashlib.sha256(repr((spec.origin, stat.st_mtime_ns, stat.st_size)).encode())
+    path = directory / f"lark-{stamp.hexdigest()[:16]}.version"
+    try:
+        return path.read_text()
+    except OSError:
+        pass
+
+    from importlib import metadata
+
+    try:
+        version = metadata.version("lark")
+    except metadata.PackageNotFoundError:
+        return None
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(version)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+    return version
+
+
+# A hash of everything besides the program text that goes into its IR. The
+# grammar is built from main.py and the plugins, so hashing their sources
+# covers it.
+def _toolchainHash(directory: pathlib.Path) -> str:
+    import custom_distribution
+
+    digest = hashlib.sha256()
+    digest.update(f"{CACHE_VERSION} {sys.version_info[:2]} {_larkVersion(directory)}".encode())
+    files = [_SRC_DIR / name for name in _IR_MODULES] + [
+        pathlib.Path(path) for path in custom_distribution.distributionFiles()
+    ]
+    for path in sorted(files):
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+class ProgramCache:
+    def __init__(self, directory=None):
+        import custom_distribution
+
+        self.directory = pathlib.Path(directory) if directory is not None else defaultCacheDir()
+        # The distribution plugins' manifest is cached alongside programs
+        custom_distribution.useManifestDir(self.directory)
+        self.toolchain = _toolchainHash(self.directory)
+        # Only built when a program isn't in the cache
+        self._parser = None
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256((self.toolchain + "\0" + text).encode()).hexdigest()
+
+    # Lark keeps its own cache of the parser tables, which it checks against
+    # the grammar before using
+    def parser(self):
+        from main import make_parser
+
+        if self._parser is None:
+            try:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                cache_file = str(self.directory / f"parser-{self.toolchain[:16]}.lark")
+                self._parser = make_parser(cache=cache_file)
+            except OSError:
+                self._parser = make_parser()
+        return self._parser
+
+    # The optimized IR of `text`, from the cache if it is there
+    def load(self, text: str):
+        path = self.directory / f"{self.key(text)}.ir"
+        try:
+            with open(path, "rb") as f:
+                ir = pickle.load(f)
+            self.hits += 1
+            return ir
+        except Exception:
+            # Missing, or damaged (e.g. by a disk that filled up partway
+            # through writing it), so it gets rebuilt
+            pass
+
+        from main import parse_ir
+        from optimizer import Optimizer
+
+        self.misses += 1
+        ir = Optimizer(parse_ir(text, self.parser())).optimize()
+        self.store(path, ir)
+        return ir
+
+    # Writes to a temporary file first, so concurrent runs never see half an
+    # entry. Failing to store an entry (a read-only home directory, an IR
+    # too deep to pickle, ...) isn't an error.
+    def store(self, path: pathlib.Path, ir):
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump(ir, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except Exception:
+            pass
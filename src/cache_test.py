@@ -0,0 +1,103 @@
+import importlib.metadata
+import os
+import subprocess
+import sys
+
+import pytest
+
+from cache import ProgramCache
+from inference import Inferencer
+
+
+TEXT = """
+fun f(a: int(3), b: bool) { if b then a + int(3, 1) else a }
+let x = uniform(3, 0, 8) in
+let b = flip 0.4 in
+let tmp = observe !(x == int(3, 7)) in
+(f(x, b) < int(3, 4), b)
+"""
+
+
+def infer(ir) -> dict:
+    return {repr(outcome): prob for outcome, prob in
+            Inferencer(ir, num_iterations=2000, seed=0).infer().items()}
+
+
+def test_reuses_programs(tmp_path) -> None:
+    first = ProgramCache(tmp_path)
+    expected = infer(first.load(TEXT))
+    assert (first.hits, first.misses) == (0, 1)
+
+    # A new run finds the program without building a parser
+    second = ProgramCache(tmp_path)
+    assert infer(second.load(TEXT)) == expected
+    assert (second.hits, second.misses) == (1, 0)
+    assert second._parser is None
+
+    second.load(TEXT + " ")
+    assert second.misses == 1
+
+
+def test_keyed_by_lark_version(tmp_path, monkeypatch) -> None:
+    key = ProgramCache(tmp_path / "a").key(TEXT)
+    assert ProgramCache(tmp_path / "a").key(TEXT) == key
+    monkeypatch.setattr(importlib.metadata, "version", lambda name: "0.0.1")
+    assert ProgramCache(tmp_path / "b").key(TEXT) != key
+
+
+def test_rebuilds_damaged_entries(tmp_path) -> None:
+    cache = ProgramCache(tmp_path)
+    expected = infer(cache.load(TEXT))
+    (tmp_path / f"{cache.key(TEXT)}.ir").write_bytes(b"not a pickle")
+    assert infer(cache.load(TEXT)) == expected
+    assert cache.misses == 2
+    assert ProgramCache(tmp_path).load(TEXT) is not None
+
+
+def test_unwritable_directory(tmp_path) -> None:
+    blocked = tmp_path / "file"
+    blocked.write_text("")
+    cache = ProgramCache(blocked / "cache")
+    assert infer(cache.load(TEXT)) == infer(cache.load(TEXT))
+    assert cache.misses == 2
+
+
+def test_errors_are_not_cached(tmp_path) -> None:
+    cache = ProgramCache(tmp_path)
+    with pytest.raises(TypeError):
+        cache.load("let x = int(4, 1) + int(3, 1) in x")
+    assert not list(tmp_path.glob("*.ir"))
+
+
+# A program that is already cached runs without importing the parser, numpy
+# or the engines it doesn't use
+def test_hits_skip_slow_imports(tmp_path) -> None:
+    script = f"""
+import sys
+from cache import ProgramCache
+from inference import Inferencer
+ir = ProgramCache({str(tmp_path)!r}).load({TEXT!r})
+Inferencer(ir, num_iterations=10, seed=0).infer()
+print(sorted(m for m in ("lark", "numpy", "main", "compiler", "vectorized",
+                          "importlib.metadata") if m in sys.modules))
+"""
+    env = dict(os.environ, XDG_CACHE_HOME=str(tmp_path))
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    run = lambda: subprocess.run([sys.executable, "-c", script], cwd=src_dir, env=env,
+                                 capture_output=True, text=True, check=True).stdout.strip()
+    assert run() == "['importlib.metadata', 'lark', 'main']"
+    assert run() == "[]"
+
+
+# The plugin manifest is only written with caching on, and then into the
+# cache's own directory
+def test_manifest_only_written_by_cache(tmp_path) -> None:
+    env = dict(os.environ, XDG_CACHE_HOME=str(tmp_path / "home"))
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    for script in [
+        "from main import make_parser, parse_ir; parse_ir('uniform(2, 0, 3)', make_parser())",
+        f"from cache import ProgramCache; ProgramCache({str(tmp_path / 'cache')!r}).load('uniform(2, 0, 3)')",
+    ]:
+        subprocess.run([sys.executable, "-c", script], cwd=src_dir, env=env, check=True)
+    assert not (tmp_path / "home").exists()
+    assert len(list((tmp_path / "cache").glob("plugins-*.json"))) == 1
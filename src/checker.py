@@ -0,0 +1,280 @@
+# A static pass over the IR that runs once, before any sampling.
+#
+# It resolves every identifier and function call, and infers the type of
+# every node, so that programs which could fail partway through sampling
+# are rejected up front, with the same errors the samplers would raise.
+# Types are written the same way as function parameter types: BoolType(True)
+# for `bool`, IntType(width, 0) for `int(width)`, TupleType(left, right) and
+# ListType([], item_type). None means a type only known once the program
+# runs, e.g. an `if` whose branches have different types, which is allowed.
+import custom_distribution
+import node
+from dicetypes import DiceType, BoolType, IntType, TupleType, ListType
+
+
+BOOL = BoolType(True)
+
+# Marks a function whose body is being checked, so recursive calls don't
+# loop forever
+_CHECKING = object()
+
+
+# The type of a constant value
+def typeOf(val: DiceType) -> DiceType | None:
+    if type(val) is BoolType:
+        return BOOL
+    elif type(val) is IntType:
+        return IntType(val.width, 0)
+    elif type(val) is TupleType:
+        return TupleType(typeOf(val.left), typeOf(val.right))
+    elif type(val) is ListType:
+        if not val.lst:
+            return ListType([], val.type_ if isinstance(val.type_, DiceType) else None)
+        item_type = typeOf(val.lst[0])
+        for item in val.lst[1:]:
+            item_type = join(item_type, typeOf(item))
+        return ListType([], item_type)
+    return None
+
+
+# Whether two types are definitely the same. Unknown types match anything.
+def sameType(lhs: DiceType | None, rhs: DiceType | None) -> bool:
+    if lhs is None or rhs is None:
+        return True
+    if type(lhs) is not type(rhs):
+        return False
+    if type(lhs) is IntType:
+        return lhs.width == rhs.width
+    if type(lhs) is TupleType:
+        return sameType(lhs.left, rhs.left) and sameType(lhs.right, rhs.right)
+    if type(lhs) is ListType:
+        return sameType(lhs.type_, rhs.type_)
+    return True
+
+
+# Whether a type is known all the way down
+def isKnown(dice_type: DiceType | None) -> bool:
+    if dice_type is None:
+        return False
+    if type(dice_type) is TupleType:
+        return isKnown(dice_type.left) and isKnown(dice_type.right)
+    if type(dice_type) is ListType:
+        return isKnown(dice_type.type_)
+    return True
+
+
+# The type of something that is either `lhs` or `rhs`
+def join(lhs: DiceType | None, rhs: DiceType | None) -> DiceType | None:
+    if lhs is None or rhs is None or type(lhs) is not type(rhs):
+        return None
+    if type(lhs) is TupleType:
+        return TupleType(join(lhs.left, rhs.left), join(lhs.right, rhs.right))
+    if type(lhs) is ListType:
+        return ListType([], join(lhs.type_, rhs.type_))
+    return lhs if sameType(lhs, rhs) else None
+
+
+class TypeChecker:
+    def __init__(self, tree, variables=None):
+        self.tree = tree
+        self.variables = variables if variables is not None else {}
+        # The type of every node, by node. Constants aren't included.
+        self.types = {}
+        self.function_nodes = {}
+        self.function_types = {}
+
+    # Checks the whole program, returning the type of every node. Raises
+    # on the first error.
+    def check(self) -> dict:
+        tree = self.tree
+        if type(tree) is node.ProgramNode:
+            for function in tree.functions:
+                self.function_nodes[function.ident] = function
+            for function in tree.functions:
+                self.checkFunction(function.ident)
+            tree = tree.expr
+
+        scope = {ident: typeOf(val) for ident, val in self.variables.items()}
+        self.recurseTree(tree, scope)
+        return self.types
+
+    # The type of the program's result, once it has been checked
+    def resultType(self) -> DiceType | None:
+        tree = self.tree.expr if type(self.tree) is node.ProgramNode else self.tree
+        if isinstance(tree, DiceType):
+            return typeOf(tree)
+        return self.types.get(tree)
+
+    # Returns the type of the function's result
+    def checkFunction(self, ident: str) -> DiceType | None:
+        if ident in self.function_types:
+            res = self.function_types[ident]
+            return None if res is _CHECKING else res
+        function = self.function_nodes[ident]
+        self.function_types[ident] = _CHECKING
+        # Function bodies only see their own parameters
+        scope = {param.ident: param.type for param in function.arg_list_node.args}
+        res = self.recurseTree(function.expr, scope)
+        self.function_types[ident] = res
+        return res
+
+    def checkCall(self, treeNode: node.FunctionCallNode, scope: dict) -> DiceType | None:
+        ident, args = treeNode.ident, treeNode.arg_list_node.args
+        arg_types = [self.recurseTree(arg, scope) for arg in args]
+        if ident not in self.function_nodes:
+            raise Exception("Function identifier not defined:", ident)
+        params = self.function_nodes[ident].arg_list_node.args
+        if len(params) != len(args):
+            raise AttributeError(
+                f"Argument Length does not match: Param len {len(params)} != Arg len {len(args)}"
+            )
+        for param, arg_type in zip(params, arg_types):
+            if not sameType(param.type, arg_type):
+                raise TypeError(
+                    f"Argument `{param.ident}` of `{ident}` must be {param.type} (found {arg_type})"
+                )
+        return self.checkFunction(ident)
+
+    def verifyBools(self, *operand_types):
+        for operand_type in operand_types:
+            if operand_type is not None and type(operand_type) is not BoolType:
+                raise TypeError(
+                    f"Boolean operation must act on two booleans ({operand_type})"
+                )
+
+    def verifyInts(self, lhs: DiceType | None, rhs: DiceType | None):
+        for operand_type in (lhs, rhs):
+            if operand_type is not None and type(operand_type) is not IntType:
+                raise TypeError("Integer operation must act on two integers")
+        if lhs is not None and rhs is not None and lhs.width != rhs.width:
+            raise TypeError(
+                f"Integer operands must be equal widths ({lhs.width} != {rhs.width})"
+            )
+
+    def recurseTree(self, treeNode, scope: dict) -> DiceType | None:
+        if isinstance(treeNode, DiceType):
+            return typeOf(treeNode)
+        res = self.nodeType(treeNode, scope)
+        self.types[treeNode] = res
+        return res
+
+    def nodeType(self, treeNode, scope: dict) -> DiceType | None:
+        if type(treeNode) is node.FlipNode:
+            return BOOL
+
+        elif isinstance(treeNode, custom_distribution.CustomDistribution):
+            return treeNode.result_type()
+
+        elif type(treeNode) is node.IdentNode:
+            if treeNode.ident not in scope:
+                raise Exception("Identifier not defined:", treeNode.ident)
+            return scope[treeNode.ident]
+
+        elif type(treeNode) is node.FunctionCallNode:
+            return self.checkCall(treeNode, scope)
+
+        elif type(treeNode) is node.NotNode:
+            self.verifyBools(self.recurseTree(treeNode.operand, scope))
+            return BOOL
+
+        elif type(treeNode) in (node.LeftShiftNode, node.RightShiftNode):
+            operand = self.recurseTree(treeNode.operand, scope)
+            if operand is not None and type(operand) is not IntType:
+                raise TypeError("Can only shift an integer")
+            return operand
+
+        elif type(treeNode) in (node.AndNode, node.OrNode):
+            self.verifyBools(self.recurseTree(treeNode.left, scope),
+                             self.recurseTree(treeNode.right, scope))
+            return BOOL
+
+        elif type(treeNode) is node.EqualNode:
+            self.recurseTree(treeNode.left, scope)
+            self.recurseTree(treeNode.right, scope)
+            return BOOL
+
+        elif type(treeNode) in (node.AddNode, node.SubNode, node.MulNode,
+                                node.DivNode, node.LessThanNode):
+            lhs = self.recurseTree(treeNode.left, scope)
+            rhs = self.recurseTree(treeNode.right, scope)
+            self.verifyInts(lhs, rhs)
+            if type(treeNode) is node.LessThanNode:
+                return BOOL
+            return lhs if lhs is not None else rhs
+
+        elif type(treeNode) is node.NthBitNode:
+            for operand in (treeNode.left, treeNode.right):
+                operand_type = self.recurseTree(operand, scope)
+                if operand_type is not None and type(operand_type) is not IntType:
+                    raise TypeError(f"nth_bit can only take IntTypes (found {operand_type})")
+            return BOOL
+
+        elif type(treeNode) is node.ConcatNode:
+            item = self.recurseTree(treeNode.left, scope)
+            lst = self.recurseTree(treeNode.right, scope)
+            if lst is None:
+                return None
+            if type(lst) is not ListType:
+                raise TypeError(f"Must concatenate onto a list (found {lst})")
+            return ListType([], join(item, lst.type_) if lst.type_ is not None else None)
+
+        elif type(treeNode) is node.AssignNode:
+            # A loop rather than recursion down the chain of `let`s, since
+            # generated programs can have thousands of them. Every `let` in
+            # the chain has the type of the expression at its end.
+            scope = dict(scope)
+            chain = []
+            while type(treeNode) is node.AssignNode:
+                chain.append(treeNode)
+                scope[treeNode.ident] = self.recurseTree(treeNode.val, scope)
+                treeNode = treeNode.rest
+            res = self.recurseTree(treeNode, scope)
+            for assign in chain[1:]:
+                self.types[assign] = res
+            return res
+
+        elif type(treeNode) is node.IfNode:
+            cond = self.recurseTree(treeNode.cond, scope)
+            if cond is not None and type(cond) is not BoolType:
+                raise TypeError("Condition must be BoolType")
+            return join(self.recurseTree(treeNode.true_expr, scope),
+                        self.recurseTree(treeNode.false_expr, scope))
+
+        elif type(treeNode) is node.ObserveNode:
+            observation = self.recurseTree(treeNode.observation, scope)
+            if observation is not None and type(observation) is not BoolType:
+                raise TypeError("Can't observe a non-bool type")
+            return BOOL
+
+        elif type(treeNode) is node.TupleNode:
+            return TupleType(self.recurseTree(treeNode.left, scope),
+                             self.recurseTree(treeNode.right, scope))
+
+        elif type(treeNode) in (node.FstNode, node.SndNode):
+            tup = self.recurseTree(treeNode.tup, scope)
+            if tup is None:
+                return None
+            if type(tup) is not TupleType:
+                raise Exception("`fst` and `snd` can only be used on tuples")
+            return tup.left if type(treeNode) is node.FstNode else tup.right
+
+        elif type(treeNode) is node.ListNode:
+            if not treeNode.lst:
+                return ListType([], treeNode.type_ if isinstance(treeNode.type_, DiceType) else None)
+            item_type = self.recurseTree(treeNode.lst[0], scope)
+            for item in treeNode.lst[1:]:
+                item_type = join(item_type, self.recurseTree(item, scope))
+            return ListType([], item_type)
+
+        elif type(treeNode) in (node.HeadNode, node.TailNode, node.LengthNode):
+            lst = self.recurseTree(treeNode.lst, scope)
+            if lst is not None and type(lst) is not ListType:
+                raise Exception("`head`, `tail` and `length` can only be used on lists")
+            if type(treeNode) is node.LengthNode:
+                return IntType(4, 0)
+            elif type(treeNode) is node.TailNode:
+                return lst
+            return lst.type_ if lst is not None else None
+
+        else:
+            raise Exception("Tree Node Unknown:", treeNode)
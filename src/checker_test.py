@@ -0,0 +1,63 @@
+import pytest
+import lark
+
+from main import grammar, TreeTransformer
+from inference import Inferencer
+from checker import TypeChecker
+from dicetypes import BoolType, IntType, TupleType
+
+
+@pytest.fixture
+def test_parser() -> lark.Lark:
+    return lark.Lark(grammar, parser="lalr")
+
+
+def transform(test_parser: lark.Lark, text: str):
+    return TreeTransformer().transform(test_parser.parse(text))
+
+
+def test_infers_types(test_parser: lark.Lark) -> None:
+    ir = transform(test_parser, """
+    fun f(a: int(3)) { (a + int(3, 1), a < int(3, 2)) }
+    let x = discrete(0.1, 0.2, 0.3, 0.4) in
+    f(int(3, 4))
+    """)
+    types = TypeChecker(ir).check()
+    # DiceType's == doesn't return a plain bool, so compare the reprs
+    assert repr(types[ir.expr]) == repr(TupleType(IntType(3, 0), BoolType(True)))
+    assert repr(types[ir.expr.val]) == repr(IntType(2, 0))
+
+
+@pytest.mark.parametrize("compiled", [True, False])
+@pytest.mark.parametrize("text, error", [
+    # Each error is in a branch that sampling would hardly ever reach
+    ("if flip 0.999 then int(4, 1) else int(4, 1) + int(3, 1)", TypeError),
+    ("if flip 0.999 then true else undefined_ident", Exception),
+    ("fun f(a: bool) { a } if flip 0.999 then true else f(true, false)", AttributeError),
+    ("fun f(a: bool) { a } if flip 0.999 then true else f(int(4, 1))", TypeError),
+    ("if flip 0.999 then true else fst true", Exception),
+    ("let _ = observe flip 0.999 || int(2, 1) == int(2, 1) in int(2, 1) < true", TypeError),
+])
+def test_rejects_before_sampling(test_parser: lark.Lark, text: str, error, compiled: bool) -> None:
+    ir = transform(test_parser, text)
+    with pytest.raises(error):
+        Inferencer(ir, num_iterations=10, compiled=compiled)
+
+
+def test_branches_of_different_types(test_parser: lark.Lark) -> None:
+    ir = transform(test_parser, "let x = if flip 0.5 then int(4, 1) else true in x")
+    types = TypeChecker(ir).check()
+    assert types[ir.expr] is None
+    res = Inferencer(ir, num_iterations=1000, seed=0).infer()
+    assert sorted(repr(outcome) for outcome in res) == ["BoolType(True)", "IntType(4, 1)"]
+    assert sum(res.values()) == pytest.approx(1.0)
+
+
+def test_dynamic_argument_checked_at_call(test_parser: lark.Lark) -> None:
+    # The argument's type is only known once the `if` runs
+    ir = transform(test_parser, """
+    fun f(a: int(4)) { a + int(4, 1) }
+    f(if flip 0.5 then int(4, 1) else true)
+    """)
+    with pytest.raises(TypeError, match="Argument `a` of `f`"):
+        Inferencer(ir, num_iterations=100, seed=0).infer()
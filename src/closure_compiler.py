@@ -0,0 +1,523 @@
+# Contains code to compile our parsed tree into nested Python closures.
+#
+# TreeInferencer re-dispatches on the type of every node on every sample. The
+# ClosureCompiler does that dispatch once: each node becomes a small function
+# `f(frame, state)` that directly calls the functions of its children.
+# Variables are resolved to slot indices at compile time, so `frame` is just a
+# list holding the variables of the function currently being run, and `state`
+# holds the RNG and whether all observations have succeeded so far.
+#
+# The program is type checked first. Wherever the checker knows the type of
+# an operand, the closure skips the check it would otherwise repeat on every
+# sample.
+#
+# With likelihood weighting, observations of a flip don't reject samples.
+# `observe flip p` multiplies the sample's weight by p instead. A let-bound
+# flip that is observed directly (`let x = flip p in ... observe x`) is left
+# undecided until it is first read; if an observation reaches it first, the
+# flip is set to the observed value and the weight is multiplied by that
+# value's probability.
+import custom_distribution
+import node
+from checker import TypeChecker, isKnown, sameType, typeOf
+from dicetypes import DiceType, BoolType, IntType, TupleType, ListType
+
+
+class SampleState:
+    def __init__(self, rng):
+        self.rng = rng
+        self.observe_ok = True
+        self.weight = 1.0
+
+
+# A flip that hasn't been read or observed yet
+class _PendingFlip:
+    __slots__ = ("prob",)
+
+    def __init__(self, prob: float):
+        self.prob = prob
+
+
+class CompiledProgram:
+    def __init__(self, body, num_slots: int, initial_values: list):
+        self.body = body
+        self.initial_frame = initial_values + [None] * (num_slots - len(initial_values))
+
+    # Runs the program once, returning None if an observation failed
+    def __call__(self, state: SampleState) -> DiceType | None:
+        state.observe_ok = True
+        state.weight = 1.0
+        res = self.body(self.initial_frame.copy(), state)
+
+        if state.observe_ok:
+            return res
+        else:
+            return None
+
+
+# Tracks the slots of the function (or main program) being compiled
+class _Scope:
+    def __init__(self, idents):
+        self.slots = {ident: i for i, ident in enumerate(idents)}
+        self.num_slots = len(self.slots)
+        # Slots that may hold a _PendingFlip
+        self.pending = set()
+
+    def lookup(self, ident: str) -> int | None:
+        return self.slots.get(ident)
+
+    # Every `let` gets a fresh slot, so shadowed variables keep their values
+    def bind(self, ident: str) -> tuple[int, dict]:
+        slot = self.num_slots
+        self.num_slots += 1
+        old_slots = self.slots
+        self.slots = {**old_slots, ident: slot}
+        return slot, old_slots
+
+
+# Whether `treeNode` is `observe <ident>` or `observe !<ident>`, returning
+# the identifier and the observed value
+def _directObservation(treeNode) -> tuple[str, bool] | None:
+    if type(treeNode) is not node.ObserveNode:
+        return None
+    observation, val = treeNode.observation, True
+    if type(observation) is node.NotNode:
+        observation, val = observation.operand, False
+    if type(observation) is node.IdentNode:
+        return observation.ident, val
+    return None
+
+
+# Whether `treeNode` observes the variable `ident` directly anywhere it can
+# still see it
+def _observesDirectly(treeNode, ident: str) -> bool:
+    while type(treeNode) is node.AssignNode:
+        if _observesDirectly(treeNode.val, ident):
+            return True
+        if treeNode.ident == ident:
+            return False
+        treeNode = treeNode.rest
+    observation = _directObservation(treeNode)
+    if observation is not None and observation[0] == ident:
+        return True
+    if not isinstance(treeNode, node.Node) or type(treeNode) is node.FunctionNode:
+        return False
+    for child in vars(treeNode).values():
+        children = child if type(child) is list else [child]
+        if any(_observesDirectly(c, ident) for c in children):
+            return True
+    return False
+
+
+class ClosureCompiler:
+    def __init__(self, tree, variables=None, likelihood_weighting=False):
+        self.tree = tree
+        self.variables = variables if variables is not None else {}
+        self.likelihood_weighting = likelihood_weighting
+
+        # Calls are looked up by name when they run, which lets functions call
+        # each other (and themselves) regardless of definition order
+        self.functions = {}
+        self.checker = TypeChecker(tree, self.variables)
+        self.types = {}
+
+    def compile(self) -> CompiledProgram:
+        self.types = self.checker.check()
+        tree = self.tree
+        if type(tree) is node.ProgramNode:
+            for function in tree.functions:
+                self.compileFunction(function)
+            tree = tree.expr
+
+        scope = _Scope(self.variables.keys())
+        body = self.recurseTree(tree, scope)
+        return CompiledProgram(body, scope.num_slots, list(self.variables.values()))
+
+    def compileFunction(self, function: node.FunctionNode):
+        params = [param.ident for param in function.arg_list_node.args]
+        scope = _Scope(params)
+        body = self.recurseTree(function.expr, scope)
+        self.functions[function.ident] = (len(params), body, scope.num_slots)
+
+    def compileCall(self, treeNode: node.FunctionCallNode, scope: _Scope):
+        ident = treeNode.ident
+        params = self.checker.function_nodes[ident].arg_list_node.args
+        args = []
+        for param, arg_node in zip(params, treeNode.arg_list_node.args):
+            arg = self.recurseTree(arg_node, scope)
+            if not isKnown(self.types.get(arg_node)) and not isinstance(arg_node, DiceType):
+                # The function body was compiled for the declared type, so
+                # an argument the checker couldn't pin down is checked here
+                arg = self.compileArgCheck(arg, param, ident)
+            args.append(arg)
+        functions = self.functions
+
+        # The checker has made sure the function exists and takes this many
+        # arguments
+        def call(frame, state):
+            num_params, body, num_slots = functions[ident]
+            callee_frame = [arg(frame, state) for arg in args]
+            callee_frame.extend([None] * (num_slots - num_params))
+            return body(callee_frame, state)
+        return call
+
+    def compileArgCheck(self, arg, param: node.ArgNode, ident: str):
+        param_type = param.type
+
+        def checked_arg(frame, state):
+            val = arg(frame, state)
+            if not sameType(param_type, typeOf(val)):
+                raise TypeError(
+                    f"Argument `{param.ident}` of `{ident}` must be {param_type} (found {val})"
+                )
+            return val
+        return checked_arg
+
+    # Whether the checker found that `treeNode` always has type `dice_type`
+    def hasType(self, treeNode, dice_type: type) -> bool:
+        if isinstance(treeNode, DiceType):
+            return type(treeNode) is dice_type
+        return type(self.types.get(treeNode)) is dice_type
+
+    def recurseTree(self, treeNode, scope: _Scope):
+        if isinstance(treeNode, DiceType):
+            def constant(frame, state):
+                return treeNode
+            return constant
+
+        elif type(treeNode) is node.FunctionCallNode:
+            return self.compileCall(treeNode, scope)
+
+        elif type(treeNode) is node.FlipNode:
+            prob = treeNode.prob
+
+            def flip(frame, state):
+                return BoolType(state.rng.random() < prob)
+            return flip
+
+        elif isinstance(treeNode, custom_distribution.CustomDistribution):
+            sample = treeNode.sample
+
+            def custom(frame, state):
+                return sample(state.rng)
+            return custom
+
+        elif type(treeNode) is node.IdentNode:
+            ident = treeNode.ident
+            slot = scope.lookup(ident)
+            if slot is None:
+                def undefined(frame, state):
+                    raise Exception("Identifier not defined:", ident)
+                return undefined
+
+            if slot in scope.pending:
+                def pending_ident(frame, state):
+                    val = frame[slot]
+                    if type(val) is _PendingFlip:
+                        val = BoolType(state.rng.random() < val.prob)
+                        frame[slot] = val
+                    return val
+                return pending_ident
+
+            def ident_(frame, state):
+                return frame[slot]
+            return ident_
+
+        elif type(treeNode) is node.NotNode:
+            operand = self.recurseTree(treeNode.operand, scope)
+
+            def not_(frame, state):
+                return operand(frame, state).__not__()
+            return not_
+
+        elif isinstance(treeNode, node.UnaryNode):
+            operand = self.recurseTree(treeNode.operand, scope)
+            op = treeNode.op
+
+            def unary(frame, state):
+                return op(operand(frame, state))
+            return unary
+
+        elif isinstance(treeNode, node.BinaryNode):
+            return self.compileBinary(treeNode, scope)
+
+        elif type(treeNode) is node.AssignNode:
+            return self.compileAssign(treeNode, scope)
+
+        elif type(treeNode) is node.IfNode:
+            cond = self.recurseTree(treeNode.cond, scope)
+            true_expr = self.recurseTree(treeNode.true_expr, scope)
+            false_expr = self.recurseTree(treeNode.false_expr, scope)
+
+            if self.hasType(treeNode.cond, BoolType):
+                def checked_if(frame, state):
+                    if cond(frame, state).val:
+                        return true_expr(frame, state)
+                    else:
+                        return false_expr(frame, state)
+                return checked_if
+
+            def if_(frame, state):
+                cond_val = cond(frame, state)
+                if type(cond_val) is not BoolType:
+                    raise TypeError("Condition must be BoolType")
+                if cond_val.val:
+                    return true_expr(frame, state)
+                else:
+                    return false_expr(frame, state)
+            return if_
+
+        elif type(treeNode) is node.ObserveNode:
+            if self.likelihood_weighting:
+                weighted = self.compileWeightedObserve(treeNode, scope)
+                if weighted is not None:
+                    return weighted
+            observation = self.recurseTree(treeNode.observation, scope)
+
+            if self.hasType(treeNode.observation, BoolType):
+                def checked_observe(frame, state):
+                    if not observation(frame, state).val:
+                        state.observe_ok = False
+                    return BoolType(True)
+                return checked_observe
+
+            def observe(frame, state):
+                observation_val = observation(frame, state)
+                if not isinstance(observation_val, BoolType):
+                    raise TypeError("Can't observe a non-bool type")
+                if not observation_val.val:
+                    state.observe_ok = False
+                return BoolType(True)
+            return observe
+
+        elif type(treeNode) is node.TupleNode:
+            left = self.recurseTree(treeNode.left, scope)
+            right = self.recurseTree(treeNode.right, scope)
+
+            def tuple_(frame, state):
+                return TupleType(left(frame, state), right(frame, state))
+            return tuple_
+
+        elif type(treeNode) is node.FstNode:
+            tup = self.recurseTree(treeNode.tup, scope)
+
+            if self.hasType(treeNode.tup, TupleType):
+                def checked_fst(frame, state):
+                    return tup(frame, state).left
+                return checked_fst
+
+            def fst(frame, state):
+                tup_val = tup(frame, state)
+                if not isinstance(tup_val, TupleType):
+                    raise Exception("`fst` can only be used on tuples")
+                return tup_val.left
+            return fst
+
+        elif type(treeNode) is node.SndNode:
+            tup = self.recurseTree(treeNode.tup, scope)
+
+            if self.hasType(treeNode.tup, TupleType):
+                def checked_snd(frame, state):
+                    return tup(frame, state).right
+                return checked_snd
+
+            def snd(frame, state):
+                tup_val = tup(frame, state)
+                if not isinstance(tup_val, TupleType):
+                    raise Exception("`snd` can only be used on tuples")
+                return tup_val.right
+            return snd
+
+        elif type(treeNode) is node.ListNode:
+            items = [self.recurseTree(val, scope) for val in treeNode.lst]
+
+            def list_(frame, state):
+                return ListType([item(frame, state) for item in items], DiceType)
+            return list_
+
+        elif type(treeNode) is node.HeadNode:
+            lst = self.recurseTree(treeNode.lst, scope)
+
+            if self.hasType(treeNode.lst, ListType):
+                def checked_head(frame, state):
+                    return lst(frame, state).lst[0]
+                return checked_head
+
+            def head(frame, state):
+                lst_val = lst(frame, state)
+                if not isinstance(lst_val, ListType):
+                    raise Exception(f"`head` can only be used on lists (found {type(lst_val)})")
+                return lst_val.lst[0]
+            return head
+
+        elif type(treeNode) is node.TailNode:
+            lst = self.recurseTree(treeNode.lst, scope)
+
+            if self.hasType(treeNode.lst, ListType):
+                def checked_tail(frame, state):
+                    return ListType(lst(frame, state).lst[1:], DiceType)
+                return checked_tail
+
+            def tail(frame, state):
+                lst_val = lst(frame, state)
+                if not isinstance(lst_val, ListType):
+                    raise Exception("`tail` can only be used on lists")
+                return ListType(lst_val.lst[1:], DiceType)
+            return tail
+
+        elif type(treeNode) is node.LengthNode:
+            lst = self.recurseTree(treeNode.lst, scope)
+
+            if self.hasType(treeNode.lst, ListType):
+                def checked_length(frame, state):
+                    return IntType(4, len(lst(frame, state).lst))
+                return checked_length
+
+            def length(frame, state):
+                lst_val = lst(frame, state)
+                if not isinstance(lst_val, ListType):
+                    raise Exception("`length` can only be used on lists")
+                return IntType(4, len(lst_val.lst))
+            return length
+
+        else:
+            raise Exception("Tree Node Unknown:", treeNode)
+
+    # A chain of `let`s becomes one closure that runs its bindings in a loop,
+    # rather than a closure per `let`, since generated programs can have
+    # thousands of them
+    def compileAssign(self, treeNode: node.AssignNode, scope: _Scope):
+        old_slots = scope.slots
+        bindings = []
+        while type(treeNode) is node.AssignNode:
+            if self.likelihood_weighting and type(treeNode.val) is node.FlipNode \
+                    and _observesDirectly(treeNode.rest, treeNode.ident):
+                val = self.compilePendingFlip(treeNode)
+                slot, _ = scope.bind(treeNode.ident)
+                scope.pending.add(slot)
+            else:
+                val = self.recurseTree(treeNode.val, scope)
+                slot, _ = scope.bind(treeNode.ident)
+            bindings.append((slot, val))
+            treeNode = treeNode.rest
+        rest = self.recurseTree(treeNode, scope)
+        scope.slots = old_slots
+
+        if len(bindings) == 1:
+            [(slot, val)] = bindings
+
+            def assign(frame, state):
+                frame[slot] = val(frame, state)
+                return rest(frame, state)
+            return assign
+
+        def assign_chain(frame, state):
+            for slot, val in bindings:
+                frame[slot] = val(frame, state)
+            return rest(frame, state)
+        return assign_chain
+
+    def compilePendingFlip(self, treeNode: node.AssignNode):
+        pending = _PendingFlip(treeNode.val.prob)
+
+        def pending_flip(frame, state):
+            return pending
+        return pending_flip
+
+    # Returns None for observations that still have to reject samples
+    def compileWeightedObserve(self, treeNode: node.ObserveNode, scope: _Scope):
+        observation, observed_val = treeNode.observation, True
+        if type(observation) is node.NotNode:
+            observation, observed_val = observation.operand, False
+
+        if type(observation) is node.FlipNode:
+            likelihood = observation.prob if observed_val else 1 - observation.prob
+
+            def observe_flip(frame, state):
+                state.weight *= likelihood
+                return BoolType(True)
+            return observe_flip
+
+        if type(observation) is not node.IdentNode:
+            return None
+        slot = scope.lookup(observation.ident)
+        if slot not in scope.pending:
+            return None
+        observed = BoolType(observed_val)
+
+        def observe_pending(frame, state):
+            val = frame[slot]
+            if type(val) is _PendingFlip:
+                state.weight *= val.prob if observed_val else 1 - val.prob
+                frame[slot] = observed
+            elif val.val != observed_val:
+                state.observe_ok = False
+            return BoolType(True)
+        return observe_pending
+
+    # Integer operators on operands the checker has verified, by node type
+    CHECKED_INT_OPS = {
+        node.AddNode: lambda width, lhs, rhs: IntType(width, lhs + rhs),
+        node.SubNode: lambda width, lhs, rhs: IntType(width, lhs - rhs),
+        node.MulNode: lambda width, lhs, rhs: IntType(width, lhs * rhs),
+        node.DivNode: lambda width, lhs, rhs: IntType(width, lhs // rhs),
+        node.LessThanNode: lambda width, lhs, rhs: BoolType(lhs < rhs),
+    }
+
+    def compileBinary(self, treeNode: node.BinaryNode, scope: _Scope):
+        left = self.recurseTree(treeNode.left, scope)
+        right = self.recurseTree(treeNode.right, scope)
+
+        # With both operand types known, the operators that would check them
+        # again are inlined without the checks. The checker has already made
+        # sure integer widths match. Both operands are always evaluated, since
+        # either can draw random values or observe.
+        bools = self.hasType(treeNode.left, BoolType) and self.hasType(treeNode.right, BoolType)
+        ints = self.hasType(treeNode.left, IntType) and self.hasType(treeNode.right, IntType)
+        if bools and type(treeNode) is node.AndNode:
+            def checked_and(frame, state):
+                lhs, rhs = left(frame, state), right(frame, state)
+                return BoolType(lhs.val and rhs.val)
+            return checked_and
+
+        elif bools and type(treeNode) is node.OrNode:
+            def checked_or(frame, state):
+                lhs, rhs = left(frame, state), right(frame, state)
+                return BoolType(lhs.val or rhs.val)
+            return checked_or
+
+        elif ints and type(treeNode) in self.CHECKED_INT_OPS:
+            int_op = self.CHECKED_INT_OPS[type(treeNode)]
+
+            def checked_int(frame, state):
+                lhs, rhs = left(frame, state), right(frame, state)
+                return int_op(lhs.width, lhs.val, rhs.val)
+            return checked_int
+
+        # Otherwise the most common operators are inlined to skip a call
+        # through `op`
+        if type(treeNode) is node.AndNode:
+            def and_(frame, state):
+                return left(frame, state) & right(frame, state)
+            return and_
+
+        elif type(treeNode) is node.OrNode:
+            def or_(frame, state):
+                return left(frame, state) | right(frame, state)
+            return or_
+
+        elif type(treeNode) is node.EqualNode:
+            def eq(frame, state):
+                return left(frame, state) == right(frame, state)
+            return eq
+
+        elif type(treeNode) is node.AddNode:
+            def add(frame, state):
+                return left(frame, state) + right(frame, state)
+            return add
+
+        op = treeNode.op
+
+        def binary(frame, state):
+            return op(left(frame, state), right(frame, state))
+        return binary
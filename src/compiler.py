@@ -1,58 +1,173 @@
 # Contains code to do BDD compilation on our parsed tree
+import time
+
+import custom_distribution
 import node
-from dicetypes import DiceType, BoolType, IntType
-from pyeda.inter import *
+from bdd import BDDManager, BDDNode
+from ordering import ORDERINGS
+from dicetypes import DiceType, BoolType, IntType, TupleType, ListType
+
+
+# Compiled values mirror the DiceTypes: a bool is a single BDDNode, and the
+# classes below hold the BDDs for the parts of the other types.
+
+# An integer compiled to one BDD per bit. bits[0] is the least significant bit.
+class IntBits:
+    def __init__(self, bits: list[BDDNode]):
+        self.bits = bits
+        self.width = len(bits)
+
+    def __repr__(self):
+        return f"IntBits({self.width})"
+
+
+class TupleBits:
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+
+    def __repr__(self):
+        return f"TupleBits({self.left}, {self.right})"
+
+
+# Lists must have the same length on every path through the program
+class ListBits:
+    def __init__(self, items: list):
+        self.items = items
+
+    def __repr__(self):
+        return f"ListBits({', '.join(str(item) for item in self.items)})"
+
 
 class PyEdaCompiler:
-    def __init__(self, tree):
+    # Variables are indexed by rank * RANK_STRIDE + creation order, leaving
+    # room for every variable a rank could need
+    RANK_STRIDE = 1 << 32
+
+    def __init__(self, tree, ordering: str = "ast", sift: bool = False):
         self.tree = tree
+        self.bdd = BDDManager()
+        if ordering not in ORDERINGS:
+            raise ValueError(f"Unknown variable ordering: {ordering}")
+        self.ordering = ordering
+        self.sift = sift
+        if sift:
+            self.bdd.enable_reordering()
+        self.binding_rank = {}
+        self.current_rank = 0
+        self.var_seq = 0
+        self.stats = {}
         self.variable_asgn = {}
         self.flip_prob = {}
         self.flip_label = 0
+        self.function_params = {}
         self.function_to_node = {}
         self.function_to_compile = {}
         self.function_to_observe = {}
+        self.function_flips = {}
         self.adjacency_list = {}
         self.function_results = {}
+        # The condition for reaching the expression being compiled, and for
+        # dividing by zero somewhere in the program so far
+        self.path = self.bdd.one
+        self.div_by_zero = self.bdd.zero
+        self.function_to_div_by_zero = {}
     
     # infer should be run on a program, with no added context
     def infer(self) -> dict[DiceType, float]:
+        joint, observe_prob = self.infer_joint()
+        return {outcome: prob / observe_prob for outcome, prob in joint.items()}
+
+    # Like infer, but returns P(outcome and evidence) for every outcome along
+    # with P(evidence), without normalizing. Any variables already in
+    # `variable_asgn` are visible to the program.
+    def infer_joint(self) -> tuple[dict[DiceType, float], float]:
         if type(self.tree) is not node.ProgramNode:
             raise Exception("infer() should only be run on root program nodes")
         self.precomputeFunc(self.tree, None)
         function_list = self.topoSort()
         if len(function_list) != len(self.function_to_node):
             raise Exception("recursion/mutual recursive functions detected")
+        start = time.perf_counter()
+        self.binding_rank = ORDERINGS[self.ordering](self.tree)
         for function in function_list:
             self.compileFunc(function)
-        return self.infer_tree(self.tree)
+        self.current_rank = self.binding_rank.get(None, 0)
+        return self.joint_tree(self.tree, start)
 
     # infer_tree carries all the extra scoping that has already been added in program
-    def infer_tree(self, tree) -> dict[DiceType, float]:
-        expr, observe = self.recurseTree(tree)
-        bdd = expr2bdd(And(expr, observe))
-        prob = 0.0
-        for satisfiability in list(bdd.satisfy_all()):
-            clause_prob = 1.0
-            for var, val in satisfiability.items():
-                var = str(var)
-                if val == 0:
-                    clause_prob *= 1.0 - self.flip_prob[var]
-                else:
-                    clause_prob *= self.flip_prob[var]
-            prob += clause_prob
-        observe_bdd = expr2bdd(observe)
-        observe_prob = 0.0
-        for satisfiability in list(observe_bdd.satisfy_all()):
-            clause_prob = 1.0
-            for var, val in satisfiability.items():
-                var = str(var)
-                if val == 0:
-                    clause_prob *= 1.0 - self.flip_prob[var]
-                else:
-                    clause_prob *= self.flip_prob[var]
-            observe_prob += clause_prob
-        return {BoolType(True): prob/observe_prob, BoolType(False): (observe_prob-prob)/observe_prob}
+    def infer_tree(self, tree, start: float | None = None) -> dict[DiceType, float]:
+        joint, observe_prob = self.joint_tree(tree, start)
+        return {outcome: prob / observe_prob for outcome, prob in joint.items()}
+
+    def joint_tree(self, tree, start: float | None = None) -> tuple[dict[DiceType, float], float]:
+        start = start if start is not None else time.perf_counter()
+        value, observe = self.recurseTree(tree)
+        # Samplers raise as soon as they divide by zero, whatever the
+        # evidence, so any way to do it rejects the program
+        if self.div_by_zero is not self.bdd.zero:
+            raise ZeroDivisionError("integer division or modulo by zero")
+        self.stats["compile_time"] = time.perf_counter() - start
+        if self.sift:
+            # Reordering only starts once the BDDs have grown large, so the
+            # finished ones are sifted once more
+            self.bdd.sift()
+            self.stats["sift_time"] = self.bdd.sift_time
+            self.stats["num_reorders"] = self.bdd.num_reorders
+        self.stats["bdd_size"] = self.bdd.size(*self.flattenBits(value), observe)
+        self.stats["num_vars"] = len(self.bdd.support(*self.flattenBits(value), observe))
+        if type(value) is not BDDNode:
+            return self.joint_value(value, observe)
+        prob, observe_prob = self.bdd.wmc_with_evidence(value, observe, self.flip_prob)
+        return {BoolType(True): prob, BoolType(False): observe_prob - prob}, observe_prob
+
+    # Returns the joint distribution of every bit of `value` with the
+    # evidence. The evidence is split on one output bit at a time, so only
+    # the outcomes that are actually possible get enumerated.
+    def joint_value(self, value, observe: BDDNode) -> tuple[dict[DiceType, float], float]:
+        bdd = self.bdd
+        bits = self.flattenBits(value)
+        wmc_cache = {}
+        observe_prob = bdd.wmc(observe, self.flip_prob, wmc_cache)
+        results = {}
+
+        def split(i, cond, assignment):
+            if cond is bdd.zero:
+                return
+            if i == len(bits):
+                prob = bdd.wmc(cond, self.flip_prob, wmc_cache)
+                if prob > 0:
+                    results[self.decodeBits(value, iter(assignment))] = prob
+                return
+            for val, literal in ((False, bdd.not_(bits[i])), (True, bits[i])):
+                assignment.append(val)
+                split(i + 1, bdd.and_(cond, literal), assignment)
+                assignment.pop()
+
+        split(0, observe, [])
+        return results, observe_prob
+
+    def flattenBits(self, value) -> list[BDDNode]:
+        if type(value) is BDDNode:
+            return [value]
+        elif type(value) is IntBits:
+            return value.bits
+        elif type(value) is TupleBits:
+            return self.flattenBits(value.left) + self.flattenBits(value.right)
+        else:
+            return [bit for item in value.items for bit in self.flattenBits(item)]
+
+    # Rebuilds the DiceType for `value` from the values of its flattened bits
+    def decodeBits(self, value, assignment) -> DiceType:
+        if type(value) is BDDNode:
+            return BoolType(next(assignment))
+        elif type(value) is IntBits:
+            return IntType(value.width, sum(next(assignment) << i for i in range(value.width)))
+        elif type(value) is TupleBits:
+            left = self.decodeBits(value.left, assignment)
+            return TupleType(left, self.decodeBits(value.right, assignment))
+        else:
+            return ListType([self.decodeBits(item, assignment) for item in value.items], DiceType)
 
     # this tracks all call sites to make sure no recursion or mutual recursion happens
     def precomputeFunc(self, treeNode, curr_func):
@@ -67,7 +182,9 @@ class PyEdaCompiler:
             self.precomputeFunc(treeNode.expr, curr_func)
 
         elif type(treeNode) is node.FunctionCallNode:
-            self.adjacency_list[treeNode.ident].add(curr_func)
+            # Undefined functions are reported when the call is compiled
+            if treeNode.ident in self.adjacency_list:
+                self.adjacency_list[treeNode.ident].add(curr_func)
             arg_expr = treeNode.arg_list_node.args
             for argument in arg_expr:
                 self.precomputeFunc(argument, curr_func)
@@ -75,12 +192,25 @@ class PyEdaCompiler:
         elif isinstance(treeNode, node.UnaryNode):
             self.precomputeFunc(treeNode.operand, curr_func)
 
-        elif isinstance(treeNode, node.BinaryNode):
+        elif isinstance(treeNode, (node.BinaryNode, node.TupleNode)):
             self.precomputeFunc(treeNode.left, curr_func)
             self.precomputeFunc(treeNode.right, curr_func)
 
         elif isinstance(treeNode, node.AssignNode):
-            self.precomputeFunc(treeNode.rest, curr_func)
+            while isinstance(treeNode, node.AssignNode):
+                self.precomputeFunc(treeNode.val, curr_func)
+                treeNode = treeNode.rest
+            self.precomputeFunc(treeNode, curr_func)
+
+        elif isinstance(treeNode, (node.FstNode, node.SndNode)):
+            self.precomputeFunc(treeNode.tup, curr_func)
+
+        elif type(treeNode) is node.ListNode:
+            for item in treeNode.lst:
+                self.precomputeFunc(item, curr_func)
+
+        elif isinstance(treeNode, (node.HeadNode, node.TailNode, node.LengthNode)):
+            self.precomputeFunc(treeNode.lst, curr_func)
 
         elif isinstance(treeNode, node.IfNode):
             self.precomputeFunc(treeNode.cond, curr_func)
@@ -115,143 +245,440 @@ class PyEdaCompiler:
             queue_pos += 1
         return topo_list
 
+    # Compiles each function once into a summary: its result and observe BDDs
+    # over free variables for its parameters. processFunc substitutes the
+    # arguments into the summary at each call site.
     def compileFunc(self, func):
         expr, formal_param_list = self.function_to_node[func].expr, self.function_to_node[func].arg_list_node.args
+        # Function bodies only see their own parameters
+        outer_asgn, self.variable_asgn = self.variable_asgn, {}
+        outer_path, outer_div_by_zero = self.path, self.div_by_zero
+        self.path, self.div_by_zero = self.bdd.one, self.bdd.zero
+        params = []
         for formal_param in formal_param_list:
-            self.variable_asgn[str(formal_param.ident)] = None #dummy values and a hack - these never get filled!
-        eda_expr, eda_observe = self.recurseTree(expr)
-        compiled_bdd = expr2bdd(eda_expr)
-        self.function_to_compile[func] = list(compiled_bdd.satisfy_all())
-        compiled_observe_bdd = expr2bdd(eda_observe)
-        self.function_to_observe[func] = list(compiled_observe_bdd.satisfy_all())
-    
-    def processFunc(self, treeNode) -> expr:
+            param = self.paramValue(f"{func}.{formal_param.ident}", formal_param.type)
+            params.append(param)
+            self.variable_asgn[str(formal_param.ident)] = param
+        compiled_value, compiled_observe_bdd = self.recurseTree(expr)
+        div_by_zero = self.div_by_zero
+        self.variable_asgn = outer_asgn
+        self.path, self.div_by_zero = outer_path, outer_div_by_zero
+
+        self.function_params[func] = params
+        self.function_to_compile[func] = compiled_value
+        self.function_to_observe[func] = compiled_observe_bdd
+        self.function_to_div_by_zero[func] = div_by_zero
+        # The flips a call has to make fresh copies of
+        self.function_flips[func] = [
+            var for var in self.bdd.support(*self.flattenBits(compiled_value),
+                                            compiled_observe_bdd, div_by_zero)
+            if var in self.flip_prob
+        ]
+
+    # A value of the given type made of fresh, unweighted variables
+    def paramValue(self, name: str, param_type: DiceType):
+        if type(param_type) is BoolType:
+            return self.bdd.var(self.newVar(name))
+        elif type(param_type) is IntType:
+            return IntBits([
+                self.bdd.var(self.newVar(f"{name}[{i}]")) for i in range(param_type.width)
+            ])
+        elif type(param_type) is TupleType:
+            return TupleBits(
+                self.paramValue(f"{name}.0", param_type.left),
+                self.paramValue(f"{name}.1", param_type.right),
+            )
+        raise NotImplementedError("PyDice does not support BDD inference on"
+            + " functions with list parameters")
+
+    # The type of a compiled value, ignoring the bits themselves
+    def shapeOf(self, value):
+        if type(value) is BDDNode:
+            return "bool"
+        elif type(value) is IntBits:
+            return ("int", value.width)
+        elif type(value) is TupleBits:
+            return (self.shapeOf(value.left), self.shapeOf(value.right))
+        else:
+            return ["list"] + [self.shapeOf(item) for item in value.items]
+
+    # Rebuilds `value` with `fn` applied to each of its bits
+    def mapBits(self, value, fn):
+        if type(value) is BDDNode:
+            return fn(value)
+        elif type(value) is IntBits:
+            return IntBits([fn(bit) for bit in value.bits])
+        elif type(value) is TupleBits:
+            return TupleBits(self.mapBits(value.left, fn), self.mapBits(value.right, fn))
+        else:
+            return ListBits([self.mapBits(item, fn) for item in value.items])
+
+    # Places a variable by the rank of the binding being compiled
+    def newVar(self, name: str) -> int:
+        index = self.current_rank * self.RANK_STRIDE + self.var_seq
+        self.var_seq += 1
+        return self.bdd.new_var(name, index)
+
+    def newFlip(self, prob: float) -> BDDNode:
+        flip_var = self.newVar(f"f{self.flip_label}")
+        self.flip_prob[flip_var] = prob
+        self.flip_label += 1
+        return self.bdd.var(flip_var)
+
+    # Encodes a distribution over ints as a chain of flips: the first outcome
+    # is picked with its own probability, and each later one with its
+    # probability conditioned on none of the earlier ones being picked
+    def compileDistribution(self, dist: custom_distribution.CustomDistribution) -> IntBits:
+        outcomes = [(outcome, prob) for outcome, prob in dist.pmf().items() if prob > 0]
+        if not outcomes:
+            raise ValueError("Distribution has no possible outcomes")
+        widths = {outcome.width for outcome, _ in outcomes}
+        if len(widths) != 1:
+            raise TypeError("Distribution outcomes must all have the same width")
+        width = widths.pop()
+
+        value = self.intConstant(outcomes[-1][0].val, width)
+        remaining = outcomes[-1][1]
+        for outcome, prob in reversed(outcomes[:-1]):
+            remaining += prob
+            flip = self.newFlip(min(prob / remaining, 1.0))
+            value = self.iteValue(flip, self.intConstant(outcome.val, width), value)
+        return value
+
+    ### Bit-blasted integer operations ########################################
+
+    def intConstant(self, val: int, width: int) -> IntBits:
+        return IntBits([self.bdd.constant((val >> i) & 1) for i in range(width)])
+
+    # The compiled form of a known value
+    def constantValue(self, val: DiceType):
+        if type(val) is BoolType:
+            return self.bdd.constant(val.val)
+        elif type(val) is IntType:
+            return self.intConstant(val.val, val.width)
+        elif type(val) is TupleType:
+            return TupleBits(self.constantValue(val.left), self.constantValue(val.right))
+        elif type(val) is ListType:
+            return ListBits([self.constantValue(item) for item in val.lst])
+        raise TypeError(f"Not a value: {val}")
+
+    def iteValue(self, cond: BDDNode, true_val, false_val):
+        if type(true_val) is BDDNode and type(false_val) is BDDNode:
+            return self.bdd.ite(cond, true_val, false_val)
+        if type(true_val) is IntBits and type(false_val) is IntBits \
+                and true_val.width == false_val.width:
+            return IntBits([
+                self.bdd.ite(cond, t, f) for t, f in zip(true_val.bits, false_val.bits)
+            ])
+        if type(true_val) is TupleBits and type(false_val) is TupleBits:
+            return TupleBits(
+                self.iteValue(cond, true_val.left, false_val.left),
+                self.iteValue(cond, true_val.right, false_val.right),
+            )
+        if type(true_val) is ListBits and type(false_val) is ListBits \
+                and len(true_val.items) == len(false_val.items):
+            return ListBits([
+                self.iteValue(cond, t, f) for t, f in zip(true_val.items, false_val.items)
+            ])
+        raise NotImplementedError("PyDice only supports BDD inference on"
+            + " if-branches of the same type")
+
+    def verifyBools(self, *values):
+        for value in values:
+            if type(value) is not BDDNode:
+                raise TypeError("Boolean operation must act on two booleans")
+
+    def verifyInts(self, lhs, rhs):
+        if type(lhs) is not IntBits or type(rhs) is not IntBits:
+            raise TypeError("Integer operation must act on two integers")
+        if lhs.width != rhs.width:
+            raise TypeError(
+                f"Integer operands must be equal widths ({lhs.width} != {rhs.width})"
+            )
+
+    # Ripple-carry adder, dropping the final carry like IntType does
+    def addBits(self, lhs: IntBits, rhs: IntBits, carry: BDDNode | None = None) -> IntBits:
+        bdd = self.bdd
+        carry = bdd.zero if carry is None else carry
+        bits = []
+        for a, b in zip(lhs.bits, rhs.bits):
+            a_xor_b = bdd.xor(a, b)
+            bits.append(bdd.xor(a_xor_b, carry))
+            carry = bdd.or_(bdd.and_(a, b), bdd.and_(carry, a_xor_b))
+        return IntBits(bits)
+
+    # a - b = a + ~b + 1
+    def subBits(self, lhs: IntBits, rhs: IntBits) -> IntBits:
+        negated = IntBits([self.bdd.not_(b) for b in rhs.bits])
+        return self.addBits(lhs, negated, self.bdd.one)
+
+    # Shift-and-add multiplier
+    def mulBits(self, lhs: IntBits, rhs: IntBits) -> IntBits:
+        bdd = self.bdd
+        product = self.intConstant(0, lhs.width)
+        for i, b in enumerate(rhs.bits):
+            shifted = self.shiftBits(lhs, i)
+            partial = IntBits([bdd.and_(b, s) for s in shifted.bits])
+            product = self.addBits(product, partial)
+        return product
+
+    # Restoring long division. Where the divisor is zero the quotient is all
+    # ones, but the program is rejected if that can happen on a path that
+    # reaches the division.
+    def divBits(self, lhs: IntBits, rhs: IntBits) -> IntBits:
+        bdd = self.bdd
+        zero = self.equalBits(rhs, self.intConstant(0, rhs.width))
+        self.div_by_zero = bdd.or_(self.div_by_zero, bdd.and_(self.path, zero))
+        width = lhs.width
+        remainder = self.intConstant(0, width)
+        quotient = [bdd.zero] * width
+        for i in reversed(range(width)):
+            # The bit shifted out of the remainder also makes it >= the divisor
+            overflow = remainder.bits[-1]
+            remainder = IntBits([lhs.bits[i]] + remainder.bits[:-1])
+            fits = bdd.or_(overflow, bdd.not_(self.lessThanBits(remainder, rhs)))
+            remainder = self.iteValue(fits, self.subBits(remainder, rhs), remainder)
+            quotient[i] = fits
+        return IntBits(quotient)
+
+    def equalBits(self, lhs: IntBits, rhs: IntBits) -> BDDNode:
+        bdd = self.bdd
+        # Ints of different widths are never equal, like DiceType.__eq__
+        if lhs.width != rhs.width:
+            return bdd.zero
+        res = bdd.one
+        for a, b in zip(lhs.bits, rhs.bits):
+            res = bdd.and_(res, bdd.iff(a, b))
+        return res
+
+    def lessThanBits(self, lhs: IntBits, rhs: IntBits) -> BDDNode:
+        bdd = self.bdd
+        # Walk up from the LSB: a higher bit that differs decides the result
+        res = bdd.zero
+        for a, b in zip(lhs.bits, rhs.bits):
+            res = bdd.ite(bdd.iff(a, b), res, b)
+        return res
+
+    # Positive amounts shift left, negative ones shift right
+    def shiftBits(self, value: IntBits, amt: int) -> IntBits:
+        zero = self.bdd.zero
+        if amt >= 0:
+            bits = [zero] * min(amt, value.width) + value.bits[:max(value.width - amt, 0)]
+        else:
+            bits = value.bits[-amt:] + [zero] * min(-amt, value.width)
+        return IntBits(bits)
+
+    # Bits are indexed from the MSB, like NthBitNode.nth_bit
+    def nthBit(self, n: IntBits, number: IntBits) -> BDDNode:
+        bdd = self.bdd
+        res = bdd.zero
+        for idx in range(min(number.width, 1 << n.width)):
+            is_idx = self.equalBits(n, self.intConstant(idx, n.width))
+            res = bdd.or_(res, bdd.and_(is_idx, number.bits[number.width - idx - 1]))
+        return res
+
+    def equalValues(self, lhs, rhs) -> BDDNode:
+        bdd = self.bdd
+        if type(lhs) is BDDNode and type(rhs) is BDDNode:
+            return bdd.iff(lhs, rhs)
+        if type(lhs) in (TupleBits, ListBits) or type(rhs) in (TupleBits, ListBits):
+            if type(lhs) is not type(rhs):
+                return bdd.zero
+            if type(lhs) is TupleBits:
+                return bdd.and_(
+                    self.equalValues(lhs.left, rhs.left),
+                    self.equalValues(lhs.right, rhs.right),
+                )
+            if len(lhs.items) != len(rhs.items):
+                return bdd.zero
+            res = bdd.one
+            for left, right in zip(lhs.items, rhs.items):
+                res = bdd.and_(res, self.equalValues(left, right))
+            return res
+        # A bool never equals an int, like DiceType.__eq__
+        if type(lhs) is not type(rhs):
+            return bdd.zero
+        return self.equalBits(lhs, rhs)
+
+    def processFunc(self, treeNode):
         ident, arg_expr_list = treeNode.ident, treeNode.arg_list_node.args
-        parameter_expression = {}
         # Check if function exists
         if( ident not in self.function_to_node ):
             raise Exception("Function identifier not defined:", ident)
         formal_param_list = self.function_to_node[ident].arg_list_node.args
-        formal_param_list_names = []
-        for formal_param in formal_param_list:
-            formal_param_list_names.append(formal_param.ident)
         if len(arg_expr_list) != len(formal_param_list):
             raise AttributeError(f"Argument Length does not match: Param len {len( formal_param_list )} != Arg len {len(arg_expr_list)}")
-        clause_of_observes= []
-        for arg_expr, formal_param in zip(arg_expr_list, formal_param_list_names):
-            arg_expr_compiled, observed_compiled = self.recurseTree(arg_expr)
-            parameter_expression[formal_param] = arg_expr_compiled
-            clause_of_observes.append(observed_compiled)
-        list_of_clauses = []
-        reset_flips = {}
-        for satisfiability in self.function_to_compile[ident]:
-            clause_expr = []
-            for var, val in satisfiability.items():
-                var = str(var)
-                literal = None
-                if var in formal_param_list_names:
-                    literal = parameter_expression[var]
-                else:
-                    # this has to be a flip
-                    probability = self.flip_prob[var]
-                    # we need to reset flips so that they are independent between function calls
-                    # see paper section 4.3 for more details
-                    if var not in reset_flips:
-                        flip_var = exprvar('f', self.flip_label)
-                        reset_flips[var] = str(flip_var)
-                        self.flip_prob[str(flip_var)] = probability
-                        self.flip_label += 1
-                        literal = flip_var
-                    else:
-                        literal = reset_flips[var]
-                if val == 0:
-                    literal = Not(literal)
-                clause_expr.append(literal)
-            list_of_clauses.append(And(*clause_expr))
-        # do same substitution for observes
-        list_of_observes = []
-        for satisfiability in self.function_to_observe[ident]:
-            clause_expr = []
-            for var, val in satisfiability.items():
-                var = str(var)
-                literal = None
-                if var in formal_param_list_names:
-                    literal = parameter_expression[var]
-                else:
-                    # this has to be a flip
-                    probability = self.flip_prob[var]
-                    # we need to reset flips so that they are independent between function calls
-                    # see paper section 4.3 for more details
-                    if var not in reset_flips:
-                        flip_var = exprvar('f', self.flip_label)
-                        reset_flips[var] = str(flip_var)
-                        self.flip_prob[str(flip_var)] = probability
-                        self.flip_label += 1
-                        literal = flip_var
-                    else:
-                        literal = reset_flips[var]
-                if val == 0:
-                    literal = Not(literal)
-                clause_expr.append(literal)
-            list_of_observes.append(And(*clause_expr))
-
-        return Or(*list_of_clauses), And(And(*clause_of_observes), Or(*list_of_observes))
-
-    def recurseTree(self, treeNode)-> (expr, expr):
+        clause_of_observes = self.bdd.one
+        substitution = {}
+        for arg_expr, formal_param, param in zip(arg_expr_list, formal_param_list, self.function_params[ident]):
+            arg_compiled, observed_compiled = self.recurseTree(arg_expr)
+            if self.shapeOf(arg_compiled) != self.shapeOf(param):
+                raise TypeError(f"Argument for parameter {formal_param.ident} does not match its type")
+            for param_bit, arg_bit in zip(self.flattenBits(param), self.flattenBits(arg_compiled)):
+                substitution[param_bit.var] = arg_bit
+            clause_of_observes = self.bdd.and_(clause_of_observes, observed_compiled)
+
+        # we need to reset flips so that they are independent between function calls
+        # see paper section 4.3 for more details
+        for flip_var in self.function_flips[ident]:
+            substitution[flip_var] = self.newFlip(self.flip_prob[flip_var])
+
+        # The result and the observes share one memo, since they usually
+        # share most of their nodes
+        memo = {}
+        result = self.mapBits(
+            self.function_to_compile[ident],
+            lambda bit: self.bdd.compose(bit, substitution, memo),
+        )
+        observe = self.bdd.compose(self.function_to_observe[ident], substitution, memo)
+        div_by_zero = self.bdd.compose(self.function_to_div_by_zero[ident], substitution, memo)
+        self.div_by_zero = self.bdd.or_(self.div_by_zero, self.bdd.and_(self.path, div_by_zero))
+        return result, self.bdd.and_(clause_of_observes, observe)
+
+    INT_OPS = {
+        node.AddNode: addBits,
+        node.SubNode: subBits,
+        node.MulNode: mulBits,
+        node.DivNode: divBits,
+        node.LessThanNode: lessThanBits,
+    }
+
+    # Returns the compiled value of `treeNode`, and the BDD for the
+    # observations made while computing it
+    def recurseTree(self, treeNode) -> (BDDNode | IntBits | TupleBits | ListBits, BDDNode):
+        bdd = self.bdd
         if type(treeNode) is node.ProgramNode:
-            # no support for functions at this time
             return self.recurseTree( treeNode.expr )
-        elif type(treeNode) is BoolType:
-            if treeNode.val == True:
-                return expr(1), expr(1)
-            else:
-                return expr(0), expr(1)
+        elif isinstance(treeNode, DiceType):
+            # Folding in the optimizer can also leave tuple and list constants
+            return self.constantValue(treeNode), bdd.one
 
         elif type(treeNode) is node.FlipNode:
-            flip_var = exprvar('f', self.flip_label)
-            self.flip_prob[str(flip_var)] = treeNode.prob
-            self.flip_label += 1
-            return flip_var, expr(1)
+            return self.newFlip(treeNode.prob), bdd.one
+
+        elif isinstance(treeNode, custom_distribution.CustomDistribution):
+            return self.compileDistribution(treeNode), bdd.one
 
         elif type(treeNode) is node.AndNode:
             lhs, lhs_observe = self.recurseTree(treeNode.left)
             rhs, rhs_observe = self.recurseTree(treeNode.right)
-            return expr(And(lhs, rhs)), expr(And(lhs_observe, rhs_observe))
+            self.verifyBools(lhs, rhs)
+            return bdd.and_(lhs, rhs), bdd.and_(lhs_observe, rhs_observe)
 
         elif type(treeNode) is node.OrNode:
             lhs, lhs_observe = self.recurseTree(treeNode.left)
             rhs, rhs_observe = self.recurseTree(treeNode.right)
-            return expr(Or(lhs, rhs)), expr(And(lhs_observe, rhs_observe))
-        
+            self.verifyBools(lhs, rhs)
+            return bdd.or_(lhs, rhs), bdd.and_(lhs_observe, rhs_observe)
+
         elif type(treeNode) is node.NotNode:
             operand, observe = self.recurseTree(treeNode.operand)
-            return expr(Not(operand)), observe
+            self.verifyBools(operand)
+            return bdd.not_(operand), observe
+
+        elif type(treeNode) is node.EqualNode:
+            lhs, lhs_observe = self.recurseTree(treeNode.left)
+            rhs, rhs_observe = self.recurseTree(treeNode.right)
+            return self.equalValues(lhs, rhs), bdd.and_(lhs_observe, rhs_observe)
+
+        elif type(treeNode) in self.INT_OPS:
+            lhs, lhs_observe = self.recurseTree(treeNode.left)
+            rhs, rhs_observe = self.recurseTree(treeNode.right)
+            self.verifyInts(lhs, rhs)
+            value = self.INT_OPS[type(treeNode)](self, lhs, rhs)
+            return value, bdd.and_(lhs_observe, rhs_observe)
+
+        elif type(treeNode) is node.NthBitNode:
+            n, n_observe = self.recurseTree(treeNode.left)
+            number, number_observe = self.recurseTree(treeNode.right)
+            if type(n) is not IntBits or type(number) is not IntBits:
+                raise TypeError("nth_bit can only take IntTypes")
+            return self.nthBit(n, number), bdd.and_(n_observe, number_observe)
+
+        elif type(treeNode) in (node.LeftShiftNode, node.RightShiftNode):
+            operand, observe = self.recurseTree(treeNode.operand)
+            if type(operand) is not IntBits:
+                raise TypeError("Can only shift an integer")
+            amt = treeNode.amt if type(treeNode) is node.LeftShiftNode else -treeNode.amt
+            return self.shiftBits(operand, amt), observe
 
         elif type(treeNode) is node.IfNode:
-            cond, _ = self.recurseTree(treeNode.cond)
+            cond, cond_observe = self.recurseTree(treeNode.cond)
+            self.verifyBools(cond)
+            outer_path = self.path
+            self.path = bdd.and_(outer_path, cond)
             true_expr, true_observe = self.recurseTree(treeNode.true_expr)
+            self.path = bdd.and_(outer_path, bdd.not_(cond))
             false_expr, false_observe = self.recurseTree(treeNode.false_expr)
-            return expr(Or(And(cond, true_expr), And(Not(cond), false_expr))), expr(Or(And(cond, true_observe), And(Not(cond), false_observe)))
-        
+            self.path = outer_path
+            return self.iteValue(cond, true_expr, false_expr), bdd.and_(cond_observe, bdd.ite(cond, true_observe, false_observe))
+
         elif type(treeNode) is node.IdentNode:
             if treeNode.ident not in self.variable_asgn:
                 raise Exception("Identifier not defined:", treeNode.ident)
-            if self.variable_asgn[str(treeNode.ident)] == None:
-                return exprvar(treeNode.ident), expr(1)
-            return self.variable_asgn[str(treeNode.ident)], expr(1) 
+            return self.variable_asgn[str(treeNode.ident)], bdd.one
 
         elif type(treeNode) is node.AssignNode:
-            var_value, var_observe = self.recurseTree(treeNode.val)
-            self.variable_asgn[str(treeNode.ident)] = var_value
-            rest_value, rest_observe = self.recurseTree(treeNode.rest)
-            return rest_value, And(var_observe, rest_observe)
-            
+            # A loop rather than recursion down the chain of `let`s, since
+            # generated programs can have thousands of them
+            outer_rank = self.current_rank
+            observe = bdd.one
+            while type(treeNode) is node.AssignNode:
+                self.current_rank = self.binding_rank.get(treeNode, outer_rank)
+                var_value, var_observe = self.recurseTree(treeNode.val)
+                self.current_rank = outer_rank
+                self.variable_asgn[str(treeNode.ident)] = var_value
+                observe = bdd.and_(observe, var_observe)
+                treeNode = treeNode.rest
+            rest_value, rest_observe = self.recurseTree(treeNode)
+            return rest_value, bdd.and_(observe, rest_observe)
+
         elif type(treeNode) is node.FunctionCallNode:
             return self.processFunc(treeNode)
 
         elif type(treeNode) is node.ObserveNode:
-            obs_val, _ = self.recurseTree(treeNode.observation)
-            return expr(1), obs_val
+            obs_val, obs_observe = self.recurseTree(treeNode.observation)
+            if type(obs_val) is not BDDNode:
+                raise TypeError("Can't observe a non-bool type")
+            return bdd.one, bdd.and_(obs_val, obs_observe)
+
+        elif type(treeNode) is node.TupleNode:
+            left, left_observe = self.recurseTree(treeNode.left)
+            right, right_observe = self.recurseTree(treeNode.right)
+            return TupleBits(left, right), bdd.and_(left_observe, right_observe)
+
+        elif type(treeNode) in (node.FstNode, node.SndNode):
+            tup, observe = self.recurseTree(treeNode.tup)
+            if type(tup) is not TupleBits:
+                raise Exception("`fst` and `snd` can only be used on tuples")
+            return (tup.left if type(treeNode) is node.FstNode else tup.right), observe
+
+        elif type(treeNode) is node.ListNode:
+            items, observe = [], bdd.one
+            for item in treeNode.lst:
+                item_value, item_observe = self.recurseTree(item)
+                items.append(item_value)
+                observe = bdd.and_(observe, item_observe)
+            return ListBits(items), observe
+
+        elif type(treeNode) is node.ConcatNode:
+            item, item_observe = self.recurseTree(treeNode.left)
+            lst, lst_observe = self.recurseTree(treeNode.right)
+            if type(lst) is not ListBits:
+                raise TypeError("Must concatenate onto a list")
+            return ListBits([item] + lst.items), bdd.and_(item_observe, lst_observe)
+
+        elif type(treeNode) in (node.HeadNode, node.TailNode, node.LengthNode):
+            lst, observe = self.recurseTree(treeNode.lst)
+            if type(lst) is not ListBits:
+                raise Exception("`head`, `tail` and `length` can only be used on lists")
+            if type(treeNode) is node.HeadNode:
+                if not lst.items:
+                    raise IndexError("`head` of an empty list")
+                return lst.items[0], observe
+            elif type(treeNode) is node.TailNode:
+                return ListBits(lst.items[1:]), observe
+            return self.intConstant(len(lst.items), 4), observe
 
         else:
             raise NotImplementedError("PyDice does not support BDD inference on"
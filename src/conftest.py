@@ -0,0 +1,15 @@
+import os
+
+import pytest
+
+
+# Nothing a test runs should write to the real cache directory
+@pytest.fixture(autouse=True, scope="session")
+def cache_home(tmp_path_factory):
+    old = os.environ.get("XDG_CACHE_HOME")
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path_factory.mktemp("cache"))
+    yield
+    if old is None:
+        del os.environ["XDG_CACHE_HOME"]
+    else:
+        os.environ["XDG_CACHE_HOME"] = old
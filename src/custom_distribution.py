@@ -1,7 +1,9 @@
+import hashlib
 import importlib
-import inspect
+import json
 import os
 import pathlib
+import random
 from dicetypes import DiceType
 from node import ExprNode
 
@@ -11,35 +13,51 @@ class CustomDistribution(ExprNode):
     def __init__(self, *args):
         self.args: tuple = args
 
-    def sample(self) -> DiceType:
+    # Draws one value using only `rng`, the caller's random.Random, so that
+    # seeded runs are reproducible and parallel workers stay independent
+    def sample(self, rng: random.Random) -> DiceType:
         raise NotImplementedError("You must inherit from CustomDistribution")
 
+    # Draws `n` values at once from `rng`, a numpy Generator. Returns their
+    # bit width and a uint64 array of the values. Override this to skip the
+    # per-sample Python overhead; by default it just calls `sample` n times.
+    def sample_n(self, rng, n: int):
+        import numpy as np
 
-### Gather custom distributions from the distributions/ folder
+        py_rng = random.Random(int(rng.integers(2**63)))
+        samples = [self.sample(py_rng) for _ in range(n)]
+        width = (samples[0] if samples else self.sample(py_rng)).width
+        return width, np.array([sample.val for sample in samples], dtype=np.uint64)
 
-_pkg_name = "distributions"
-_dir = os.path.join(pathlib.Path(__file__).parent.resolve(), _pkg_name)
+    # Optional: the type of every value this draws, e.g. IntType(4, 0) for
+    # 4-bit integers, which lets programs be type checked before sampling.
+    # None means it isn't known up front.
+    def result_type(self) -> DiceType | None:
+        return None
 
-distribution_module_names: list[str] = [
-    f[:-3]
-    for f in os.listdir(_dir)
-    if f.endswith(".py") and f != "__init__.py"
-]
+    # Optional: the probability of every possible outcome, used for exact
+    # (BDD) inference. Distributions that don't override this can only be
+    # sampled.
+    def pmf(self) -> dict[DiceType, float]:
+        raise NotImplementedError(f"{type(self).__name__} does not support exact inference")
 
-distribution_class_names: list[str] = []
-distribution_classes: list[type] = []
 
-for module_name in distribution_module_names:
-    module = importlib.import_module(f"{_pkg_name}.{module_name}")
+### Gather custom distributions from the distributions/ folder
+#
+# Building the grammar only needs each distribution's NAME and ARG_TYPES, so
+# rather than importing every plugin (and everything it imports) on every
+# run, those are kept in a manifest. With caching on, ProgramCache keeps the
+# manifest in its directory, and it is rebuilt whenever a file in
+# distributions/ is added, removed or changed. Otherwise every plugin is
+# imported to build it. Either way, it is only built once something needs
+# it, and a plugin's module is only imported once a program uses it.
+
+_pkg_name = "distributions"
+_dir = os.path.join(pathlib.Path(__file__).parent.resolve(), _pkg_name)
 
-    # Automatically collect all classes defined in the module
-    for name, obj in inspect.getmembers(module, inspect.isclass):
-        # Only collect classes defined in the module (not imported ones)
-        if obj.__module__ == f"{_pkg_name}.{module_name}":
-            distribution_class_names.append(name)
-            distribution_classes.append(obj)
+# Bump this when the format of the manifest changes
+_MANIFEST_VERSION = 1
 
-assert len(distribution_classes) > 0
 
 def _type_to_string(arg_type) -> str:
     if arg_type == int:
@@ -53,15 +71,119 @@ def _type_to_string(arg_type) -> str:
     raise TypeError("Custom distributions can only have "
                   + "int, float, list[int], or list[float] arguments")
 
-grammar = "custom  :  "
-for i, dist_class in enumerate(distribution_classes):
-    if i > 0:
-        grammar += "        |  "
-    grammar += f'"{dist_class.NAME}" "(" '
 
-    for i, arg_type in enumerate(dist_class.ARG_TYPES):
+# Identifies the current contents of distributions/ without reading them
+def _pluginStamp() -> str:
+    stats = sorted(
+        (entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+        for entry in os.scandir(_dir)
+        if entry.name.endswith(".py") and entry.name != "__init__.py"
+    )
+    return hashlib.sha256(repr((_MANIFEST_VERSION, stats)).encode()).hexdigest()
+
+
+# Imports every plugin and lists the distributions it defines
+def _scanPlugins() -> list[dict]:
+    manifest = []
+    for f in sorted(os.listdir(_dir)):
+        if not f.endswith(".py") or f == "__init__.py":
+            continue
+        module_name = f[:-3]
+        module = importlib.import_module(f"{_pkg_name}.{module_name}")
+        for name, obj in sorted(vars(module).items()):
+            # Only collect distributions defined in the module (not imported
+            # ones or helper classes)
+            if isinstance(obj, type) and obj.__module__ == module.__name__ \
+                    and issubclass(obj, CustomDistribution):
+                manifest.append({
+                    "module": module_name,
+                    "class": name,
+                    "name": obj.NAME,
+                    "args": [_type_to_string(arg_type) for arg_type in obj.ARG_TYPES],
+                })
+    return manifest
+
+
+# The directory ProgramCache keeps the manifest in, if caching is on
+_manifest_dir = None
+_manifest = None
+
+
+def useManifestDir(directory: pathlib.Path):
+    global _manifest_dir
+    _manifest_dir = pathlib.Path(directory)
+
+
+def _readOrScan(directory: pathlib.Path) -> list[dict]:
+    path = directory / f"plugins-{_pluginStamp()}.json"
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+    manifest = _scanPlugins()
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+    return manifest
+
+
+def _loadManifest() -> list[dict]:
+    global _manifest
+    if _manifest is None:
+        _manifest = _readOrScan(_manifest_dir) if _manifest_dir is not None else _scanPlugins()
+        assert len(_manifest) > 0
+    return _manifest
+
+
+def _grammar(manifest: list[dict]) -> str:
+    grammar = "custom  :  "
+    for i, entry in enumerate(manifest):
         if i > 0:
-            grammar += ' "," '
-        grammar += _type_to_string(arg_type)
+            grammar += "        |  "
+        grammar += f'"{entry["name"]}" "(" '
+        grammar += ' "," '.join(entry["args"])
+        grammar += f' ")" -> custom_{entry["name"]}\n'
+    return grammar
+
+
+# What the manifest lists, only built once one of them is used:
+# distribution_module_names, distribution_class_names, distribution_names
+# (the NAME of every distribution, as used in programs) and grammar
+def __getattr__(name: str):
+    if name == "distribution_module_names":
+        return sorted({entry["module"] for entry in _loadManifest()})
+    elif name == "distribution_class_names":
+        return [entry["class"] for entry in _loadManifest()]
+    elif name == "distribution_names":
+        return [entry["name"] for entry in _loadManifest()]
+    elif name == "grammar":
+        return _grammar(_loadManifest())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+_classes: dict[str, type] = {}
+
+
+# The class of the distribution called `name` in programs
+def distributionClass(name: str) -> type:
+    if name not in _classes:
+        entry = next(entry for entry in _loadManifest() if entry["name"] == name)
+        module = importlib.import_module(f"{_pkg_name}.{entry['module']}")
+        _classes[name] = getattr(module, entry["class"])
+    return _classes[name]
+
+
+# The source files of every plugin. These don't need the manifest, so a
+# cached program can be looked up without it.
+def distributionFiles() -> list[str]:
+    return sorted(
+        os.path.join(_dir, f) for f in os.listdir(_dir)
+        if f.endswith(".py") and f != "__init__.py"
+    )
 
-    grammar += f' ")" -> custom_{dist_class.NAME}\n'
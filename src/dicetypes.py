@@ -2,7 +2,19 @@
 from __future__ import annotations
 
 
+# Values are created for every node of every sample, so they are kept small:
+# every class uses __slots__, booleans are two shared instances, and small
+# ints are shared per width. None of them are ever mutated after they are
+# built, so sharing is safe, and dict/Counter lookups of shared values hit on
+# identity before `__eq__` is ever called.
+#
+# `__eq__` returns a BoolType, since that is what `==` means in a program,
+# and BoolType's `__bool__` makes that result usable wherever Python wants a
+# plain bool (dict lookups, `if a == b`, ...). Values of different types, or
+# ints of different widths, are never equal, so they stay separate outcomes.
 class DiceType:
+    __slots__ = ("val",)
+
     def __init__(self, val):
         self.val = val
 
@@ -13,16 +25,33 @@ class DiceType:
         return hash(self.val)
 
     def __eq__(self, other):
-        return BoolType(isinstance(other, DiceType) and self.val == other.val)
+        return TRUE if other.__class__ is self.__class__ and self.val == other.val else FALSE
 
 
 class BoolType(DiceType):
-    def __init__(self, val: bool):
-        super().__init__(val)
+    __slots__ = ()
+
+    # Everything is done by __new__, which hands back TRUE or FALSE
+    __init__ = object.__init__
+
+    def __new__(cls, val: bool):
+        return TRUE if val else FALSE
+
+    # Unpickle to the shared instances rather than to copies of them
+    def __reduce__(self):
+        return (BoolType, (self.val,))
 
     def __repr__(self):
         return f"BoolType({self.val})"
 
+    def __bool__(self):
+        return self.val
+
+    def __eq__(self, other):
+        return TRUE if self is other else FALSE
+
+    __hash__ = DiceType.__hash__
+
     def verify_types(self, other: BoolType):
         if type(other) is not BoolType:
             raise TypeError(
@@ -31,26 +60,91 @@ class BoolType(DiceType):
 
     def __and__(self, other: BoolType) -> BoolType:
         self.verify_types(other)
-        return BoolType(self.val and other.val)
+        return TRUE if self.val and other.val else FALSE
 
     def __or__(self, other: BoolType) -> BoolType:
         self.verify_types(other)
-        return BoolType(self.val or other.val)
+        return TRUE if self.val or other.val else FALSE
 
     def __not__(self) -> BoolType:
-        return BoolType(not self.val)
+        return FALSE if self.val else TRUE
 
 
-class IntType(DiceType):
-    def __init__(self, width: int, val: int):
+def _makeBool(val: bool) -> BoolType:
+    res = object.__new__(BoolType)
+    res.val = val
+    return res
+
+
+TRUE = _makeBool(True)
+FALSE = _makeBool(False)
+
+
+# Ints with a value below this are shared, for each width
+SMALL_INT_LIMIT = 256
+
+# `(1 << width) - 1` for each width seen so far
+_MASKS = {}
+# The shared small ints of each width, indexed by value
+_SMALL_INTS = {}
+
+
+def _mask(width: int) -> int:
+    mask = _MASKS.get(width)
+    if mask is None:
         if width <= 0:
             raise ValueError("Int width should be at least one bit")
-        self.width = width
-        super().__init__(val % (2**self.width))
+        mask = _MASKS[width] = (1 << width) - 1
+    return mask
+
+
+def _smallInts(width: int) -> list[IntType]:
+    ints = []
+    for val in range(min(_mask(width) + 1, SMALL_INT_LIMIT)):
+        res = object.__new__(IntType)
+        res.width = width
+        res.val = val
+        ints.append(res)
+    _SMALL_INTS[width] = ints
+    return ints
+
+
+class IntType(DiceType):
+    __slots__ = ("width",)
+
+    # Everything is done by __new__, which can hand back a shared instance
+    __init__ = object.__init__
+
+    def __new__(cls, width: int, val: int):
+        mask = _MASKS.get(width)
+        if mask is None:
+            mask = _mask(width)
+        # Same as `val % 2**width`, negative values included
+        val &= mask
+        if val < SMALL_INT_LIMIT:
+            ints = _SMALL_INTS.get(width)
+            if ints is None:
+                ints = _smallInts(width)
+            return ints[val]
+        res = object.__new__(cls)
+        res.width = width
+        res.val = val
+        return res
+
+    def __reduce__(self):
+        return (IntType, (self.width, self.val))
 
     def __repr__(self):
         return f"IntType({self.width}, {self.val})"
 
+    def __eq__(self, other):
+        if other.__class__ is IntType and self.width == other.width and self.val == other.val:
+            return TRUE
+        return FALSE
+
+    def __hash__(self):
+        return hash((self.width, self.val))
+
     def verify_types(self, other: IntType):
         if type(other) is not IntType:
             raise TypeError("Integer operation must act on two integers")
@@ -61,7 +155,7 @@ class IntType(DiceType):
 
     def __lt__(self, other: IntType) -> BoolType:
         self.verify_types(other)
-        return BoolType(self.val < other.val)
+        return TRUE if self.val < other.val else FALSE
 
     def __add__(self, other: IntType) -> IntType:
         self.verify_types(other)
@@ -91,6 +185,8 @@ class IntType(DiceType):
 
 
 class TupleType(DiceType):
+    __slots__ = ("left", "right")
+
     def __init__(self, left, right):
         self.left = left
         self.right = right
@@ -105,17 +201,22 @@ class TupleType(DiceType):
         return f"TupleType({self.left}, {self.right})"
 
     def __hash__(self):
-        return hash(hash(self.left) + hash(self.right))
+        # Order matters, or (a, b) and (b, a) would land on the same key
+        return hash((self.left, self.right))
 
     def __eq__(self, other):
-        return BoolType(
+        if (
             isinstance(other, TupleType)
             and self.left == other.left
             and self.right == other.right
-        )
+        ):
+            return TRUE
+        return FALSE
 
 
 class ListType(DiceType):
+    __slots__ = ("lst", "type_")
+
     def __init__(self, lst, type_):
         self.lst = lst
         self.type_ = type_
@@ -124,11 +225,13 @@ class ListType(DiceType):
         return f"ListType({', '.join((str(itm) for itm in self.lst))})"
 
     def __hash__(self):
-        return hash("".join((str(itm) for itm in self.lst)))
+        return hash(tuple(self.lst))
 
     def __eq__(self, other):
-        return BoolType(
-            isinstance(other, ListType) 
+        if (
+            isinstance(other, ListType)
             and len(self.lst) == len(other.lst)
             and all((left == right for left, right in zip(self.lst, other.lst)))
-        )
+        ):
+            return TRUE
+        return FALSE
@@ -1,5 +1,6 @@
 from custom_distribution import CustomDistribution
 from dicetypes import DiceType, IntType
+import math
 import random
 
 class BinomialDistribution(CustomDistribution):
@@ -11,9 +12,26 @@ class BinomialDistribution(CustomDistribution):
         self.n = n
         self.p = p
 
-    def sample(self) -> DiceType:
+    def sample(self, rng: random.Random) -> DiceType:
         n_successes = 0
         for _ in range(self.n):
-            if random.random() < self.p:
+            if rng.random() < self.p:
                 n_successes += 1
         return IntType(self.width, n_successes)
+
+    def sample_n(self, rng, n: int):
+        import numpy as np
+
+        n_successes = rng.binomial(self.n, self.p, size=n).astype(np.uint64)
+        return self.width, n_successes & np.uint64((1 << self.width) - 1)
+
+    def result_type(self) -> DiceType:
+        return IntType(self.width, 0)
+
+    def pmf(self) -> dict[DiceType, float]:
+        probs = {}
+        for k in range(self.n + 1):
+            outcome = IntType(self.width, k)
+            prob = math.comb(self.n, k) * self.p ** k * (1 - self.p) ** (self.n - k)
+            probs[outcome] = probs.get(outcome, 0.0) + prob
+        return probs
@@ -1,8 +1,62 @@
 from custom_distribution import CustomDistribution
 from dicetypes import DiceType, IntType
+import functools
 import math
 import random
 
+
+# Walker's alias method, built with Vose's algorithm. Column i holds outcome
+# i with probability prob[i], and outcome alias[i] otherwise, so one draw
+# only needs to pick a column and flip a biased coin: O(1) per sample instead
+# of a scan over the outcomes.
+class AliasTable:
+    def __init__(self, probs: tuple[float, ...]):
+        k = len(probs)
+        scaled = [prob * k for prob in probs]
+        prob = [1.0] * k
+        alias = list(range(k))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        # Whatever is left over is only off from 1 by rounding
+        for i in small + large:
+            prob[i] = 1.0
+
+        self.prob = prob
+        self.alias = alias
+        # Copies for sample_n, only made once it is used
+        self.prob_array = None
+        self.alias_array = None
+
+    def sample(self, rng: random.Random) -> int:
+        r = rng.random() * len(self.prob)
+        column = min(int(r), len(self.prob) - 1)
+        return column if r - column < self.prob[column] else self.alias[column]
+
+    def sample_n(self, rng, n: int):
+        import numpy as np
+
+        if self.prob_array is None:
+            self.prob_array = np.array(self.prob)
+            self.alias_array = np.array(self.alias, dtype=np.uint64)
+        r = rng.random(n) * len(self.prob)
+        columns = np.minimum(r.astype(np.uint64), np.uint64(len(self.prob) - 1))
+        keep = (r - columns) < self.prob_array[columns]
+        return np.where(keep, columns, self.alias_array[columns])
+
+
+# Programs often repeat the same weights, so identical probability vectors
+# share one table
+@functools.lru_cache(maxsize=None)
+def alias_table(probs: tuple[float, ...]) -> AliasTable:
+    return AliasTable(probs)
+
+
 class DiscreteDistribution(CustomDistribution):
     NAME = "discrete"
     ARG_TYPES = (list[float],)
@@ -28,12 +82,16 @@ class DiscreteDistribution(CustomDistribution):
 
         self.bit_width = bit_width
         self.probs = probs
+        self.table = alias_table(tuple(probs))
+
+    def sample(self, rng: random.Random) -> DiceType:
+        return IntType(self.bit_width, self.table.sample(rng))
+
+    def sample_n(self, rng, n: int):
+        return self.bit_width, self.table.sample_n(rng, n)
+
+    def result_type(self) -> DiceType:
+        return IntType(self.bit_width, 0)
 
-    def sample(self) -> DiceType:
-        r = random.random()
-        accumulated_prob = 0.0
-        for i, prob in enumerate(self.probs):
-            accumulated_prob += prob
-            if r < accumulated_prob:
-                return IntType(self.bit_width, i)
-        assert False
+    def pmf(self) -> dict[DiceType, float]:
+        return {IntType(self.bit_width, i): prob for i, prob in enumerate(self.probs)}
@@ -17,7 +17,21 @@ class UniformDistribution(CustomDistribution):
         self.start = start
         self.end = end
 
-    def sample(self) -> DiceType:
-        options = range(self.start, self.end)
-        choice = random.choice(options)
-        return IntType(self.size, choice)
+    def sample(self, rng: random.Random) -> DiceType:
+        return IntType(self.size, rng.randrange(self.start, self.end))
+
+    def sample_n(self, rng, n: int):
+        import numpy as np
+
+        choices = rng.integers(self.start, self.end, size=n, dtype=np.uint64)
+        return self.size, choices & np.uint64((1 << self.size) - 1)
+
+    def result_type(self) -> DiceType:
+        return IntType(self.size, 0)
+
+    def pmf(self) -> dict[DiceType, float]:
+        probs = {}
+        for choice in range(self.start, self.end):
+            outcome = IntType(self.size, choice)
+            probs[outcome] = probs.get(outcome, 0.0) + 1 / (self.end - self.start)
+        return probs
@@ -0,0 +1,209 @@
+from collections import Counter
+import random
+
+import custom_distribution
+import node
+from checker import TypeChecker
+from compiler import PyEdaCompiler
+from dicetypes import DiceType, BoolType, ListType
+from inference import TreeInferencer, normalize
+
+
+# Nodes the BDD compiler can't handle in general. Lists are sampled since
+# their lengths can depend on random choices.
+_LIST_NODES = (node.ListNode, node.ConcatNode, node.HeadNode, node.TailNode, node.LengthNode)
+
+
+def _children(treeNode):
+    for child in vars(treeNode).values():
+        yield from (child if type(child) is list else [child])
+
+
+# Every node under `treeNode` (but not inside function definitions), walked
+# with a stack rather than recursion since generated programs can have
+# thousands of `let`s
+def _nodes(treeNode):
+    stack = [treeNode]
+    while stack:
+        treeNode = stack.pop()
+        yield treeNode
+        if isinstance(treeNode, node.Node) and type(treeNode) is not node.FunctionNode:
+            stack.extend(_children(treeNode))
+
+
+# The functions each function calls
+def _callees(treeNode) -> set[str]:
+    return {n.ident for n in _nodes(treeNode) if type(n) is node.FunctionCallNode}
+
+
+# Every variable `treeNode` reads. Inner `let`s aren't taken into account, so
+# this can include variables that are only read after being shadowed.
+def _reads(treeNode) -> set[str]:
+    return {n.ident for n in _nodes(treeNode) if type(n) is node.IdentNode}
+
+
+# Rao-Blackwellized sampling: the parts of a program the BDD compiler can
+# handle are computed exactly, and only the rest is sampled.
+#
+# The top-level chain of `let`s is split in two. A binding is sampled if its
+# value uses a list, a custom distribution without a `pmf`, or a function
+# that does (or that is recursive), or if a sampled binding reads it. Each
+# iteration samples just those bindings, and compiles the rest of the
+# program with them fixed to the sampled values. That gives P(evidence) given
+# the samples, which is the iteration's weight, and the exact distribution of
+# the result given the samples and the evidence. Compiled results are
+# memoized by the sampled values, so a model whose sampled part only takes a
+# few values is compiled only a few times.
+class HybridInferencer:
+    def __init__(self, tree, variables=None, num_iterations=1000, seed=None):
+        self.tree = tree
+        self.variables = variables if variables is not None else {}
+        TypeChecker(tree, self.variables).check()
+        self.num_its = num_iterations
+        self.rng = random.Random(seed)
+
+        functions, expr = [], tree
+        if type(tree) is node.ProgramNode:
+            functions, expr = tree.functions, tree.expr
+        self.sampled_functions = self.findSampledFunctions(functions)
+
+        self.bindings = []
+        while type(expr) is node.AssignNode:
+            self.bindings.append(expr)
+            expr = expr.rest
+        self.result = expr
+        self.result_sampled = self.needsSampling(expr)
+        self.sampled = self.findSampledBindings()
+
+        # Samples the sampled bindings one at a time
+        self.evaluator = TreeInferencer(None, {})
+        self.evaluator.rng = self.rng
+        for function in functions:
+            self.evaluator.registerFunction(function)
+
+        # The program that gets compiled: sampled bindings read their value
+        # from a placeholder variable (which can't clash with a real one),
+        # and the result is dropped if it has to be sampled
+        rest = BoolType(True) if self.result_sampled else expr
+        for binding in reversed(self.bindings):
+            val = binding.val
+            if binding in self.sampled:
+                val = node.IdentNode(self.placeholder(binding))
+            rest = node.AssignNode(binding.ident, val, rest)
+        self.exact_tree = node.ProgramNode([
+            function for function in functions
+            if function.ident not in self.sampled_functions
+        ] + [rest])
+
+        self.compiled = {}
+
+    @staticmethod
+    def placeholder(binding: node.AssignNode) -> str:
+        return f"{binding.ident}#{id(binding)}"
+
+    # Functions that can't be compiled: those whose bodies need sampling or
+    # that take lists, those that can reach themselves, and everything that
+    # calls one of them
+    def findSampledFunctions(self, functions: list) -> set[str]:
+        callees = {function.ident: _callees(function.expr) for function in functions}
+        reachable = {}
+        for ident in callees:
+            seen, stack = set(), list(callees[ident])
+            while stack:
+                callee = stack.pop()
+                if callee in seen or callee not in callees:
+                    continue
+                seen.add(callee)
+                stack.extend(callees[callee])
+            reachable[ident] = seen
+
+        self.sampled_functions = set()
+        sampled = set()
+        for function in functions:
+            takes_list = any(type(arg.type) is ListType for arg in function.arg_list_node.args)
+            if takes_list or function.ident in reachable[function.ident] \
+                    or self.needsSampling(function.expr):
+                sampled.add(function.ident)
+        return sampled | {
+            ident for ident in callees if reachable[ident] & sampled
+        }
+
+    def needsSampling(self, treeNode) -> bool:
+        for n in _nodes(treeNode):
+            if isinstance(n, _LIST_NODES):
+                return True
+            if isinstance(n, custom_distribution.CustomDistribution) \
+                    and type(n).pmf is custom_distribution.CustomDistribution.pmf:
+                return True
+            if type(n) is node.FunctionCallNode and n.ident in self.sampled_functions:
+                return True
+        return False
+
+    # Walks the bindings backwards, so every read of a sampled binding is
+    # known by the time that the binding it reads is reached
+    def findSampledBindings(self) -> set[node.AssignNode]:
+        needed = _reads(self.result) if self.result_sampled else set()
+        sampled = set()
+        for binding in reversed(self.bindings):
+            if binding.ident in needed or self.needsSampling(binding.val):
+                sampled.add(binding)
+                needed.discard(binding.ident)
+                needed |= _reads(binding.val)
+            else:
+                needed.discard(binding.ident)
+        return sampled
+
+    def infer(self) -> dict[DiceType, float]:
+        results, total_weight = self.sample()
+        return normalize(results, total_weight)
+
+    # Returns the total weight of each outcome and the total weight of all
+    # iterations, where an iteration is weighted by P(evidence) given what
+    # it sampled
+    def sample(self) -> tuple[Counter, float]:
+        results = Counter()
+        total_weight = 0.0
+        for _ in range(self.num_its):
+            sampled = self.sampleOnce()
+            if sampled is None:
+                continue
+            key, res = sampled
+            joint, observe_prob = self.compileGiven(key)
+            if self.result_sampled:
+                results[res] += observe_prob
+            else:
+                results.update(joint)
+            total_weight += observe_prob
+        return results, total_weight
+
+    # Runs the program, only evaluating the sampled bindings (and the result,
+    # if it is sampled). Returns the sampled values in order, and the result
+    # or None if it is compiled. Returns None instead if an observation in a
+    # sampled binding failed.
+    def sampleOnce(self):
+        evaluator = self.evaluator
+        evaluator.variables = dict(self.variables)
+        evaluator.observe_ok = True
+        values = []
+        for binding in self.bindings:
+            if binding in self.sampled:
+                val = evaluator.recurseTree(binding.val)
+                evaluator.variables[binding.ident] = val
+                values.append(val)
+        res = evaluator.recurseTree(self.result) if self.result_sampled else None
+        if not evaluator.observe_ok:
+            return None
+        return tuple(values), res
+
+    # The joint distribution of the compiled part with the evidence, given
+    # the sampled values `key`
+    def compileGiven(self, key: tuple) -> tuple[dict[DiceType, float], float]:
+        if key not in self.compiled:
+            compiler = PyEdaCompiler(self.exact_tree)
+            for ident, val in self.variables.items():
+                compiler.variable_asgn[ident] = compiler.constantValue(val)
+            sampled = (binding for binding in self.bindings if binding in self.sampled)
+            for binding, val in zip(sampled, key):
+                compiler.variable_asgn[self.placeholder(binding)] = compiler.constantValue(val)
+            self.compiled[key] = compiler.infer_joint()
+        return self.compiled[key]
@@ -1,10 +1,16 @@
 # Contains code to do MonteCarlo Inferencing on our parsed tree
+import math
 import random
+import statistics
+import time
 from collections import Counter
 
 import custom_distribution
 import node
+from checker import TypeChecker
+from closure_compiler import ClosureCompiler, SampleState
 from dicetypes import DiceType, BoolType, IntType, TupleType, ListType
+from outcomes import OutcomeCodec
 
 
 # Only does MC for the particular tree
@@ -35,8 +41,11 @@ class TreeInferencer:
             function.arg_list_node.args,
             function.expr,
         )
-        self.functions[ident] = [arg_list, expr]
+        self.functions[ident] = [[param.ident for param in arg_list], expr]
 
+    # Calls run in a new frame on this inferencer, so they share its random
+    # stream and its observations. A failed observation inside the call
+    # fails the whole sample.
     def processFunction(self, function: node.FunctionCallNode):
         ident, arg_expr_list = function.ident, function.arg_list_node.args
 
@@ -45,28 +54,22 @@ class TreeInferencer:
             raise Exception("Function identifier not defined:", ident)
 
         # Check if length of arguments the same
-        param_list, function_expr = self.functions[ident]
-        if len(param_list) != len(arg_expr_list):
+        param_idents, function_expr = self.functions[ident]
+        if len(param_idents) != len(arg_expr_list):
             raise AttributeError(
-                f"Argument Length does not match: Param len {len( param_list )} != Arg len {len(arg_expr_list)}"
+                f"Argument Length does not match: Param len {len( param_idents )} != Arg len {len(arg_expr_list)}"
             )
 
-        # Process expressions in arg_list
-        arguments = []
-        for expr in arg_expr_list:
-            arguments.append(self.recurseTree(expr))
-
-        # Check if arguments all sound
-        var_map = {}
-        for i in range(len(arguments)):
-            param_ident, param_type = param_list[i].ident, param_list[i].type
-            # arguments[i].verify_types(param_type)
-            var_map[param_ident] = arguments[i]
-
-        # Call function
-        # Can allow recursion by passing in existing functions.
-        function_tf = TreeInferencer(function_expr, var_map, functions=self.functions)
-        return function_tf.infer()
+        # Function bodies only see their parameters, bound by position
+        frame = {
+            param_ident: self.recurseTree(expr)
+            for param_ident, expr in zip(param_idents, arg_expr_list)
+        }
+        caller_frame, self.variables = self.variables, frame
+        try:
+            return self.recurseTree(function_expr)
+        finally:
+            self.variables = caller_frame
 
     def recurseTree(self, treeNode) -> DiceType | None:
         if type(treeNode) is BoolType:
@@ -87,17 +90,13 @@ class TreeInferencer:
             return self.recurseTree(treeNode.expr)
 
         elif type(treeNode) is node.FunctionCallNode:
-            call_return =  self.processFunction(treeNode)
-            # if we call some other function and its observation is invalid, ours is too!
-            if call_return is None:
-                self.observe_ok = False
-            return call_return
+            return self.processFunction(treeNode)
 
         elif type(treeNode) is node.FlipNode:
             return BoolType(self.rng.random() < treeNode.prob)
 
         elif isinstance(treeNode, custom_distribution.CustomDistribution):
-            return treeNode.sample()
+            return treeNode.sample(self.rng)
 
         elif type(treeNode) is node.IdentNode:
             if treeNode.ident not in self.variables:
@@ -113,8 +112,10 @@ class TreeInferencer:
             )
 
         elif isinstance(treeNode, node.AssignNode):
-            self.variables[treeNode.ident] = self.recurseTree(treeNode.val)
-            return self.recurseTree(treeNode.rest)
+            while isinstance(treeNode, node.AssignNode):
+                self.variables[treeNode.ident] = self.recurseTree(treeNode.val)
+                treeNode = treeNode.rest
+            return self.recurseTree(treeNode)
 
         elif isinstance(treeNode, node.IfNode):
             cond = self.recurseTree(treeNode.cond)
@@ -168,26 +169,206 @@ class TreeInferencer:
             raise Exception("Tree Node Unknown:", treeNode)
 
 
+# Runs one worker's share of the iterations of a parallel Inferencer. This has
+# to be a module-level function so that it can be sent to a process pool.
+def _infer_worker(tree, variables, num_iterations, seed, compiled,
+                  likelihood_weighting) -> tuple[Counter, float, float]:
+    inferencer = Inferencer(tree, variables, num_iterations=num_iterations, seed=seed,
+                            compiled=compiled, likelihood_weighting=likelihood_weighting)
+    return inferencer.sample()
+
+
+# The result of Inferencer.inferAdaptive: the estimated probability of every
+# outcome, with a confidence interval for each
+class Estimate:
+    def __init__(self, probs: dict, intervals: dict, num_samples: int,
+                 num_iterations: int, converged: bool):
+        self.probs = probs
+        self.intervals = intervals
+        # Samples that passed every observation, or the effective sample size
+        # when they are weighted; the intervals are based on this
+        self.num_samples = num_samples
+        self.num_iterations = num_iterations
+        # Whether every interval got narrower than the tolerance (as opposed
+        # to running out of time or iterations)
+        self.converged = converged
+
+    def __repr__(self):
+        lines = [
+            f"{outcome}: {prob:.6f} [{self.intervals[outcome][0]:.6f}, {self.intervals[outcome][1]:.6f}]"
+            for outcome, prob in self.probs.items()
+        ]
+        lines.append(f"samples: {self.num_samples:.0f} of {self.num_iterations}"
+                     + ("" if self.converged else " (did not converge)"))
+        return "\n".join(lines)
+
+
+# Wilson score interval for a proportion of `successes` out of `n` trials
+def wilson_interval(successes: float, n: float, confidence: float = 0.95) -> tuple[float, float]:
+    if n == 0:
+        return 0.0, 1.0
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = successes / n
+    denom = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denom
+    half_width = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+
+# Turns the total weight of each outcome into probabilities
+def normalize(results: Counter, total_weight: float) -> dict[DiceType, float]:
+    if total_weight == 0:
+        raise Exception("Every sample was rejected by an observation, so the"
+            + " evidence is impossible or too unlikely to sample")
+    return {outcome: weight / total_weight for outcome, weight in results.items()}
+
+
 # Should do numerous runs of inference + handle functions
 class Inferencer:
     # TODO - Add function support once it's implemented
-    def __init__(self, tree, variables=None, num_iterations=1000, seed=None):
+    def __init__(self, tree, variables=None, num_iterations=1000, seed=None, workers=1,
+                 compiled=True, likelihood_weighting=False):
+        if workers < 1:
+            raise ValueError("Need at least one worker")
+        if likelihood_weighting and not compiled:
+            raise ValueError("Likelihood weighting needs the compiled sampler")
         self.tree = tree
         self.variables = variables if variables is not None else {}
-        self.treeInferencer = TreeInferencer(tree, self.variables, seed)
+        # Without likelihood weighting every accepted sample has weight one
+        self.state = None
+        if compiled:
+            # Compile once up front so each iteration is a single call
+            compiler = ClosureCompiler(tree, self.variables, likelihood_weighting)
+            program = compiler.compile()
+            checker = compiler.checker
+            state = SampleState(random.Random(seed))
+            self.runOnce = lambda: program(state)
+            if likelihood_weighting:
+                self.state = state
+        else:
+            # The compiler checks the program itself; this rejects bad
+            # programs before sampling without it
+            checker = TypeChecker(tree, self.variables)
+            checker.check()
+            self.runOnce = TreeInferencer(tree, self.variables, seed).infer
+        # Outcomes are tallied by key, see outcomes.py
+        self.codec = OutcomeCodec(checker.resultType())
+        self.compiled = compiled
+        self.likelihood_weighting = likelihood_weighting
         self.num_its = num_iterations
+        self.seed = seed
+        self.workers = workers
 
     def infer(self) -> dict[DiceType, float]:
+        if self.workers > 1:
+            results, total_weight, _ = self.sampleParallel()
+        else:
+            results, total_weight, _ = self.sample()
+
+        return normalize(results, total_weight)
+
+    # Samples in chunks of `chunk_size` until the confidence interval of
+    # every outcome seen so far is narrower than `tolerance`. Also stops after
+    # `time_budget` seconds or `max_iterations` iterations, if given.
+    def inferAdaptive(self, tolerance: float, time_budget: float | None = None,
+                      max_iterations: int | None = None, chunk_size: int = 1000,
+                      confidence: float = 0.95) -> Estimate:
+        if tolerance <= 0:
+            raise ValueError("Tolerance must be positive")
+        start = time.perf_counter()
         results = Counter()
         num_its = 0
-        num_successful_its = 0
-        while num_its < self.num_its:
-            # print(num_successful_its, num_its)
+        total_weight = 0.0
+        total_weight_sq = 0.0
+        converged = False
+        while True:
+            chunk = chunk_size
+            if max_iterations is not None:
+                chunk = min(chunk, max_iterations - num_its)
+            chunk_results, chunk_weight, chunk_weight_sq = self.sample(chunk)
+            results.update(chunk_results)
+            num_its += chunk
+            total_weight += chunk_weight
+            total_weight_sq += chunk_weight_sq
+
+            # Kish's effective sample size, which is just the number of
+            # accepted samples when they all have weight one
+            ess = total_weight ** 2 / total_weight_sq if total_weight_sq > 0 else 0.0
+            intervals = {
+                outcome: wilson_interval(weight / total_weight * ess, ess, confidence)
+                for outcome, weight in results.items()
+            }
+            converged = ess > 0 and all(
+                hi - lo < tolerance for lo, hi in intervals.values()
+            )
+            if converged:
+                break
+            if time_budget is not None and time.perf_counter() - start >= time_budget:
+                break
+            if max_iterations is not None and num_its >= max_iterations:
+                break
+
+        return Estimate(normalize(results, total_weight), intervals, ess, num_its, converged)
+
+    # Returns the total weight of each outcome, the total weight of all
+    # accepted samples, and the total of their squared weights
+    def sample(self, num_its: int | None = None) -> tuple[Counter, float, float]:
+        num_its_target = self.num_its if num_its is None else num_its
+        table = {}
+        num_its = 0
+        total_weight = 0.0
+        total_weight_sq = 0.0
+        state = self.state
+        runOnce, pack = self.runOnce, self.codec.pack
+        while num_its < num_its_target:
             num_its += 1
-            res = self.treeInferencer.infer()
+            res = runOnce()
             if res is None:  # This means an observation failed
                 continue
-            results[res] += 1
-            num_successful_its += 1
+            weight = 1.0 if state is None else state.weight
+            key = pack(res)
+            table[key] = table.get(key, 0.0) + weight
+            total_weight += weight
+            total_weight_sq += weight * weight
+
+        return self.codec.decode(table), total_weight, total_weight_sq
+
+    # Splits the iterations across a process pool. Every worker gets its own
+    # stream derived from `seed`, so a given seed and worker count always
+    # produces the same result.
+    def sampleParallel(self) -> tuple[Counter, float, float]:
+        # Only imported here, since they are slow to import and most runs
+        # don't need them
+        from concurrent.futures import ProcessPoolExecutor
+        import numpy as np
+
+        its_per_worker = [
+            self.num_its // self.workers + (i < self.num_its % self.workers)
+            for i in range(self.workers)
+        ]
+        seeds = [
+            int(child.generate_state(1)[0])
+            for child in np.random.SeedSequence(self.seed).spawn(self.workers)
+        ]
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            worker_results = pool.map(
+                _infer_worker,
+                [self.tree] * self.workers,
+                [self.variables] * self.workers,
+                its_per_worker,
+                seeds,
+                [self.compiled] * self.workers,
+                [self.likelihood_weighting] * self.workers,
+            )
+
+            # Merge in worker order so the result doesn't depend on scheduling
+            results = Counter()
+            total_weight = 0.0
+            total_weight_sq = 0.0
+            for worker_counter, worker_weight, worker_weight_sq in worker_results:
+                results.update(worker_counter)
+                total_weight += worker_weight
+                total_weight_sq += worker_weight_sq
 
-        return {outcome: count / num_successful_its for outcome, count in results.items()}
+        return results, total_weight, total_weight_sq
@@ -2,17 +2,10 @@ from pathlib import Path
 import lark
 
 import node
-from inference import Inferencer
-from compiler import PyEdaCompiler
+from optimizer import Optimizer
 from dicetypes import BoolType, IntType, TupleType, ListType, DiceType
 import custom_distribution
 
-for dist_class_name, dist_module_name in zip(
-    custom_distribution.distribution_class_names,
-    custom_distribution.distribution_module_names,
-):
-    exec(f"from distributions.{dist_module_name} import {dist_class_name}")
-
 # See https://lark-parser.readthedocs.io/en/latest/_static/lark_cheatsheet.pdf
 grammar = f"""
 ?start: program_expr
@@ -112,11 +105,11 @@ grammar = f"""
 
 {custom_distribution.grammar}
 
-nums  :  NUMBER                         -> nums_single
-      |  NUMBER "," nums                -> nums_recurse
+// Flat lists rather than right recursion, so long weight vectors are read in
+// linear time
+nums  :  NUMBER ("," NUMBER)*
 
-ints  : INT                             -> ints_single
-      | INT "," ints                    -> ints_recurse
+ints  :  INT ("," INT)*
 
 // Terminals
 %import common.NUMBER
@@ -177,15 +170,6 @@ class TreeTransformer(lark.Transformer):
     def custom(self, x):
         return x[0]
 
-    # This dynamically creates a new method for each custom distribution
-    for dist_class, dist_class_name in zip(
-        custom_distribution.distribution_classes,
-        custom_distribution.distribution_class_names,
-    ):
-        exec(
-            f"def custom_{dist_class.NAME}(self, x): " + f"return {dist_class_name}(*x)"
-        )
-
     def int_(self, x):
         return IntType(x[0], x[1])
 
@@ -261,17 +245,11 @@ class TreeTransformer(lark.Transformer):
     def if_(self, x):
         return node.IfNode(x[0], x[1], x[2])
 
-    def nums_single(self, x):
-        return [x[0]]
-
-    def nums_recurse(self, x):
-        return [x[0]] + x[1]
+    def nums(self, x):
+        return list(x)
 
-    def ints_single(self, x):
-        return [x[0]]
-
-    def ints_recurse(self, x):
-        return [x[0]] + x[1]
+    def ints(self, x):
+        return list(x)
 
     def IDENT(self, token):
         return str(token)
@@ -346,25 +324,65 @@ class TreeTransformer(lark.Transformer):
         return node.NthBitNode(x[0], x[1])
 
 
+# The method for the rule `custom_<name>`, which builds the distribution
+# called `name`
+def _customMethod(name: str):
+    def custom(self, x):
+        return custom_distribution.distributionClass(name)(*x)
+    custom.__name__ = f"custom_{name}"
+    return custom
+
+
+# This creates a new method for each custom distribution
+for _name in custom_distribution.distribution_names:
+    setattr(TreeTransformer, f"custom_{_name}", _customMethod(_name))
+
+
+# A parser that builds the IR in the same pass as it parses, instead of
+# building a whole lark.Tree first for TreeTransformer to walk afterwards.
+# Its `parse` returns the IR itself. This also never recurses, so it can
+# parse programs of any length.
+def make_parser(**options) -> lark.Lark:
+    return lark.Lark(grammar, parser="lalr", transformer=TreeTransformer(), **options)
+
+
+# The IR of `text`, with either a parser from make_parser or a plain one
+def parse_ir(text: str, parser: lark.Lark):
+    tree = parser.parse(text)
+    if isinstance(tree, lark.Tree):
+        tree = TreeTransformer().transform(tree)
+    return tree
+
+
 def parse_string(text: str, parser: lark.Lark, num_its: int=100000) -> dict:
-    ast = parser.parse(text)
-    ir = TreeTransformer().transform(ast)
+    from inference import Inferencer
+
+    ir = Optimizer(parse_ir(text, parser)).optimize()
     print(ir)
     inferencer = Inferencer(ir, num_iterations=num_its, seed=0)
     return inferencer.infer()
 
 
-def execute_from_file(
-    p: Path, parser: lark.Lark = lark.Lark(grammar, parser="lalr")
-) -> dict:
+def execute_from_file(p: Path, parser: lark.Lark | None = None) -> dict:
+    if parser is None:
+        parser = make_parser()
     with open(p, "r") as f:
         s = f.read()
 
     return parse_string(s, parser)
 
 
+def parse_string_vectorized(text: str, parser: lark.Lark, num_its: int=100000) -> dict:
+    from vectorized import VectorizedInferencer
+
+    ir = Optimizer(parse_ir(text, parser)).optimize()
+    inferencer = VectorizedInferencer(ir, num_iterations=num_its, seed=0)
+    return inferencer.infer()
+
+
 def parse_string_compile(text: str, parser: lark.Lark) -> dict:
-    ast = parser.parse(text)
-    ir = TreeTransformer().transform(ast)
+    from compiler import PyEdaCompiler
+
+    ir = Optimizer(parse_ir(text, parser)).optimize()
     compiled_tree = PyEdaCompiler(ir)
     return compiled_tree.infer()
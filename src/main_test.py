@@ -1,9 +1,26 @@
+import random
+import sys
+from collections import Counter
+
+import numpy as np
 import pytest
 import lark
-from dicetypes import BoolType, IntType
+import node
+import PyDice
+from dicetypes import BoolType, IntType, TupleType
 
-from main import grammar, TreeTransformer, parse_string, parse_string_compile
+from main import grammar, TreeTransformer, make_parser, parse_ir, parse_string, parse_string_compile, parse_string_vectorized
 from inference import Inferencer
+from smc import SMCInferencer
+from optimizer import Optimizer
+from checker import TypeChecker
+from hybrid import HybridInferencer
+from compiler import PyEdaCompiler
+from vectorized import VectorizedInferencer
+from custom_distribution import CustomDistribution
+from distributions.binomial import BinomialDistribution
+from distributions.discrete import DiscreteDistribution
+from distributions.uniform import UniformDistribution
 
 
 @pytest.fixture
@@ -180,6 +197,27 @@ def test_int_div(test_parser: lark.Lark) -> None:
     assert parse_string(text, test_parser)[IntType(3, 3)] == 1.0
 
 
+@pytest.mark.parametrize("text, zero_reachable", [
+    ("let y = uniform(2, 0, 4) in int(2, 3) / y", True),
+    ("let y = uniform(2, 0, 4) in if y == int(2, 0) then y else int(2, 3) / y", False),
+    ("fun f(a: int(2)) { int(2, 3) / a } f(uniform(2, 0, 4))", True),
+    ("fun f(a: int(2)) { int(2, 3) / a } let y = uniform(2, 0, 4) in"
+     " if y == int(2, 0) then y else f(y)", False),
+])
+def test_int_div_by_zero(test_parser: lark.Lark, text: str, zero_reachable: bool) -> None:
+    # The BDD compiler rejects a division that can reach a zero divisor,
+    # since sampling would sooner or later raise
+    if zero_reachable:
+        with pytest.raises(ZeroDivisionError):
+            parse_string_compile(text, test_parser)
+        with pytest.raises(ZeroDivisionError):
+            parse_string(text, test_parser)
+    else:
+        res = parse_string_compile(text, test_parser)
+        assert res == pytest.approx({IntType(2, 0): 0.25, IntType(2, 1): 0.5, IntType(2, 3): 0.25})
+        assert parse_string(text, test_parser)[IntType(2, 1)] == pytest.approx(0.5, rel=0.05)
+
+
 def test_int_precedence(test_parser: lark.Lark) -> None:
     text = "int(10,4) * int(10,2) + int(10,10) / ( int(10,5) - int(10,3) )"
     print(parse_string(text, test_parser))
@@ -454,6 +492,12 @@ def test_nested_consistent_assign_advanced_compiled(test_parser: lark.Lark) -> N
         0.35, rel=1e-6
     )
 
+def test_dont_care_compiled(test_parser: lark.Lark) -> None:
+    text = "(flip 0.3 && flip 0.6) || (flip 0.2 && flip 0.9) || (flip 0.5 && flip 0.5)"
+    assert parse_string_compile(text, test_parser)[BoolType(True)] == pytest.approx(
+        1 - (1 - 0.18) * (1 - 0.18) * (1 - 0.25), rel=1e-6
+    )
+
 def test_no_arg_function_compiled(test_parser: lark.Lark) -> None:
     text = "fun flip_coin(){ flip 0.5 } flip_coin()"
     assert parse_string_compile(text, test_parser)[BoolType(True)] == pytest.approx(0.5, rel=1e-6)
@@ -629,3 +673,502 @@ def test_list_tail(test_parser: lark.Lark) -> None:
 def test_list_length(test_parser: lark.Lark) -> None:
     text = "let xs = [flip 0.3, flip 0.2, flip 0.8] in length xs"
     assert parse_string(text, test_parser)[IntType(4, 3)] == 1.0
+
+
+def test_vectorized_observe(test_parser: lark.Lark) -> None:
+    text = """
+    let x = flip 0.2 in
+    let y = flip 0.6 in
+    let tmp = observe !y in
+    x || y
+    """
+    assert parse_string_vectorized(text, test_parser)[BoolType(True)] == pytest.approx(
+        0.2, rel=0.05
+    )
+
+
+def test_vectorized_if_observe(test_parser: lark.Lark) -> None:
+    text = """
+    let evidence = flip 0.5 in
+    let coin  = flip 0.5 in
+    if evidence then
+        let tmp = observe coin in evidence
+        else evidence
+    """
+    assert parse_string_vectorized(text, test_parser)[BoolType(True)] == pytest.approx(
+        1.0 / 3.0, rel=0.05
+    )
+
+
+def test_vectorized_int(test_parser: lark.Lark) -> None:
+    text = "int(10,4) * int(10,2) + int(10,10) / ( int(10,5) - int(10,3) )"
+    assert parse_string_vectorized(text, test_parser)[IntType(10, 13)] == 1.0
+    text = "let x = int(4, 12) in (x >> 1, x << 2)"
+    assert parse_string_vectorized(text, test_parser)[TupleType(IntType(4, 6), IntType(4, 0))] == 1.0
+
+
+def test_vectorized_discrete(test_parser: lark.Lark) -> None:
+    text = """
+    let x = discrete(0.1, 0.2, 0.3, 0.4) in
+    let y = discrete(0.4, 0.3, 0.2, 0.1) in
+    let tmp = observe (x + y) < int(2, 2) in
+    x == y"""
+    assert parse_string_vectorized(text, test_parser)[BoolType(True)] == pytest.approx(
+        0.21739130434782608, rel=0.05
+    )
+
+
+def test_vectorized_nthbit(test_parser: lark.Lark) -> None:
+    text = "let f1 = discrete(0.1, 0.4, 0.3, 0.2) in nth_bit(int(2, 1), f1)"
+    assert parse_string_vectorized(text, test_parser)[BoolType(True)] == pytest.approx(0.6, rel=0.05)
+
+
+def test_vectorized_function(test_parser: lark.Lark) -> None:
+    text = """
+    fun f( x : bool ){
+    let y = x || flip 0.5 in let z = observe y in y
+    }
+    let x = flip 0.1 in let obs = f(x) in x
+    """
+    assert parse_string_vectorized(text, test_parser)[BoolType(True)] == pytest.approx(0.1818, rel=0.05)
+
+
+def test_vectorized_recursion(test_parser: lark.Lark) -> None:
+    text = """
+    fun f() {
+        flip 0.5
+    }
+    fun flip_n(n: int(4)): bool {
+        if n == int(4, 0) then true else f() && flip_n(n - int(4, 1))
+    }
+    flip_n(int(4, 3))
+    """
+    assert parse_string_vectorized(text, test_parser)[BoolType(True)] == pytest.approx(0.125, rel=0.05)
+
+
+def test_vectorized_type_check(test_parser: lark.Lark) -> None:
+    with pytest.raises(TypeError):
+        parse_string_vectorized("int(2, 1) && int(2, 2)", test_parser)
+    with pytest.raises(TypeError):
+        parse_string_vectorized("int(3, 1) + int(4, 2)", test_parser)
+
+
+def test_parallel_reproducible(test_parser: lark.Lark) -> None:
+    text = """
+    let x = discrete(0.1, 0.2, 0.3, 0.4) in
+    let y = flip 0.6 in
+    let tmp = observe y || x == int(2, 0) in
+    x
+    """
+    ir = TreeTransformer().transform(test_parser.parse(text))
+    res1 = Inferencer(ir, num_iterations=4001, seed=3, workers=3).infer()
+    res2 = Inferencer(ir, num_iterations=4001, seed=3, workers=3).infer()
+    assert res1 == res2
+    assert res1[IntType(2, 3)] == pytest.approx(0.4 * 0.6 / (0.6 + 0.4 * 0.1), rel=0.1)
+
+
+def test_compiled_matches_tree(test_parser: lark.Lark) -> None:
+    text = """
+    let x = flip 0.4 in
+    let y = if x then flip 0.1 else flip 0.7 in
+    let x = (x, y) in
+    let tmp = observe (fst x) || (snd x) in
+    let z = int(3, 2) + int(3, 3) in
+    (snd x, z << 1)
+    """
+    ir = TreeTransformer().transform(test_parser.parse(text))
+    compiled = Inferencer(ir, num_iterations=2000, seed=7).infer()
+    interpreted = Inferencer(ir, num_iterations=2000, seed=7, compiled=False).infer()
+    assert compiled == interpreted
+
+
+
+def test_int_arith_compiled(test_parser: lark.Lark) -> None:
+    text = "let x = discrete(0.1, 0.2, 0.3, 0.4) in x + int(2, 1)"
+    res = parse_string_compile(text, test_parser)
+    assert res[IntType(2, 0)] == pytest.approx(0.4, rel=1e-6)
+    assert res[IntType(2, 1)] == pytest.approx(0.1, rel=1e-6)
+    text = "let x = discrete(0.1, 0.2, 0.3, 0.4) in let y = discrete(0, 0.5, 0.25, 0.25) in x / y"
+    res = parse_string_compile(text, test_parser)
+    assert res[IntType(2, 0)] == pytest.approx(0.275, rel=1e-6)
+    assert res[IntType(2, 3)] == pytest.approx(0.2, rel=1e-6)
+
+
+def test_int_compare_compiled(test_parser: lark.Lark) -> None:
+    text = "let x = discrete(0.1, 0.2, 0.3, 0.4) in (x < int(2, 2)) || nth_bit(int(2, 0), x)"
+    assert parse_string_compile(text, test_parser)[BoolType(True)] == pytest.approx(1.0, rel=1e-6)
+    text = "let x = discrete(0.1, 0.2, 0.3, 0.4) in x == int(2, 2)"
+    assert parse_string_compile(text, test_parser)[BoolType(True)] == pytest.approx(0.3, rel=1e-6)
+
+
+def test_int_observe_compiled(test_parser: lark.Lark) -> None:
+    text = "let x = uniform(3, 1, 6) in let _ = observe x < int(3, 4) in x"
+    res = parse_string_compile(text, test_parser)
+    assert set(res) == {IntType(3, 1), IntType(3, 2), IntType(3, 3)}
+    assert res[IntType(3, 2)] == pytest.approx(1 / 3, rel=1e-6)
+
+
+def test_binomial_compiled(test_parser: lark.Lark) -> None:
+    text = "binomial(3, 5, 0.3)"
+    res = parse_string_compile(text, test_parser)
+    assert res[IntType(3, 2)] == pytest.approx(10 * 0.3**2 * 0.7**3, rel=1e-6)
+
+
+def test_tuple_compiled(test_parser: lark.Lark) -> None:
+    text = """
+    let aliceDunnit = flip 0.3 in
+    let withGun = if aliceDunnit then flip 0.03 else flip 0.8 in
+    let _ = observe withGun in
+    (aliceDunnit, withGun)
+    """
+    res = parse_string_compile(text, test_parser)
+    assert set(res) == {TupleType(BoolType(True), BoolType(True)), TupleType(BoolType(False), BoolType(True))}
+    assert res[TupleType(BoolType(True), BoolType(True))] == pytest.approx(
+        0.3 * 0.03 / (0.3 * 0.03 + 0.7 * 0.8), rel=1e-6
+    )
+
+
+def test_list_compiled(test_parser: lark.Lark) -> None:
+    text = "let l = flip 0.5 :: [flip 0.2] in (head (tail l), length l)"
+    res = parse_string_compile(text, test_parser)
+    assert res[TupleType(BoolType(True), IntType(4, 2))] == pytest.approx(0.2, rel=1e-6)
+    assert res[TupleType(BoolType(False), IntType(4, 2))] == pytest.approx(0.8, rel=1e-6)
+
+
+def test_function_summary_compiled(test_parser: lark.Lark) -> None:
+    text = """
+    fun mystery() {
+        let aliceDunnit = flip 0.3 in
+        let withGun = if aliceDunnit then flip 0.03 else flip 0.8 in
+        (aliceDunnit, withGun)
+    }
+    let res = mystery() in
+    let _ = observe snd res in
+    fst res
+    """
+    assert parse_string_compile(text, test_parser)[BoolType(True)] == pytest.approx(
+        0.3 * 0.03 / (0.3 * 0.03 + 0.7 * 0.8), rel=1e-6
+    )
+
+
+def test_int_function_compiled(test_parser: lark.Lark) -> None:
+    text = """
+    fun inc(x: int(2)) { let _ = observe !(x == int(2, 0)) in x + int(2, 1) }
+    let a = discrete(0.25, 0.25, 0.25, 0.25) in
+    (inc(a), inc(a))
+    """
+    res = parse_string_compile(text, test_parser)
+    assert set(res) == {TupleType(IntType(2, i), IntType(2, i)) for i in (0, 2, 3)}
+    assert res[TupleType(IntType(2, 0), IntType(2, 0))] == pytest.approx(1 / 3, rel=1e-6)
+
+
+def test_seeded_distributions_reproducible(test_parser: lark.Lark) -> None:
+    text = "let x = discrete(0.1, 0.2, 0.3, 0.4) in (x, (uniform(3, 1, 6), binomial(3, 5, 0.3)))"
+    ir = TreeTransformer().transform(test_parser.parse(text))
+    for compiled in (True, False):
+        random.seed(1)
+        res1 = Inferencer(ir, num_iterations=500, seed=5, compiled=compiled).infer()
+        # The global random module must not affect seeded runs
+        random.seed(2)
+        res2 = Inferencer(ir, num_iterations=500, seed=5, compiled=compiled).infer()
+        assert res1 == res2
+
+
+def test_interpreted_function_calls_seeded(test_parser: lark.Lark) -> None:
+    text = """
+    fun noisy(a: bool) {
+        let x = flip 0.3 in
+        let _ = observe a || x in
+        x
+    }
+    let x = flip 0.5 in
+    let y = noisy(x) in
+    (x, y)
+    """
+    ir = TreeTransformer().transform(test_parser.parse(text))
+    res1 = Inferencer(ir, num_iterations=2000, seed=3, compiled=False).infer()
+    res2 = Inferencer(ir, num_iterations=2000, seed=3, compiled=False).infer()
+    assert res1 == res2
+    # The call's `x` doesn't leak into the caller's
+    assert TupleType(BoolType(False), BoolType(False)) not in res1
+    assert res1[TupleType(BoolType(False), BoolType(True))] == pytest.approx(0.15 / 0.65, abs=0.04)
+
+
+def test_sample_n() -> None:
+    rng = np.random.default_rng(0)
+    dists = [
+        DiscreteDistribution([0.1, 0.2, 0.3, 0.4]),
+        UniformDistribution(3, 1, 6),
+        BinomialDistribution(3, 5, 0.3),
+    ]
+    for dist in dists:
+        exact = {outcome.val: prob for outcome, prob in dist.pmf().items()}
+        width, samples = dist.sample_n(rng, 20000)
+        assert width == next(iter(dist.pmf())).width
+        assert samples.dtype == np.uint64
+        for val, prob in exact.items():
+            assert np.mean(samples == val) == pytest.approx(prob, abs=0.015)
+        # The default implementation loops over `sample`
+        width, samples = CustomDistribution.sample_n(dist, rng, 5000)
+        for val, prob in exact.items():
+            assert np.mean(samples == val) == pytest.approx(prob, abs=0.03)
+
+
+def test_sample_n_64_bits() -> None:
+    rng = np.random.default_rng(0)
+    uniform = UniformDistribution(64, 2 ** 64 - 4, 2 ** 64)
+    width, samples = uniform.sample_n(rng, 1000)
+    assert width == 64
+    assert set(samples.tolist()) == set(range(2 ** 64 - 4, 2 ** 64))
+    width, samples = BinomialDistribution(64, 5, 0.5).sample_n(rng, 1000)
+    assert width == 64
+    assert set(samples.tolist()) <= set(range(6))
+
+
+def test_discrete_alias_table() -> None:
+    weights = [float(i % 7) for i in range(256)]
+    dist1, dist2 = DiscreteDistribution(list(weights)), DiscreteDistribution(list(weights))
+    assert dist1.table is dist2.table
+    rng = random.Random(0)
+    counts = Counter(dist1.sample(rng).val for _ in range(100000))
+    for i in (0, 1, 6, 250):
+        assert counts[i] / 100000 == pytest.approx(dist1.probs[i], abs=0.002)
+
+
+def test_adaptive(test_parser: lark.Lark) -> None:
+    text = "let x = flip 0.3 in let y = flip 0.5 in let _ = observe x || y in x"
+    ir = TreeTransformer().transform(test_parser.parse(text))
+    estimate = Inferencer(ir, seed=0).inferAdaptive(0.05)
+    assert estimate.converged
+    exact = 0.3 / (1 - 0.7 * 0.5)
+    lo, hi = estimate.intervals[BoolType(True)]
+    assert hi - lo < 0.05
+    assert lo <= exact <= hi
+    assert estimate.probs[BoolType(True)] == pytest.approx(exact, abs=0.05)
+    assert estimate.num_samples < estimate.num_iterations
+
+    estimate = Inferencer(ir, seed=0).inferAdaptive(1e-6, max_iterations=2500)
+    assert not estimate.converged
+    assert estimate.num_iterations == 2500
+
+
+def test_likelihood_weighting(test_parser: lark.Lark) -> None:
+    text = """
+    let y = flip 0.3 in
+    let x = flip 0.001 in
+    let z = if y then flip 0.9 else flip 0.2 in
+    let _ = observe x in
+    let _ = observe !(flip 0.5) in
+    if x then z else false
+    """
+    ir = TreeTransformer().transform(test_parser.parse(text))
+    res = Inferencer(ir, num_iterations=20000, seed=0, likelihood_weighting=True).infer()
+    assert res[BoolType(True)] == pytest.approx(0.3 * 0.9 + 0.7 * 0.2, rel=0.05)
+
+
+def test_likelihood_weighting_read_before_observe(test_parser: lark.Lark) -> None:
+    # x is read before it is observed, so it can't be forced by the observe
+    text = """
+    let x = flip 0.3 in
+    let y = x && flip 0.5 in
+    let _ = observe x in
+    y
+    """
+    ir = TreeTransformer().transform(test_parser.parse(text))
+    res = Inferencer(ir, num_iterations=20000, seed=0, likelihood_weighting=True).infer()
+    assert res[BoolType(True)] == pytest.approx(0.5, rel=0.05)
+
+
+def test_all_samples_rejected(test_parser: lark.Lark) -> None:
+    text = "let x = flip 0.5 in let _ = observe x && !x in x"
+    ir = TreeTransformer().transform(test_parser.parse(text))
+    with pytest.raises(Exception, match="rejected"):
+        Inferencer(ir, num_iterations=100, seed=0).infer()
+
+
+def test_smc_long_evidence_chain(test_parser: lark.Lark) -> None:
+    # A hidden state observed through a noisy sensor twelve times. The
+    # evidence is far too unlikely for rejection sampling.
+    steps = "".join(
+        f"let o{i} = if h then flip 0.3 else flip 0.1 in let _ = observe o{i} in"
+        + " let h = if h then flip 0.8 else flip 0.3 in "
+        for i in range(12)
+    )
+    text = "let h = flip 0.5 in " + steps + "h"
+    ir = TreeTransformer().transform(test_parser.parse(text))
+    exact = parse_string_compile(text, test_parser)
+    smc = SMCInferencer(ir, num_particles=2000, seed=0)
+    res = smc.infer()
+    assert res[BoolType(True)] == pytest.approx(exact[BoolType(True)], abs=0.03)
+    assert smc.num_resamples > 0
+
+
+def test_smc_long_let_chain() -> None:
+    # Generated programs chain thousands of `let`s, far deeper than Python's
+    # recursion limit
+    steps = "".join(
+        f"let o{i} = flip 0.5 in let _ = observe h || o{i} in " for i in range(3000)
+    )
+    ir = parse_ir("let h = flip 0.5 in " + steps + "h", make_parser())
+    tree = Optimizer(ir).optimize()
+    checker = TypeChecker(tree)
+    checker.check()
+    assert type(checker.resultType()) is BoolType
+    # Every observation of `o` is evidence for `h`
+    res = SMCInferencer(tree, num_particles=200, seed=0).infer()
+    assert res[BoolType(True)] == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize("infer", [
+    lambda ir: Inferencer(ir, num_iterations=200, seed=0).infer(),
+    lambda ir: Inferencer(ir, num_iterations=200, seed=0, compiled=False).infer(),
+    lambda ir: Inferencer(ir, num_iterations=200, seed=0, likelihood_weighting=True).infer(),
+    lambda ir: Inferencer(ir, num_iterations=200, seed=0, workers=2).infer(),
+    lambda ir: VectorizedInferencer(ir, num_iterations=200, seed=0).infer(),
+    lambda ir: HybridInferencer(ir, num_iterations=10, seed=0).infer(),
+    lambda ir: PyEdaCompiler(ir).infer(),
+], ids=["compiled", "tree", "weighted", "workers", "vectorized", "hybrid", "bdd"])
+def test_long_let_chain(infer) -> None:
+    # Negates `h` an even number of times, so the result is always true
+    steps = "".join(f"let x{i + 1} = !x{i} in " for i in range(3000))
+    text = "let h = flip 0.5 in let _ = observe h || flip 0.5 in let x0 = h in " \
+        + steps + "x3000 || !h"
+    ir = parse_ir(text, make_parser())
+    assert infer(ir)[BoolType(True)] == pytest.approx(1.0)
+
+
+def test_smc_matches_inferencer(test_parser: lark.Lark) -> None:
+    text = """
+    fun f(a: bool) { a || flip 0.2 }
+    let y = flip 0.3 in
+    let x = flip 0.1 in
+    let z = if y then flip 0.9 else f(x) in
+    let _ = observe x in
+    let _ = observe !(flip 0.5) in
+    if x then (z, y) else (false, false)
+    """
+    ir = TreeTransformer().transform(test_parser.parse(text))
+    expected = Inferencer(ir, num_iterations=20000, seed=0).infer()
+    res = SMCInferencer(ir, num_particles=5000, seed=0).infer()
+    assert res.keys() == expected.keys()
+    for outcome, prob in expected.items():
+        assert res[outcome] == pytest.approx(prob, abs=0.03)
+
+
+def test_hybrid_compiles_boolean_part(test_parser: lark.Lark) -> None:
+    text = """
+    let a = flip 0.3 in
+    let b = flip 0.6 in
+    let xs = if a then [int(4, 1), int(4, 2)] else [int(4, 1)] in
+    let c = b || flip 0.1 in
+    let _ = observe c in
+    let n = length(xs) in
+    (b, n == int(4, 2))
+    """
+    ir = TreeTransformer().transform(test_parser.parse(text))
+    hybrid = HybridInferencer(ir, num_iterations=5000, seed=0)
+    assert {binding.ident for binding in hybrid.sampled} == {"a", "xs", "n"}
+    assert not hybrid.result_sampled
+    res = hybrid.infer()
+    # b given the evidence is computed exactly, so only a is sampled
+    p_b = 0.6 / (0.6 + 0.4 * 0.1)
+    assert res[TupleType(BoolType(True), BoolType(True))] == pytest.approx(p_b * 0.3, abs=0.02)
+    assert res[TupleType(BoolType(True), BoolType(False))] == pytest.approx(p_b * 0.7, abs=0.02)
+    assert len(hybrid.compiled) == 2
+
+
+def test_hybrid_exact_without_lists(test_parser: lark.Lark) -> None:
+    text = "let a = flip 0.3 in let b = flip 0.2 in let _ = observe a || b in a"
+    ir = TreeTransformer().transform(test_parser.parse(text))
+    hybrid = HybridInferencer(ir, num_iterations=10, seed=0)
+    assert not hybrid.sampled
+    assert hybrid.infer()[BoolType(True)] == pytest.approx(0.3 / (1 - 0.7 * 0.8))
+
+
+def test_hybrid_list_function(test_parser: lark.Lark) -> None:
+    text = """
+    fun f(l: list(bool)) { head(l) }
+    let x = flip 0.5 in
+    let y = if x then [true] else [false, true] in
+    let z = f(y) in
+    let w = flip 0.1 in
+    let _ = observe z || w in
+    (x, w)
+    """
+    ir = TreeTransformer().transform(test_parser.parse(text))
+    hybrid = HybridInferencer(ir, num_iterations=5000, seed=0)
+    assert hybrid.sampled_functions == {"f"}
+    assert {binding.ident for binding in hybrid.sampled} == {"x", "y", "z"}
+    res = hybrid.infer()
+    assert res[TupleType(BoolType(False), BoolType(True))] == pytest.approx(0.05 / 0.55, abs=0.02)
+
+
+def test_values_are_shared() -> None:
+    assert BoolType(1) is BoolType(True)
+    assert IntType(4, 19) is IntType(4, 3)
+    assert IntType(4, -1).val == 15
+    assert IntType(12, 3000) == IntType(12, 3000)
+    # `==` is a dice boolean, which Python reads as the plain bool it holds
+    assert repr(IntType(4, 3) == IntType(4, 2)) == "BoolType(False)"
+    assert not (TupleType(BoolType(True), IntType(2, 1)) == TupleType(BoolType(True), IntType(2, 2)))
+    counts = Counter([TupleType(IntType(4, 1), IntType(4, 2)), TupleType(IntType(4, 2), IntType(4, 1))])
+    assert counts[TupleType(IntType(4, 1), IntType(4, 2))] == 1
+    with pytest.raises(ValueError):
+        IntType(0, 0)
+    with pytest.raises(AttributeError):
+        BoolType(True).extra = 1
+
+
+def test_plugin_manifest() -> None:
+    import custom_distribution
+
+    assert custom_distribution._scanPlugins() == custom_distribution._loadManifest()
+    assert set(custom_distribution.distribution_names) >= {"uniform", "binomial", "discrete"}
+    assert custom_distribution.distributionClass("uniform") is UniformDistribution
+
+
+def test_parse_long_programs() -> None:
+    weights = ", ".join(["0.25"] * 4096)
+    lets = "".join(f"let x{i} = flip 0.5 in\n" for i in range(5000))
+    text = f"let d = discrete({weights}) in {lets} (d, x4999)"
+    ir = make_parser().parse(text)
+    assert len(ir.expr.val.probs) == 4096
+    depth, tree = 0, ir.expr
+    while isinstance(tree, node.AssignNode):
+        depth, tree = depth + 1, tree.rest
+    assert depth == 5001
+
+
+def test_parsers_agree(test_parser: lark.Lark) -> None:
+    text = """
+    fun f(a: int(3)) { a + int(3, 1) }
+    let x = discrete(0.1, 0.2, 0.3, 0.4) in
+    let y = binomial(3, 4, 0.5) in
+    (f(y), x)
+    """
+    inline, two_pass = parse_ir(text, make_parser()), parse_ir(text, test_parser)
+    # Distributions repr as their address, so check those separately
+    assert inline.expr.val.probs == two_pass.expr.val.probs
+    assert vars(inline.expr.rest.val) == vars(two_pass.expr.rest.val)
+    assert repr(inline.functions) == repr(two_pass.functions)
+    assert repr(inline.expr.rest.rest) == repr(two_pass.expr.rest.rest)
+
+
+@pytest.mark.parametrize("engine", ["--bdd", "--tolerance=0.1", "--hybrid", "--smc", "--vectorized", "--order-stats"])
+def test_cli_workers_need_default_sampler(engine: str, tmp_path, monkeypatch) -> None:
+    program = tmp_path / "program.dice"
+    program.write_text("flip 0.5")
+    monkeypatch.setattr(sys, "argv", ["PyDice.py", engine, "-j", "2", str(program)])
+    with pytest.raises(SystemExit):
+        PyDice.main()
+
+
+def test_cli_num_its(tmp_path, monkeypatch, capsys) -> None:
+    program = tmp_path / "program.dice"
+    program.write_text("flip 0.5")
+    monkeypatch.setattr(PyDice, "parse_string", lambda prog, parser, num_its, *args: num_its)
+    for num_its, expected in [(None, 10000), ("0", 0), ("7", 7)]:
+        flags = [] if num_its is None else ["-n", num_its]
+        monkeypatch.setattr(sys, "argv", ["PyDice.py", "--no-cache", *flags, str(program)])
+        PyDice.main()
+        assert capsys.readouterr().out.strip() == str(expected)
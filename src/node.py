@@ -43,6 +43,22 @@ class AssignNode(ExprNode):
             + ")"
         )
 
+    # A chain of `let`s pickles as a flat list, since pickle recurses once per
+    # nested object and generated programs can have thousands of `let`s
+    def __reduce__(self):
+        bindings = []
+        treeNode = self
+        while type(treeNode) is AssignNode:
+            bindings.append((treeNode.ident, treeNode.val))
+            treeNode = treeNode.rest
+        return _assignChain, (bindings, treeNode)
+
+
+def _assignChain(bindings: list, rest: ExprNode) -> AssignNode:
+    for ident, val in reversed(bindings):
+        rest = AssignNode(ident, val, rest)
+    return rest
+
 
 class IfNode(ExprNode):
     def __init__(self, cond: ExprNode, true_expr: ExprNode, false_expr: ExprNode):
@@ -77,7 +93,9 @@ class ObserveNode(ExprNode):
 class UnaryNode(ExprNode):
     def __init__(self, operand: ExprNode):
         self.operand = operand
-        self.op = lambda _: None
+
+    def op(self, _):
+        return None
 
     def __repr__(self):
         return "(\n" + log.indent(self.operand) + "\n)"
@@ -86,7 +104,9 @@ class UnaryNode(ExprNode):
 class NotNode(UnaryNode):
     def __init__(self, operand: ExprNode):
         super().__init__(operand)
-        self.op = lambda x: x.__not__()  # can't override not operator for object
+
+    def op(self, x):
+        return x.__not__()  # can't override not operator for object
 
     def __repr__(self):
         return "NotNode" + super().__repr__()
@@ -97,7 +117,9 @@ class LeftShiftNode(UnaryNode):
     def __init__(self, left: ExprNode, amt: int):
         super().__init__(left)
         self.amt = amt
-        self.op = lambda x: x << self.amt
+
+    def op(self, x):
+        return x << self.amt
 
     def __repr__(self):
         return "LeftShiftNode" + super().__repr__()
@@ -108,7 +130,9 @@ class RightShiftNode(UnaryNode):
     def __init__(self, left: ExprNode, amt: int):
         super().__init__(left)
         self.amt = amt
-        self.op = lambda x: x >> self.amt
+
+    def op(self, x):
+        return x >> self.amt
 
     def __repr__(self):
         return "RightShiftNode" + super().__repr__()
@@ -121,7 +145,9 @@ class BinaryNode(ExprNode):
     def __init__(self, left: ExprNode, right: ExprNode):
         self.left = left
         self.right = right
-        self.op = lambda _, __: None
+
+    def op(self, _, __):
+        return None
 
     def __repr__(self):
         return "(\n" + log.indent(self.left) + ",\n" + log.indent(self.right) + "\n)"
@@ -201,7 +227,7 @@ class DivNode(BinaryNode):
 class NthBitNode(BinaryNode):
     def __init__(self, left: ExprNode, right: ExprNode):
         super().__init__(left, right)
-        self.op = lambda x, y: NthBitNode.nth_bit(x, y)
+        self.op = NthBitNode.nth_bit
 
     @staticmethod
     def nth_bit(n: IntType, number: IntType) -> BoolType:
@@ -222,7 +248,7 @@ class NthBitNode(BinaryNode):
 class ConcatNode(BinaryNode):
     def __init__(self, left: ExprNode, right: ExprNode):
         super().__init__(left, right)
-        self.op = lambda x, y: ConcatNode.concat(x, y)
+        self.op = ConcatNode.concat
 
     @staticmethod
     def concat(x: DiceType, y: ListType):
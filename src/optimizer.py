@@ -0,0 +1,515 @@
+# An optimization pass over the IR, run between TreeTransformer and
+# inference. It returns a new tree and leaves the original alone.
+#
+# - Constant folding: operators whose operands are all constants are
+#   evaluated, `let`-bound constants are substituted into their uses, and
+#   `if`s with a constant condition are replaced by the branch they take.
+# - Algebraic simplification: `!!x`, `x && true`, `x || false`, `x + 0`,
+#   `if c then true else false` and so on.
+# - Dead `let` elimination: bindings that are never read are dropped unless
+#   evaluating them has an effect, i.e. they observe something (perhaps
+#   inside a function call). An unread random draw doesn't change the
+#   distribution of the result, so it is dropped too.
+# - Common subexpression elimination: deterministic subexpressions that
+#   appear more than once in the same expression are computed once by a new
+#   `let`. The desugared operators (`<=`, `^`, `<=>`, ...) repeat their
+#   operands, so this mostly undoes that duplication.
+#
+# The program is type checked first, and rewrites that would drop an
+# operand only happen when its type is known, so that a type error is never
+# optimized away.
+import custom_distribution
+import node
+from checker import TypeChecker, isKnown
+from dicetypes import DiceType, BoolType, IntType, TupleType
+
+
+TRUE = BoolType(True)
+FALSE = BoolType(False)
+
+
+def _isBool(treeNode, val: bool) -> bool:
+    return type(treeNode) is BoolType and treeNode.val == val
+
+
+def _isInt(treeNode, val: int) -> bool:
+    return type(treeNode) is IntType and treeNode.val == val
+
+
+def _children(treeNode):
+    for child in vars(treeNode).values():
+        yield from (child if type(child) is list else [child])
+
+
+# Splits a chain of `let`s into its bindings and the expression at its end.
+# Passes go down the chain with a loop rather than recursion, since
+# generated programs can have thousands of `let`s in a row.
+def _letChain(treeNode):
+    chain = []
+    while type(treeNode) is node.AssignNode:
+        chain.append(treeNode)
+        treeNode = treeNode.rest
+    return chain, treeNode
+
+
+# A hashable key that is the same for structurally equal trees
+def _structuralKey(treeNode):
+    if isinstance(treeNode, DiceType):
+        return ("const", repr(treeNode))
+    if isinstance(treeNode, node.Node):
+        return (type(treeNode),) + tuple(
+            (name, _structuralKey(val)) for name, val in vars(treeNode).items()
+            if not callable(val) or isinstance(val, node.Node)
+        )
+    if type(treeNode) is list:
+        return tuple(_structuralKey(val) for val in treeNode)
+    return treeNode
+
+
+def _size(treeNode) -> int:
+    if not isinstance(treeNode, node.Node):
+        return 1
+    return 1 + sum(_size(child) for child in _children(treeNode))
+
+
+class Optimizer:
+    # Nodes that make a subexpression random
+    RANDOM_NODES = (node.FlipNode, custom_distribution.CustomDistribution)
+
+    def __init__(self, tree, variables=None):
+        self.tree = tree
+        self.variables = variables if variables is not None else {}
+        self.types = {}
+        # Functions whose calls have effects (or may never return), and
+        # functions whose results are random
+        self.effectful_functions = set()
+        self.random_functions = set()
+        self.free_vars = {}
+        self.num_cse = 0
+
+    def optimize(self):
+        tree = self.tree
+        if type(tree) is not node.ProgramNode:
+            self.types = TypeChecker(tree, self.variables).check()
+            tree = self.recurseTree(tree, {})
+            self.types = TypeChecker(tree, self.variables).check()
+            return self.eliminateCommon(tree)
+
+        self.types = TypeChecker(tree, self.variables).check()
+        self.findFunctionEffects(tree.functions)
+        functions = [
+            node.FunctionNode(function.ident, function.arg_list_node,
+                              self.recurseTree(function.expr, {}))
+            for function in tree.functions
+        ]
+        tree = node.ProgramNode(functions + [self.recurseTree(tree.expr, {})])
+
+        # Sharing needs the types of the simplified tree
+        self.types = TypeChecker(tree, self.variables).check()
+        functions = [
+            node.FunctionNode(function.ident, function.arg_list_node,
+                              self.eliminateCommon(function.expr))
+            for function in tree.functions
+        ]
+        return node.ProgramNode(functions + [self.eliminateCommon(tree.expr)])
+
+    ### Analysis ##############################################################
+
+    def findFunctionEffects(self, functions: list):
+        bodies = {function.ident: function.expr for function in functions}
+        calls = {ident: self.calls(body) for ident, body in bodies.items()}
+
+        # A function that can reach itself might not return
+        for ident in bodies:
+            seen, stack = set(), list(calls[ident])
+            while stack:
+                callee = stack.pop()
+                if callee not in seen and callee in calls:
+                    seen.add(callee)
+                    stack.extend(calls[callee])
+            if ident in seen:
+                self.effectful_functions.add(ident)
+
+        changed = True
+        while changed:
+            changed = False
+            for ident, body in bodies.items():
+                if ident not in self.effectful_functions and self.hasEffects(body):
+                    self.effectful_functions.add(ident)
+                    changed = True
+                if ident not in self.random_functions and self.isRandom(body):
+                    self.random_functions.add(ident)
+                    changed = True
+
+    def calls(self, treeNode) -> set[str]:
+        if type(treeNode) is node.AssignNode:
+            chain, end = _letChain(treeNode)
+            return self.calls(end).union(*(self.calls(assign.val) for assign in chain))
+        if not isinstance(treeNode, node.Node):
+            return set()
+        res = {treeNode.ident} if type(treeNode) is node.FunctionCallNode else set()
+        for child in _children(treeNode):
+            res |= self.calls(child)
+        return res
+
+    # Whether evaluating `treeNode` can do more than produce a value
+    def hasEffects(self, treeNode) -> bool:
+        if type(treeNode) is node.ObserveNode:
+            return True
+        if type(treeNode) is node.FunctionCallNode and (
+                treeNode.ident in self.effectful_functions):
+            return True
+        if type(treeNode) is node.AssignNode:
+            chain, end = _letChain(treeNode)
+            return any(self.hasEffects(assign.val) for assign in chain) or self.hasEffects(end)
+        if not isinstance(treeNode, node.Node):
+            return False
+        return any(self.hasEffects(child) for child in _children(treeNode))
+
+    def isRandom(self, treeNode) -> bool:
+        if isinstance(treeNode, self.RANDOM_NODES):
+            return True
+        if type(treeNode) is node.FunctionCallNode and (
+                treeNode.ident in self.random_functions):
+            return True
+        if type(treeNode) is node.AssignNode:
+            chain, end = _letChain(treeNode)
+            return any(self.isRandom(assign.val) for assign in chain) or self.isRandom(end)
+        if not isinstance(treeNode, node.Node):
+            return False
+        return any(self.isRandom(child) for child in _children(treeNode))
+
+    # The variables `treeNode` reads from outside itself. Memoized, since
+    # each `let` in a chain asks about the rest of the chain.
+    def freeVars(self, treeNode) -> set[str]:
+        if not isinstance(treeNode, node.Node):
+            return set()
+        res = self.free_vars.get(treeNode)
+        if res is not None:
+            return res
+        if type(treeNode) is node.IdentNode:
+            res = {treeNode.ident}
+        elif type(treeNode) is node.AssignNode:
+            # From the end of the chain back, so each `let` finds the rest
+            # of the chain already memoized
+            chain, end = _letChain(treeNode)
+            res = self.freeVars(end)
+            for assign in reversed(chain):
+                res = self.free_vars.get(assign)
+                if res is None:
+                    res = self.freeVars(assign.val) | (self.freeVars(assign.rest) - {assign.ident})
+                    self.free_vars[assign] = res
+            return res
+        else:
+            res = set()
+            for child in _children(treeNode):
+                res |= self.freeVars(child)
+        self.free_vars[treeNode] = res
+        return res
+
+    # Whether the checker found that `treeNode` (from the original tree)
+    # always has type `dice_type`
+    def hasType(self, treeNode, dice_type: type) -> bool:
+        if isinstance(treeNode, DiceType):
+            return type(treeNode) is dice_type
+        return type(self.types.get(treeNode)) is dice_type
+
+    ### Folding and simplification ############################################
+
+    # Returns the optimized copy of `treeNode`. `constants` maps the
+    # variables in scope that are bound to constants (or to other variables)
+    # to their values.
+    def recurseTree(self, treeNode, constants: dict):
+        if isinstance(treeNode, DiceType):
+            return treeNode
+
+        elif type(treeNode) is node.FlipNode:
+            if treeNode.prob <= 0:
+                return FALSE
+            if treeNode.prob >= 1:
+                return TRUE
+            return treeNode
+
+        elif type(treeNode) is node.IdentNode:
+            return constants.get(treeNode.ident, treeNode)
+
+        elif type(treeNode) is node.AssignNode:
+            return self.optimizeAssign(treeNode, constants)
+
+        elif type(treeNode) is node.IfNode:
+            return self.optimizeIf(treeNode, constants)
+
+        elif type(treeNode) is node.NotNode:
+            operand = self.recurseTree(treeNode.operand, constants)
+            if type(operand) is BoolType:
+                return operand.__not__()
+            if type(operand) is node.NotNode and self.hasType(treeNode.operand, BoolType):
+                return operand.operand
+            return node.NotNode(operand)
+
+        elif type(treeNode) in (node.AndNode, node.OrNode):
+            return self.optimizeBool(treeNode, constants)
+
+        elif type(treeNode) in (node.AddNode, node.SubNode, node.MulNode):
+            return self.optimizeArith(treeNode, constants)
+
+        elif isinstance(treeNode, node.BinaryNode):
+            left = self.recurseTree(treeNode.left, constants)
+            right = self.recurseTree(treeNode.right, constants)
+            return self.fold(type(treeNode)(left, right))
+
+        elif type(treeNode) in (node.LeftShiftNode, node.RightShiftNode):
+            operand = self.recurseTree(treeNode.operand, constants)
+            return self.fold(type(treeNode)(operand, treeNode.amt))
+
+        elif type(treeNode) is node.ObserveNode:
+            observation = self.recurseTree(treeNode.observation, constants)
+            if _isBool(observation, True):
+                return TRUE
+            return node.ObserveNode(observation)
+
+        elif type(treeNode) is node.TupleNode:
+            left = self.recurseTree(treeNode.left, constants)
+            right = self.recurseTree(treeNode.right, constants)
+            if isinstance(left, DiceType) and isinstance(right, DiceType):
+                return TupleType(left, right)
+            return node.TupleNode(left, right)
+
+        elif type(treeNode) in (node.FstNode, node.SndNode):
+            tup = self.recurseTree(treeNode.tup, constants)
+            if type(tup) is TupleType:
+                return tup.left if type(treeNode) is node.FstNode else tup.right
+            return type(treeNode)(tup)
+
+        elif type(treeNode) is node.ListNode:
+            return node.ListNode(
+                [self.recurseTree(item, constants) for item in treeNode.lst], treeNode.type_
+            )
+
+        elif type(treeNode) in (node.HeadNode, node.TailNode, node.LengthNode):
+            return type(treeNode)(self.recurseTree(treeNode.lst, constants))
+
+        elif type(treeNode) is node.FunctionCallNode:
+            args = [self.recurseTree(arg, constants) for arg in treeNode.arg_list_node.args]
+            return node.FunctionCallNode(treeNode.ident, node.ArgListNode(args))
+
+        # Custom distributions, and anything else without children
+        return treeNode
+
+    # Evaluates an operator whose operands are all constants. Leaves it alone
+    # if that fails, so the error still happens when the program runs.
+    def fold(self, treeNode):
+        if isinstance(treeNode, node.BinaryNode):
+            operands = (treeNode.left, treeNode.right)
+        else:
+            operands = (treeNode.operand,)
+        if not all(isinstance(operand, DiceType) for operand in operands) \
+                or type(treeNode) is node.ConcatNode:
+            return treeNode
+        try:
+            return treeNode.op(*operands)
+        except Exception:
+            return treeNode
+
+    # Goes down the chain of `let`s starting at `treeNode`, then builds the
+    # optimized chain back up from its end
+    def optimizeAssign(self, treeNode: node.AssignNode, constants: dict):
+        chain = []
+        while type(treeNode) is node.AssignNode:
+            val = self.recurseTree(treeNode.val, constants)
+            # Aliases of the variable this binding shadows can't be
+            # substituted any more, since past here the name means something
+            # else. They become real bindings again, just before this one.
+            aliases = [
+                (ident, c) for ident, c in constants.items()
+                if ident != treeNode.ident
+                and type(c) is node.IdentNode and c.ident == treeNode.ident
+            ]
+            shadowed = {treeNode.ident} | {ident for ident, _ in aliases}
+            constants = {
+                ident: c for ident, c in constants.items() if ident not in shadowed
+            }
+            substituted = isinstance(val, DiceType) or type(val) is node.IdentNode
+            if substituted:
+                # Substituted into every use, so the binding itself is dead
+                constants[treeNode.ident] = val
+            chain.append((treeNode, val, substituted, aliases))
+            treeNode = treeNode.rest
+
+        res = self.recurseTree(treeNode, constants)
+        for assign, val, substituted, aliases in reversed(chain):
+            # An unread binding still has to be evaluated if that could
+            # observe something or fail
+            if not substituted and (assign.ident in self.freeVars(res) or self.hasEffects(val)
+                                    or not self.safe(assign.val, random=True)):
+                res = node.AssignNode(assign.ident, val, res)
+            for alias, target in reversed(aliases):
+                if alias in self.freeVars(res):
+                    res = node.AssignNode(alias, target, res)
+            # Keeps freeVars from recursing down the chain later on
+            self.freeVars(res)
+        return res
+
+    def optimizeIf(self, treeNode: node.IfNode, constants: dict):
+        cond = self.recurseTree(treeNode.cond, constants)
+        if type(cond) is BoolType:
+            branch = treeNode.true_expr if cond.val else treeNode.false_expr
+            return self.recurseTree(branch, constants)
+        true_expr = self.recurseTree(treeNode.true_expr, constants)
+        false_expr = self.recurseTree(treeNode.false_expr, constants)
+
+        if type(cond) is node.NotNode:
+            cond, true_expr, false_expr = cond.operand, false_expr, true_expr
+        if _isBool(true_expr, True) and _isBool(false_expr, False):
+            return cond
+        if _isBool(true_expr, False) and _isBool(false_expr, True):
+            return node.NotNode(cond)
+        if isinstance(true_expr, DiceType) and isinstance(false_expr, DiceType) \
+                and _structuralKey(true_expr) == _structuralKey(false_expr) \
+                and not self.hasEffects(cond):
+            return true_expr
+        return node.IfNode(cond, true_expr, false_expr)
+
+    def optimizeBool(self, treeNode: node.BinaryNode, constants: dict):
+        left = self.recurseTree(treeNode.left, constants)
+        right = self.recurseTree(treeNode.right, constants)
+        if not (self.hasType(treeNode.left, BoolType) and self.hasType(treeNode.right, BoolType)):
+            return self.fold(type(treeNode)(left, right))
+
+        # `identity && x` is x, and `absorbing && x` is absorbing if x can
+        # be skipped
+        identity = type(treeNode) is node.AndNode
+        for const, other in ((left, right), (right, left)):
+            if type(const) is not BoolType:
+                continue
+            if const.val == identity:
+                return other
+            if not self.hasEffects(other):
+                return const
+        return self.fold(type(treeNode)(left, right))
+
+    def optimizeArith(self, treeNode: node.BinaryNode, constants: dict):
+        left = self.recurseTree(treeNode.left, constants)
+        right = self.recurseTree(treeNode.right, constants)
+        if not (self.hasType(treeNode.left, IntType) and self.hasType(treeNode.right, IntType)):
+            return self.fold(type(treeNode)(left, right))
+
+        if type(treeNode) is node.AddNode:
+            if _isInt(left, 0):
+                return right
+            if _isInt(right, 0):
+                return left
+        elif type(treeNode) is node.SubNode:
+            if _isInt(right, 0):
+                return left
+        elif type(treeNode) is node.MulNode:
+            if _isInt(left, 1):
+                return right
+            if _isInt(right, 1):
+                return left
+            for const, other in ((left, right), (right, left)):
+                if _isInt(const, 0) and not self.hasEffects(other):
+                    return const
+        return self.fold(type(treeNode)(left, right))
+
+    ### Common subexpression elimination ######################################
+
+    # Shares the repeated subexpressions of `treeNode`, and of every `let`
+    # value and body inside it. Within an expression without `let`s, every
+    # variable means the same thing everywhere, so a repeated subexpression
+    # can be computed once up front.
+    def eliminateCommon(self, treeNode):
+        if type(treeNode) is node.AssignNode:
+            chain, end = _letChain(treeNode)
+            vals = [self.eliminateCommon(assign.val) for assign in chain]
+            res = self.eliminateCommon(end)
+            for assign, val in zip(reversed(chain), reversed(vals)):
+                res = node.AssignNode(assign.ident, val, res)
+            return res
+        if not isinstance(treeNode, node.Node) or self.containsAssign(treeNode):
+            return treeNode
+
+        bindings = []
+        while True:
+            counts = {}
+            self.countSubtrees(treeNode, counts)
+            repeated = [
+                (size, key, subtree) for key, (count, size, subtree) in counts.items()
+                if count > 1
+            ]
+            if not repeated:
+                break
+            # The biggest first, since sharing it shares everything inside it
+            _, key, subtree = max(repeated, key=lambda entry: entry[0])
+            ident = f"#cse{self.num_cse}"
+            self.num_cse += 1
+            bindings.append((ident, subtree))
+            replacement = node.IdentNode(ident)
+            self.types[replacement] = self.types.get(subtree)
+            treeNode = self.replace(treeNode, key, replacement)
+
+        for ident, subtree in reversed(bindings):
+            treeNode = node.AssignNode(ident, subtree, treeNode)
+        return treeNode
+
+    def containsAssign(self, treeNode) -> bool:
+        if type(treeNode) is node.AssignNode:
+            return True
+        if not isinstance(treeNode, node.Node):
+            return False
+        return any(self.containsAssign(child) for child in _children(treeNode))
+
+    # Whether `treeNode` can be computed early, and as often or as rarely as
+    # we like: it has to be deterministic, free of effects, and unable to
+    # fail. Every part's type has to be known for that, and division (which
+    # can divide by zero) and `head` (which can be given an empty list) are
+    # left alone.
+    def shareable(self, treeNode) -> bool:
+        if type(treeNode) in (node.IdentNode, node.ListNode) or not isinstance(treeNode, node.Node):
+            return False
+        return self.safe(treeNode)
+
+    # With `random`, random values count as safe too: they can't be shared,
+    # but evaluating them can't fail either
+    def safe(self, treeNode, random: bool = False) -> bool:
+        if isinstance(treeNode, DiceType):
+            return True
+        if random and isinstance(treeNode, self.RANDOM_NODES):
+            return True
+        if not isKnown(self.types.get(treeNode)):
+            return False
+        if type(treeNode) is node.IdentNode:
+            return True
+        if not isinstance(treeNode, (node.BinaryNode, node.UnaryNode, node.TupleNode,
+                                     node.FstNode, node.SndNode)) \
+                or type(treeNode) in (node.DivNode, node.ConcatNode):
+            return False
+        return all(self.safe(child, random) for child in _children(treeNode)
+                   if isinstance(child, (node.Node, DiceType)))
+
+    # Counts the shareable subtrees of `treeNode` by structure, recording
+    # (count, size, one of them) for each
+    def countSubtrees(self, treeNode, counts: dict):
+        if not isinstance(treeNode, node.Node):
+            return
+        if self.shareable(treeNode):
+            key = _structuralKey(treeNode)
+            count, size, subtree = counts.get(key, (0, _size(treeNode), treeNode))
+            counts[key] = (count + 1, size, subtree)
+        for child in _children(treeNode):
+            self.countSubtrees(child, counts)
+
+    def replace(self, treeNode, key, replacement):
+        if not isinstance(treeNode, node.Node):
+            return treeNode
+        if _structuralKey(treeNode) == key:
+            return replacement
+        new = object.__new__(type(treeNode))
+        for name, val in vars(treeNode).items():
+            if type(val) is list:
+                val = [self.replace(item, key, replacement) for item in val]
+            elif isinstance(val, node.Node):
+                val = self.replace(val, key, replacement)
+            setattr(new, name, val)
+        self.types[new] = self.types.get(treeNode)
+        return new
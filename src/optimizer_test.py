@@ -0,0 +1,132 @@
+import pytest
+import lark
+
+import node
+from main import grammar, TreeTransformer
+from compiler import PyEdaCompiler
+from optimizer import Optimizer
+from inference import Inferencer
+from dicetypes import BoolType, TupleType
+
+
+@pytest.fixture
+def test_parser() -> lark.Lark:
+    return lark.Lark(grammar, parser="lalr")
+
+
+def transform(test_parser: lark.Lark, text: str):
+    return TreeTransformer().transform(test_parser.parse(text))
+
+
+def count_nodes(tree, node_type) -> int:
+    if type(tree) is list:
+        return sum(count_nodes(item, node_type) for item in tree)
+    if not isinstance(tree, node.Node):
+        return 0
+    return (type(tree) is node_type) + sum(
+        count_nodes(child, node_type) for child in vars(tree).values()
+    )
+
+
+def test_folds_constants(test_parser: lark.Lark) -> None:
+    ir = transform(test_parser, """
+    let a = int(4, 3) in
+    let b = a + int(4, 2) * int(4, 1) in
+    let c = if b < int(4, 6) then !!(true && b == int(4, 5)) else false in
+    (b, c)
+    """)
+    opt = Optimizer(ir).optimize()
+    assert type(opt.expr) is TupleType
+    assert (opt.expr.left.width, opt.expr.left.val) == (4, 5)
+    assert opt.expr.right.val is True
+
+
+def test_drops_dead_lets(test_parser: lark.Lark) -> None:
+    ir = transform(test_parser, """
+    let unused = flip 0.3 in
+    let x = flip 0.5 in
+    let tmp = observe x || flip 0.1 in
+    let y = x in
+    y
+    """)
+    opt = Optimizer(ir).optimize()
+    # The observation stays even though `tmp` is never read
+    assert count_nodes(opt, node.AssignNode) == 2
+    assert count_nodes(opt, node.ObserveNode) == 1
+    assert repr(opt.expr.rest.rest) == 'IdentNode("x")'
+
+
+def test_keeps_type_errors(test_parser: lark.Lark) -> None:
+    ir = transform(test_parser, "let unused = int(4, 1) + int(3, 1) in true")
+    with pytest.raises(TypeError):
+        Optimizer(ir).optimize()
+
+
+@pytest.mark.parametrize("text, error", [
+    ("let z = int(2, 1) / int(2, 0) in true", ZeroDivisionError),
+    ("let l = [flip 0.5] in let h = head (tail l) in true", IndexError),
+])
+def test_keeps_failing_lets(test_parser: lark.Lark, text: str, error) -> None:
+    opt = Optimizer(transform(test_parser, text)).optimize()
+    with pytest.raises(error):
+        Inferencer(opt, num_iterations=100, seed=0).infer()
+    with pytest.raises(error):
+        PyEdaCompiler(opt).infer()
+
+
+def test_shares_desugared_operands(test_parser: lark.Lark) -> None:
+    ir = transform(test_parser, """
+    let x = discrete(0.1, 0.2, 0.3, 0.4) in
+    let y = discrete(0.4, 0.3, 0.2, 0.1) in
+    x + y <= x * y
+    """)
+    opt = Optimizer(ir).optimize()
+    assert count_nodes(opt, node.AddNode) == 1
+    assert count_nodes(opt, node.MulNode) == 1
+
+
+@pytest.mark.parametrize("text", [
+    "let x = flip 0.5 in let y = flip 0.3 in (x ^ y) <=> (x -> !y)",
+    """
+    fun f(a: int(3), b: bool) { if b && true then a + int(3, 0) else a * int(3, 2) }
+    let x = uniform(3, 0, 8) in
+    let b = flip 0.4 in
+    let unused = flip 0.9 in
+    let tmp = observe !(x == int(3, 7)) in
+    let r = f(x, b) in
+    (r >= int(3, 4), r != x)
+    """,
+])
+def test_same_distribution(test_parser: lark.Lark, text: str) -> None:
+    ir = transform(test_parser, text)
+    expected = PyEdaCompiler(ir).infer()
+    res = PyEdaCompiler(Optimizer(ir).optimize()).infer()
+    assert res.keys() == expected.keys()
+    for outcome, prob in expected.items():
+        assert res[outcome] == pytest.approx(prob)
+
+
+# An alias of a variable that is later shadowed has to keep the old value
+@pytest.mark.parametrize("text, expected", [
+    ("let x = flip 0.3 in let y = x in let x = flip 0.9 in y", 0.3),
+    ("let y = flip 0.1 in let x = flip 0.9 in let y = x in let x = false in y", 0.9),
+    ("fun f(a: bool) { let y = a in let a = false in y } let z = flip 0.7 in f(z)", 0.7),
+])
+def test_shadowed_alias(test_parser: lark.Lark, text: str, expected: float) -> None:
+    opt = Optimizer(transform(test_parser, text)).optimize()
+    assert PyEdaCompiler(opt).infer()[BoolType(True)] == pytest.approx(expected)
+    sampled = Inferencer(opt, num_iterations=5000, seed=0).infer()
+    assert sampled[BoolType(True)] == pytest.approx(expected, abs=0.03)
+
+
+# Folded tuples reach the BDD compiler as constants
+def test_compiles_constant_tuples(test_parser: lark.Lark) -> None:
+    opt = Optimizer(transform(test_parser, "let x = flip 0.5 in (x, (true, int(2, 1)))")).optimize()
+    assert type(opt.expr.rest.right) is TupleType
+    res = {repr(outcome): prob for outcome, prob in PyEdaCompiler(opt).infer().items()}
+    assert res == {
+        "TupleType(BoolType(True), TupleType(BoolType(True), IntType(2, 1)))": 0.5,
+        "TupleType(BoolType(False), TupleType(BoolType(True), IntType(2, 1)))": 0.5,
+    }
+    res = PyEdaCompiler(Optimizer(transform(test_parser, "(true, false)")).optimize()).infer()
+    assert list(map(repr, res)) == ["TupleType(BoolType(True), BoolType(False))"]
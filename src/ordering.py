@@ -0,0 +1,141 @@
+# Variable-ordering heuristics for BDD compilation.
+#
+# A heuristic looks at the let-dependency graph of the main program and
+# returns a rank for every binding. The compiler gives each flip the rank of
+# the `let` whose value it is created in, so flips are ordered by the rank of
+# their binding first and by creation order second. The result expression
+# (everything after the last `let`) is the binding `None`.
+import node
+
+
+# Returns two things about the bindings of the main program:
+#  - a map from every binding to the bindings its value reads, in program
+#    order
+#  - groups of bindings used together: the identifiers that are operands of
+#    one operator, where a chain like `a || (b || c)` counts as one operator
+def let_dependencies(tree) -> tuple[dict, list[list]]:
+    deps = {}
+    groups = []
+
+    # The identifiers directly under a chain of `op` nodes
+    def operands(treeNode, op, scope):
+        if type(treeNode) is op:
+            return operands(treeNode.left, op, scope) + operands(treeNode.right, op, scope)
+        if type(treeNode) is node.IdentNode and treeNode.ident in scope:
+            return [scope[treeNode.ident]]
+        return []
+
+    def visit(treeNode, scope, reads):
+        if type(treeNode) is node.IdentNode:
+            if treeNode.ident in scope:
+                reads.append(scope[treeNode.ident])
+        elif type(treeNode) is node.AssignNode:
+            scope = dict(scope)
+            while type(treeNode) is node.AssignNode:
+                val_reads = []
+                visit(treeNode.val, scope, val_reads)
+                deps[treeNode] = list(dict.fromkeys(val_reads))
+                # The enclosing binding reads everything this one read
+                reads.extend(val_reads)
+                scope[treeNode.ident] = treeNode
+                treeNode = treeNode.rest
+            visit(treeNode, scope, reads)
+        elif type(treeNode) is node.FunctionCallNode:
+            for arg in treeNode.arg_list_node.args:
+                visit(arg, scope, reads)
+        elif isinstance(treeNode, node.UnaryNode):
+            visit(treeNode.operand, scope, reads)
+        elif isinstance(treeNode, (node.BinaryNode, node.TupleNode)):
+            group = operands(treeNode, type(treeNode), scope)
+            if len(group) > 1:
+                groups.append(group)
+            visit(treeNode.left, scope, reads)
+            visit(treeNode.right, scope, reads)
+        elif type(treeNode) is node.IfNode:
+            visit(treeNode.cond, scope, reads)
+            visit(treeNode.true_expr, scope, reads)
+            visit(treeNode.false_expr, scope, reads)
+        elif type(treeNode) is node.ObserveNode:
+            visit(treeNode.observation, scope, reads)
+        elif isinstance(treeNode, (node.FstNode, node.SndNode)):
+            visit(treeNode.tup, scope, reads)
+        elif type(treeNode) is node.ListNode:
+            for item in treeNode.lst:
+                visit(item, scope, reads)
+        elif isinstance(treeNode, (node.HeadNode, node.TailNode, node.LengthNode)):
+            visit(treeNode.lst, scope, reads)
+
+    expr = tree.expr if type(tree) is node.ProgramNode else tree
+    result_reads = []
+    visit(expr, {}, result_reads)
+    deps[None] = list(dict.fromkeys(result_reads))
+    return deps, groups
+
+
+# Keeps the order flips are created in, which follows the program text
+def ast_order(tree) -> dict:
+    return {}
+
+
+# Depth-first from the result, placing each binding right after the
+# bindings it reads. Bindings nothing reads (like `let _ = observe ...`) are
+# visited as extra roots, in program order.
+def dfs_order(tree) -> dict:
+    deps, _ = let_dependencies(tree)
+    read = {dep for reads in deps.values() for dep in reads}
+    roots = [None] + [binding for binding in deps if binding is not None and binding not in read]
+    rank = {}
+
+    for root in roots:
+        stack = [(root, iter(deps[root]))]
+        while stack:
+            binding, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                rank.setdefault(binding, len(rank))
+            elif child not in rank and all(child is not b for b, _ in stack):
+                stack.append((child, iter(deps[child])))
+    return rank
+
+
+# Greedy min-fill elimination over the interaction graph: a binding is
+# connected to what it reads, and the bindings in a group are connected to
+# each other. Bindings are ranked in elimination order.
+def min_fill_order(tree) -> dict:
+    deps, groups = let_dependencies(tree)
+    position = {binding: i for i, binding in enumerate(deps)}
+    neighbors = {binding: set() for binding in deps}
+    for binding, reads in deps.items():
+        for read in reads:
+            neighbors[binding].add(read)
+            neighbors[read].add(binding)
+    for group in groups:
+        for a in group:
+            neighbors[a].update(b for b in group if b is not a)
+
+    def fill(binding):
+        adjacent = list(neighbors[binding])
+        return sum(
+            1
+            for i, a in enumerate(adjacent)
+            for b in adjacent[i + 1:]
+            if b not in neighbors[a]
+        )
+
+    rank = {}
+    while neighbors:
+        binding = min(neighbors, key=lambda b: (fill(b), len(neighbors[b]), position[b]))
+        adjacent = neighbors.pop(binding)
+        for a in adjacent:
+            neighbors[a].discard(binding)
+            neighbors[a].update(adjacent - {a})
+        rank[binding] = len(rank)
+    return rank
+
+
+ORDERINGS = {
+    "ast": ast_order,
+    "dfs": dfs_order,
+    "minfill": min_fill_order,
+}
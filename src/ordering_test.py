@@ -0,0 +1,40 @@
+import lark
+import pytest
+
+from main import grammar, TreeTransformer
+from compiler import PyEdaCompiler
+from dicetypes import BoolType
+
+
+@pytest.fixture
+def test_parser() -> lark.Lark:
+    return lark.Lark(grammar, parser="lalr")
+
+
+# (a0 && b0) || (a1 && b1) || ... is exponential when every a comes before
+# every b, and linear when the pairs are interleaved
+PAIRS = 8
+PAIRS_TEXT = (
+    "".join(f"let a{i} = flip 0.5 in " for i in range(PAIRS))
+    + "".join(f"let b{i} = flip 0.5 in " for i in range(PAIRS))
+    + " || ".join(f"(a{i} && b{i})" for i in range(PAIRS))
+)
+
+
+@pytest.mark.parametrize("ordering", ["dfs", "minfill"])
+def test_ordering_shrinks_bdd(test_parser: lark.Lark, ordering: str) -> None:
+    ir = TreeTransformer().transform(test_parser.parse(PAIRS_TEXT))
+    baseline = PyEdaCompiler(ir)
+    expected = baseline.infer()
+    ordered = PyEdaCompiler(ir, ordering=ordering)
+    assert ordered.infer()[BoolType(True)] == pytest.approx(expected[BoolType(True)], rel=1e-9)
+    assert ordered.stats["bdd_size"] == 2 * PAIRS
+    assert baseline.stats["bdd_size"] > 2 * ordered.stats["bdd_size"]
+
+
+def test_sift(test_parser: lark.Lark) -> None:
+    ir = TreeTransformer().transform(test_parser.parse(PAIRS_TEXT))
+    expected = PyEdaCompiler(ir).infer()
+    sifted = PyEdaCompiler(ir, sift=True)
+    assert sifted.infer()[BoolType(True)] == pytest.approx(expected[BoolType(True)], rel=1e-9)
+    assert sifted.stats["bdd_size"] == 2 * PAIRS
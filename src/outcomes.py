@@ -0,0 +1,97 @@
+# Compact keys for tallying sampled outcomes.
+#
+# Samplers add up the weight of every outcome they see, once per sample.
+# Hashing DiceTypes for that means calling back into Python for every node of
+# the value, so outcomes are turned into plain keys first, totalled in a dict
+# of those keys, and only turned back into DiceTypes once at the end.
+#
+# When the checker knows the result's type all the way down and it has no
+# lists, every outcome packs into a single int: bools take one bit, ints
+# their width, and a tuple's left side goes above its right. Otherwise the
+# key is a nested Python tuple, which still hashes without calling back into
+# Python.
+from collections import Counter
+
+from dicetypes import DiceType, BoolType, IntType, TupleType, ListType
+
+
+# The number of bits a value of `dice_type` packs into, or None if it can't
+# be packed
+def packedWidth(dice_type: DiceType | None) -> int | None:
+    if type(dice_type) is BoolType:
+        return 1
+    elif type(dice_type) is IntType:
+        return dice_type.width
+    elif type(dice_type) is TupleType:
+        left = packedWidth(dice_type.left)
+        right = packedWidth(dice_type.right)
+        if left is None or right is None:
+            return None
+        return left + right
+    return None
+
+
+# A key for any value, equal for equal values. Tags keep different kinds of
+# value apart, e.g. a tuple of two bools from an int.
+def canonicalKey(val: DiceType):
+    if type(val) is BoolType:
+        return val.val
+    elif type(val) is IntType:
+        return (val.width, val.val)
+    elif type(val) is TupleType:
+        return ("t", canonicalKey(val.left), canonicalKey(val.right))
+    elif type(val) is ListType:
+        return ("l",) + tuple(canonicalKey(item) for item in val.lst)
+    raise TypeError(f"Can't tally a result of type {type(val)}")
+
+
+def _fromCanonicalKey(key) -> DiceType:
+    if type(key) is bool:
+        return BoolType(key)
+    elif key[0] == "t":
+        return TupleType(_fromCanonicalKey(key[1]), _fromCanonicalKey(key[2]))
+    elif key[0] == "l":
+        return ListType([_fromCanonicalKey(item) for item in key[1:]], DiceType)
+    return IntType(key[0], key[1])
+
+
+# Builds a function packing values of `dice_type` into ints, and one
+# unpacking them again
+def _packers(dice_type: DiceType):
+    if type(dice_type) is BoolType:
+        return (lambda val: val.val), BoolType
+    elif type(dice_type) is IntType:
+        width = dice_type.width
+        return (lambda val: val.val), (lambda key: IntType(width, key))
+
+    pack_left, unpack_left = _packers(dice_type.left)
+    pack_right, unpack_right = _packers(dice_type.right)
+    shift = packedWidth(dice_type.right)
+    mask = (1 << shift) - 1
+
+    def pack(val):
+        return (pack_left(val.left) << shift) | pack_right(val.right)
+
+    def unpack(key):
+        return TupleType(unpack_left(key >> shift), unpack_right(key & mask))
+
+    return pack, unpack
+
+
+class OutcomeCodec:
+    def __init__(self, result_type: DiceType | None):
+        self.result_type = result_type
+        self.packed = packedWidth(result_type) is not None
+        if self.packed:
+            self.pack, self.unpack = _packers(result_type)
+        else:
+            self.pack, self.unpack = canonicalKey, _fromCanonicalKey
+
+    # Turns the total weight of each key back into the total weight of each
+    # outcome
+    def decode(self, table: dict) -> Counter:
+        unpack = self.unpack
+        res = Counter()
+        for key, weight in table.items():
+            res[unpack(key)] += weight
+        return res
@@ -0,0 +1,82 @@
+import pytest
+import lark
+
+from main import grammar, TreeTransformer
+from inference import Inferencer
+from outcomes import OutcomeCodec, packedWidth
+from dicetypes import DiceType, BoolType, IntType, TupleType, ListType
+
+
+@pytest.fixture
+def test_parser() -> lark.Lark:
+    return lark.Lark(grammar, parser="lalr")
+
+
+def test_packed_width() -> None:
+    assert packedWidth(TupleType(BoolType(True), TupleType(IntType(3, 0), BoolType(True)))) == 5
+    assert packedWidth(TupleType(BoolType(True), None)) is None
+    assert packedWidth(ListType([], BoolType(True))) is None
+
+
+@pytest.mark.parametrize("result_type, val", [
+    (BoolType(True), BoolType(False)),
+    (IntType(12, 0), IntType(12, 3000)),
+    (TupleType(IntType(2, 0), TupleType(BoolType(True), IntType(3, 0))),
+     TupleType(IntType(2, 3), TupleType(BoolType(False), IntType(3, 5)))),
+    (None, TupleType(IntType(2, 1), BoolType(True))),
+    (ListType([], IntType(2, 0)), ListType([IntType(2, 1), IntType(2, 2)], DiceType)),
+])
+def test_round_trip(result_type, val) -> None:
+    codec = OutcomeCodec(result_type)
+    assert repr(codec.unpack(codec.pack(val))) == repr(val)
+
+
+def test_keys_tell_outcomes_apart() -> None:
+    codec = OutcomeCodec(None)
+    vals = [
+        TupleType(BoolType(True), BoolType(False)),
+        TupleType(BoolType(False), BoolType(True)),
+        IntType(1, 1),
+        IntType(2, 1),
+        ListType([BoolType(True)], DiceType),
+        ListType([BoolType(True), BoolType(False)], DiceType),
+        ListType([], DiceType),
+    ]
+    assert len({codec.pack(val) for val in vals}) == len(vals)
+
+
+@pytest.mark.parametrize("compiled", [True, False])
+def test_tallies_lists_and_tuples(test_parser: lark.Lark, compiled: bool) -> None:
+    text = """
+    let x = flip 0.5 in
+    let y = flip 0.5 in
+    if x then (x, [y]) else (x, [y, x])
+    """
+    ir = TreeTransformer().transform(test_parser.parse(text))
+    inferencer = Inferencer(ir, num_iterations=4000, seed=3, compiled=compiled)
+    assert not inferencer.codec.packed
+    res = {repr(outcome): prob for outcome, prob in inferencer.infer().items()}
+    assert len(res) == 4
+    for outcome in ["TupleType(BoolType(True), ListType(BoolType(False)))",
+                    "TupleType(BoolType(False), ListType(BoolType(True), BoolType(False)))"]:
+        assert res[outcome] == pytest.approx(0.25, abs=0.03)
+
+
+@pytest.mark.parametrize("compiled", [True, False])
+def test_outcomes_of_different_types(test_parser: lark.Lark, compiled: bool) -> None:
+    text = """
+    let x = discrete(0.25, 0.25, 0.5) in
+    if x == int(2, 0) then int(4, 1) else if x == int(2, 1) then int(3, 1) else true
+    """
+    ir = TreeTransformer().transform(test_parser.parse(text))
+    res = Inferencer(ir, num_iterations=4000, seed=0, compiled=compiled).infer()
+    res = {repr(outcome): prob for outcome, prob in res.items()}
+    assert res.keys() == {"IntType(4, 1)", "IntType(3, 1)", "BoolType(True)"}
+    assert sum(res.values()) == pytest.approx(1.0)
+    assert res["BoolType(True)"] == pytest.approx(0.5, abs=0.03)
+
+
+def test_equality_needs_the_same_type() -> None:
+    assert not IntType(4, 1) == BoolType(True)
+    assert not IntType(4, 1) == IntType(3, 1)
+    assert IntType(4, 1) == IntType(4, 1)
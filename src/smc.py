@@ -0,0 +1,197 @@
+from collections import Counter
+import random
+
+import node
+from checker import TypeChecker
+from dicetypes import DiceType, BoolType
+from inference import TreeInferencer, normalize
+from closure_compiler import _directObservation
+
+
+# One run of the program, partway through its `let` spine
+class Particle:
+    __slots__ = ("variables", "weight")
+
+    def __init__(self, variables: dict, weight: float):
+        self.variables = variables
+        self.weight = weight
+
+
+# Whether `treeNode` reads the variable `ident` anywhere
+def _reads(treeNode, ident: str) -> bool:
+    if type(treeNode) is node.IdentNode:
+        return treeNode.ident == ident
+    if not isinstance(treeNode, node.Node):
+        return False
+    for child in vars(treeNode).values():
+        children = child if type(child) is list else [child]
+        if any(_reads(c, ident) for c in children):
+            return True
+    return False
+
+
+# Sequential Monte Carlo (a particle filter). Rather than running the whole
+# program once per sample and rejecting it at the end, a population of
+# particles steps through the program's `let` spine together. Each
+# observation multiplies a particle's weight by its likelihood, and when the
+# weights get too uneven the population is resampled, so that particles that
+# failed an observation are replaced by copies of ones that passed instead
+# of being thrown away.
+#
+# The spine is the chain of `let`s from the top of the program (and into both
+# branches of any `if` on it); everything else is sampled with a
+# TreeInferencer, one particle at a time. An `if` splits the particles that
+# reach it by their condition, and each group continues (and is resampled) on
+# its own.
+class SMCInferencer:
+    def __init__(self, tree, variables=None, num_particles=1000, seed=None,
+                 ess_threshold=0.5):
+        if num_particles < 1:
+            raise ValueError("Need at least one particle")
+        if not 0 <= ess_threshold <= 1:
+            raise ValueError("The ESS threshold is a fraction of the particles")
+        self.tree = tree
+        self.variables = variables if variables is not None else {}
+        TypeChecker(tree, self.variables).check()
+        self.num_particles = num_particles
+        # Resample a group once its effective sample size falls below this
+        # fraction of its size
+        self.ess_threshold = ess_threshold
+        self.rng = random.Random(seed)
+
+        # Evaluates everything off the spine, sharing our random stream
+        self.evaluator = TreeInferencer(None, {})
+        self.evaluator.rng = self.rng
+
+        # Flips that are left unsampled until they are observed, by the
+        # `let` that observes them
+        self.deferred = {}
+        self.observations = {}
+
+        self.num_resamples = 0
+
+    def infer(self) -> dict[DiceType, float]:
+        results, total_weight = self.sample()
+        return normalize(results, total_weight)
+
+    # Returns the total weight of each outcome and the total weight of all
+    # particles, the same as Inferencer.sample without the squared weights
+    def sample(self) -> tuple[Counter, float]:
+        tree = self.tree
+        if type(tree) is node.ProgramNode:
+            for function in tree.functions:
+                self.evaluator.registerFunction(function)
+            tree = tree.expr
+
+        self.num_resamples = 0
+        particles = [Particle(dict(self.variables), 1.0) for _ in range(self.num_particles)]
+        results = Counter()
+        total_weight = 0.0
+        for res, weight in self.advance(tree, particles):
+            results[res] += weight
+            total_weight += weight
+        return results, total_weight
+
+    # Runs `particles` through `treeNode` and yields each one's result with
+    # its final weight
+    def advance(self, treeNode, particles: list[Particle]):
+        while particles:
+            if isinstance(treeNode, node.AssignNode):
+                flip = self.deferred.get(treeNode)
+                observer = None
+                if type(treeNode.val) is node.FlipNode:
+                    observer = self.findObservation(treeNode)
+                if flip is not None:
+                    # The observation of a flip we skipped: give the flip its
+                    # observed value, and weight by how likely that was
+                    ident, observed = _directObservation(treeNode.val)
+                    likelihood = flip.prob if observed else 1.0 - flip.prob
+                    for particle in particles:
+                        particle.variables[ident] = BoolType(observed)
+                        particle.variables[treeNode.ident] = BoolType(True)
+                        particle.weight *= likelihood
+                elif observer is not None:
+                    # Sampling the flip would only reject the particles where
+                    # it comes out wrong, so leave it until it is observed
+                    self.deferred[observer] = treeNode.val
+                else:
+                    for particle in particles:
+                        particle.variables[treeNode.ident] = self.evaluate(treeNode.val, particle)
+                treeNode = treeNode.rest
+                particles = self.resample(particles)
+
+            elif isinstance(treeNode, node.IfNode):
+                true_particles, false_particles = [], []
+                for particle in particles:
+                    cond = self.evaluate(treeNode.cond, particle)
+                    if particle.weight == 0:
+                        continue
+                    if type(cond) is not BoolType:
+                        raise TypeError("Condition must be BoolType")
+                    (true_particles if cond.val else false_particles).append(particle)
+                yield from self.advance(treeNode.true_expr, true_particles)
+                treeNode, particles = treeNode.false_expr, false_particles
+
+            else:
+                for particle in particles:
+                    res = self.evaluate(treeNode, particle)
+                    if particle.weight > 0:
+                        yield res, particle.weight
+                return
+
+    # If the first `let` on the spine after `assign` that reads its variable
+    # observes it directly, returns that `let`
+    def findObservation(self, assign: node.AssignNode) -> node.AssignNode | None:
+        if assign not in self.observations:
+            ident = assign.ident
+            found = None
+            treeNode = assign.rest
+            while isinstance(treeNode, node.AssignNode):
+                observation = _directObservation(treeNode.val)
+                if observation is not None and observation[0] == ident:
+                    found = treeNode
+                    break
+                if treeNode.ident == ident or _reads(treeNode.val, ident):
+                    break
+                treeNode = treeNode.rest
+            self.observations[assign] = found
+        return self.observations[assign]
+
+    # Samples `treeNode` for one particle, zeroing its weight if an
+    # observation fails along the way
+    def evaluate(self, treeNode, particle: Particle) -> DiceType | None:
+        evaluator = self.evaluator
+        evaluator.variables = particle.variables
+        evaluator.observe_ok = True
+        res = evaluator.recurseTree(treeNode)
+        if not evaluator.observe_ok:
+            particle.weight = 0.0
+        return res
+
+    # Drops the particles that failed an observation, and resamples the rest
+    # if their effective sample size has fallen below the threshold.
+    # Systematic resampling keeps the group's total weight, so groups split
+    # by an `if` stay comparable to each other.
+    def resample(self, particles: list[Particle]) -> list[Particle]:
+        n = len(particles)
+        particles = [particle for particle in particles if particle.weight > 0]
+        if not particles:
+            return particles
+        total_weight = sum(particle.weight for particle in particles)
+        total_weight_sq = sum(particle.weight * particle.weight for particle in particles)
+        if total_weight * total_weight >= self.ess_threshold * n * total_weight_sq:
+            return particles
+
+        self.num_resamples += 1
+        step = total_weight / n
+        position = self.rng.random() * step
+        cumulative = 0.0
+        resampled = []
+        for particle in particles:
+            cumulative += particle.weight
+            while position < cumulative and len(resampled) < n:
+                # Copies share values but not bindings, since later `let`s
+                # write into the dict
+                resampled.append(Particle(dict(particle.variables), step))
+                position += step
+        return resampled
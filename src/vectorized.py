@@ -0,0 +1,361 @@
+# Contains code to do vectorized MonteCarlo Inferencing on our parsed tree.
+#
+# Instead of walking the tree once per sample (like TreeInferencer), every
+# node is evaluated once for a whole batch of samples. Values are stored as
+# NumPy arrays with one entry per sample ("lane"):
+#   - booleans are bool arrays
+#   - ints are uint64 arrays, masked back down to their width after each op
+#   - tuples are pairs of the above
+# `if` only evaluates each branch on the lanes that take it, and `observe`
+# clears lanes out of an accept mask instead of aborting the sample.
+from collections import Counter
+
+import numpy as np
+
+import custom_distribution
+import node
+from dicetypes import DiceType, BoolType, IntType, TupleType
+from inference import normalize
+
+
+MAX_INT_WIDTH = 64
+
+
+class BoolVec:
+    def __init__(self, val: np.ndarray):
+        self.val = val
+
+    def __repr__(self):
+        return f"BoolVec({self.val})"
+
+
+class IntVec:
+    def __init__(self, width: int, val: np.ndarray):
+        if width > MAX_INT_WIDTH:
+            raise NotImplementedError("The vectorized sampler only supports"
+                + f" ints up to {MAX_INT_WIDTH} bits (found {width})")
+        self.width = width
+        self.val = val & _mask(width)
+
+    def __repr__(self):
+        return f"IntVec({self.width}, {self.val})"
+
+
+class TupleVec:
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+
+    def __repr__(self):
+        return f"TupleVec({self.left}, {self.right})"
+
+
+def _mask(width: int) -> np.uint64:
+    return np.uint64((1 << width) - 1)
+
+
+def _broadcast(value: DiceType, n: int):
+    if type(value) is BoolType:
+        return BoolVec(np.full(n, bool(value.val)))
+    if type(value) is IntType:
+        return IntVec(value.width, np.full(n, value.val, dtype=np.uint64))
+    if type(value) is TupleType:
+        return TupleVec(_broadcast(value.left, n), _broadcast(value.right, n))
+    raise NotImplementedError(f"The vectorized sampler does not support {value}")
+
+
+def _take(vec, idx: np.ndarray):
+    if type(vec) is BoolVec:
+        return BoolVec(vec.val[idx])
+    if type(vec) is IntVec:
+        return IntVec(vec.width, vec.val[idx])
+    return TupleVec(_take(vec.left, idx), _take(vec.right, idx))
+
+
+# Combines the results of the two branches of an `if` back into one vector
+def _merge(cond: np.ndarray, true_vec, false_vec):
+    if type(true_vec) is not type(false_vec) or (
+        type(true_vec) is IntVec and true_vec.width != false_vec.width
+    ):
+        raise NotImplementedError("The vectorized sampler does not support"
+            + " if-branches of different types")
+    if type(true_vec) is TupleVec:
+        return TupleVec(
+            _merge(cond, true_vec.left, false_vec.left),
+            _merge(cond, true_vec.right, false_vec.right),
+        )
+    out = np.empty(len(cond), dtype=true_vec.val.dtype)
+    out[cond] = true_vec.val
+    out[~cond] = false_vec.val
+    if type(true_vec) is BoolVec:
+        return BoolVec(out)
+    return IntVec(true_vec.width, out)
+
+
+# Mirrors DiceType.__eq__: values are compared regardless of int width
+def _equal(left, right) -> np.ndarray:
+    if type(left) is TupleVec and type(right) is TupleVec:
+        return _equal(left.left, right.left) & _equal(left.right, right.right)
+    # Values of different types or widths are never equal, like DiceType.__eq__
+    if type(left) is not type(right) or type(left) is IntVec and left.width != right.width:
+        n = len(_leaves(left)[0])
+        return np.zeros(n, dtype=bool)
+    return left.val.astype(np.uint64) == right.val.astype(np.uint64)
+
+
+def _leaves(vec) -> list[np.ndarray]:
+    if type(vec) is TupleVec:
+        return _leaves(vec.left) + _leaves(vec.right)
+    return [vec.val.astype(np.uint64)]
+
+
+# Rebuilds a DiceType with the same shape as `vec` from an iterator of values
+def _to_dice_type(vec, values) -> DiceType:
+    if type(vec) is TupleVec:
+        left = _to_dice_type(vec.left, values)
+        right = _to_dice_type(vec.right, values)
+        return TupleType(left, right)
+    if type(vec) is BoolVec:
+        return BoolType(bool(next(values)))
+    return IntType(vec.width, int(next(values)))
+
+
+def _verify_bools(left, right):
+    if type(left) is not BoolVec or type(right) is not BoolVec:
+        raise TypeError("Boolean operation must act on two booleans")
+
+
+def _verify_ints(left, right):
+    if type(left) is not IntVec or type(right) is not IntVec:
+        raise TypeError("Integer operation must act on two integers")
+    if left.width != right.width:
+        raise TypeError(
+            f"Integer operands must be equal widths ({left.width} != {right.width})"
+        )
+
+
+class VectorizedInferencer:
+    def __init__(self, tree, variables=None, num_iterations=1000, seed=None,
+                 batch_size=100000):
+        self.tree = tree
+        self.variables = variables if variables is not None else {}
+        self.num_its = num_iterations
+        self.batch_size = batch_size
+        self.rng = np.random.default_rng(seed)
+        self.functions = {}
+
+        # Accept mask for the batch currently being evaluated
+        self.observe_ok = None
+
+    def infer(self) -> dict[DiceType, float]:
+        results = Counter()
+        num_successful_its = 0
+        remaining = self.num_its
+        while remaining > 0:
+            n = min(self.batch_size, remaining)
+            remaining -= n
+
+            res = self.inferBatch(n)
+            if res is None:
+                continue
+            for outcome, count in res.items():
+                results[outcome] += count
+                num_successful_its += count
+
+        return normalize(results, num_successful_its)
+
+    # Runs `n` samples at once, returning how often each outcome was accepted
+    def inferBatch(self, n: int) -> Counter | None:
+        self.observe_ok = np.ones(n, dtype=bool)
+        env = {ident: _broadcast(val, n) for ident, val in self.variables.items()}
+        res = self.recurseTree(self.tree, env, np.arange(n))
+
+        columns = [leaf[self.observe_ok] for leaf in _leaves(res)]
+        if len(columns[0]) == 0:
+            return None
+        rows, counts = np.unique(np.stack(columns, axis=1), axis=0, return_counts=True)
+
+        return Counter({
+            _to_dice_type(res, iter(row)): int(count)
+            for row, count in zip(rows, counts)
+        })
+
+    def registerFunction(self, function: node.FunctionNode):
+        self.functions[function.ident] = [
+            function.arg_list_node.args,
+            function.expr,
+        ]
+
+    def processFunction(self, function: node.FunctionCallNode, env, lanes):
+        ident, arg_expr_list = function.ident, function.arg_list_node.args
+
+        if ident not in self.functions:
+            raise Exception("Function identifier not defined:", ident)
+
+        param_list, function_expr = self.functions[ident]
+        if len(param_list) != len(arg_expr_list):
+            raise AttributeError(
+                f"Argument Length does not match: Param len {len( param_list )} != Arg len {len(arg_expr_list)}"
+            )
+
+        var_map = {}
+        for param, expr in zip(param_list, arg_expr_list):
+            var_map[param.ident] = self.recurseTree(expr, env, lanes)
+
+        return self.recurseTree(function_expr, var_map, lanes)
+
+    # `env` maps identifiers to vectors, and `lanes` holds the index of each
+    # vector entry within the whole batch (needed to update `observe_ok`)
+    def recurseTree(self, treeNode, env: dict, lanes: np.ndarray):
+        n = len(lanes)
+
+        if isinstance(treeNode, DiceType):
+            return _broadcast(treeNode, n)
+
+        elif type(treeNode) is node.ProgramNode:
+            for function in treeNode.functions:
+                self.registerFunction(function)
+            return self.recurseTree(treeNode.expr, env, lanes)
+
+        elif type(treeNode) is node.FunctionCallNode:
+            return self.processFunction(treeNode, env, lanes)
+
+        elif type(treeNode) is node.FlipNode:
+            return BoolVec(self.rng.random(n) < treeNode.prob)
+
+        elif isinstance(treeNode, custom_distribution.CustomDistribution):
+            width, samples = treeNode.sample_n(self.rng, n)
+            return IntVec(width, samples)
+
+        elif type(treeNode) is node.IdentNode:
+            if treeNode.ident not in env:
+                raise Exception("Identifier not defined:", treeNode.ident)
+            return env[treeNode.ident]
+
+        elif type(treeNode) is node.NotNode:
+            operand = self.recurseTree(treeNode.operand, env, lanes)
+            if type(operand) is not BoolVec:
+                raise TypeError("Can't negate a non-bool type")
+            return BoolVec(~operand.val)
+
+        elif type(treeNode) in (node.LeftShiftNode, node.RightShiftNode):
+            operand = self.recurseTree(treeNode.operand, env, lanes)
+            if type(operand) is not IntVec:
+                raise TypeError("Can only shift integers")
+            if treeNode.amt >= operand.width:
+                return IntVec(operand.width, np.zeros(n, dtype=np.uint64))
+            amt = np.uint64(treeNode.amt)
+            if type(treeNode) is node.LeftShiftNode:
+                return IntVec(operand.width, operand.val << amt)
+            return IntVec(operand.width, operand.val >> amt)
+
+        elif isinstance(treeNode, node.BinaryNode):
+            left = self.recurseTree(treeNode.left, env, lanes)
+            right = self.recurseTree(treeNode.right, env, lanes)
+            return self.binaryOp(treeNode, left, right)
+
+        elif isinstance(treeNode, node.AssignNode):
+            # A loop rather than recursion down the chain of `let`s, since
+            # generated programs can have thousands of them
+            while isinstance(treeNode, node.AssignNode):
+                env[treeNode.ident] = self.recurseTree(treeNode.val, env, lanes)
+                treeNode = treeNode.rest
+            return self.recurseTree(treeNode, env, lanes)
+
+        elif isinstance(treeNode, node.IfNode):
+            cond = self.recurseTree(treeNode.cond, env, lanes)
+            if type(cond) is not BoolVec:
+                raise TypeError("Condition must be BoolType")
+            cond = cond.val
+            if cond.all():
+                return self.recurseTree(treeNode.true_expr, env, lanes)
+            if not cond.any():
+                return self.recurseTree(treeNode.false_expr, env, lanes)
+
+            # Only run each branch on the lanes that take it, so that
+            # observations and recursive calls in the other branch are skipped
+            true_env = {ident: _take(val, cond) for ident, val in env.items()}
+            false_env = {ident: _take(val, ~cond) for ident, val in env.items()}
+            true_vec = self.recurseTree(treeNode.true_expr, true_env, lanes[cond])
+            false_vec = self.recurseTree(treeNode.false_expr, false_env, lanes[~cond])
+            return _merge(cond, true_vec, false_vec)
+
+        elif type(treeNode) is node.ObserveNode:
+            observation = self.recurseTree(treeNode.observation, env, lanes)
+            if type(observation) is not BoolVec:
+                raise TypeError("Can't observe a non-bool type")
+            self.observe_ok[lanes[~observation.val]] = False
+            return BoolVec(np.ones(n, dtype=bool))
+
+        elif type(treeNode) is node.TupleNode:
+            left = self.recurseTree(treeNode.left, env, lanes)
+            right = self.recurseTree(treeNode.right, env, lanes)
+            return TupleVec(left, right)
+
+        elif type(treeNode) is node.FstNode:
+            tup = self.recurseTree(treeNode.tup, env, lanes)
+            if type(tup) is not TupleVec:
+                raise Exception("`fst` can only be used on tuples")
+            return tup.left
+
+        elif type(treeNode) is node.SndNode:
+            tup = self.recurseTree(treeNode.tup, env, lanes)
+            if type(tup) is not TupleVec:
+                raise Exception("`snd` can only be used on tuples")
+            return tup.right
+
+        elif type(treeNode) in (node.ListNode, node.HeadNode, node.TailNode,
+                                node.LengthNode):
+            raise NotImplementedError("The vectorized sampler does not support lists")
+
+        else:
+            raise Exception("Tree Node Unknown:", treeNode)
+
+    def binaryOp(self, treeNode, left, right):
+        if type(treeNode) is node.AndNode:
+            _verify_bools(left, right)
+            return BoolVec(left.val & right.val)
+
+        elif type(treeNode) is node.OrNode:
+            _verify_bools(left, right)
+            return BoolVec(left.val | right.val)
+
+        elif type(treeNode) is node.EqualNode:
+            return BoolVec(_equal(left, right))
+
+        elif type(treeNode) is node.LessThanNode:
+            _verify_ints(left, right)
+            return BoolVec(left.val < right.val)
+
+        elif type(treeNode) is node.AddNode:
+            _verify_ints(left, right)
+            return IntVec(left.width, left.val + right.val)
+
+        elif type(treeNode) is node.SubNode:
+            _verify_ints(left, right)
+            return IntVec(left.width, left.val - right.val)
+
+        elif type(treeNode) is node.MulNode:
+            _verify_ints(left, right)
+            return IntVec(left.width, left.val * right.val)
+
+        elif type(treeNode) is node.DivNode:
+            _verify_ints(left, right)
+            if (right.val == 0).any():
+                raise ZeroDivisionError("integer division or modulo by zero")
+            return IntVec(left.width, left.val // right.val)
+
+        elif type(treeNode) is node.NthBitNode:
+            if type(left) is not IntVec or type(right) is not IntVec:
+                raise TypeError("nth_bit can only take IntTypes")
+            # Bits are indexed from the MSB, like NthBitNode.nth_bit
+            in_range = left.val < np.uint64(right.width)
+            idx = np.where(in_range, np.uint64(right.width - 1) - left.val, 0)
+            bits = (right.val >> idx.astype(np.uint64)) & np.uint64(1)
+            return BoolVec(in_range & (bits == 1))
+
+        elif type(treeNode) is node.ConcatNode:
+            raise NotImplementedError("The vectorized sampler does not support lists")
+
+        else:
+            raise Exception("Tree Node Unknown:", treeNode)